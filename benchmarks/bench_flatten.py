@@ -0,0 +1,66 @@
+"""
+Compare the single-pass columnar flattening (extract.flatten_tracks + transform.create_dfs_from_columns)
+with the previous per-entity functions (get_*_from_tracks + create_*_df)
+
+Usage:
+    python -m benchmarks.bench_flatten [--pages 20] [--repeat 5]
+"""
+import argparse
+from time import perf_counter
+from utils.pipeline import Extract, Transform
+from benchmarks.synthetic import Catalog, GENRES
+
+
+def previous_path(tracks):
+    track_df = Transform.create_track_df(Extract.get_track_details_from_tracks(tracks))
+    album_df = Transform.create_album_df(Extract.get_album_details_from_tracks(tracks))
+    artist_track_df = Transform.create_artist_track_df(Extract.get_artist_track_from_tracks(tracks))
+    artist_album_df = Transform.create_artist_album_df(Extract.get_artist_album_dict_from_tracks(tracks))
+    track_album_df = Transform.create_track_album_df(Extract.get_track_album_from_tracks(tracks))
+    artist_ids = Extract.get_artist_ids_from_tracks(tracks)
+    return track_df, album_df, artist_track_df, artist_album_df, track_album_df, artist_ids
+
+def columnar_path(tracks):
+    columns = Extract.flatten_tracks(tracks)
+    artist_ids = columns.pop("artist_ids")
+    dfs = Transform.create_dfs_from_columns(columns=columns, artist_details=[], artist_genre={})
+    return dfs["track"], dfs["album"], dfs["artist_track"], dfs["artist_album"], dfs["track_album"], artist_ids
+
+def best_of(function, tracks, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = perf_counter()
+        function(tracks)
+        timings.append(perf_counter() - start_time)
+    return min(timings)
+
+def check_same_rows(previous, columnar):
+    names = ["track", "album", "artist_track", "artist_album", "track_album"]
+    for name, previous_df, columnar_df in zip(names, previous[:5], columnar[:5]):
+        key = list(columnar_df.columns[:2]) if name not in ("track", "album") else ["id"]
+        if set(map(tuple, previous_df[key].drop_duplicates().values)) != set(map(tuple, columnar_df[key].drop_duplicates().values)):
+            raise AssertionError(f"{name} rows differ")
+    if set(previous[5]) != set(columnar[5]):
+        raise AssertionError("artist ids differ")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=76, help="search pages of 50 tracks, 19 per genre")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    catalog = Catalog(n_tracks=20000, n_artists=2000)
+    pages = [catalog.search(GENRES[page // 19 % len(GENRES)], offset=page % 19 * 50, limit=50) for page in range(args.pages)]
+    tracks = Extract.merge_track_pages(pages)
+    check_same_rows(previous_path(tracks), columnar_path(tracks))
+
+    previous = best_of(previous_path, tracks, args.repeat)
+    columnar = best_of(columnar_path, tracks, args.repeat)
+    items = len(tracks["items"])
+    print(f"items: {items}")
+    print(f"previous: {previous*1000:.1f} ms ({items/previous:.0f} items/s)")
+    print(f"columnar: {columnar*1000:.1f} ms ({items/columnar:.0f} items/s)")
+    print(f"speedup: {previous/columnar:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Start-up benchmark of the command line: runs each command in a fresh interpreter with `python -X importtime`
+against a throwaway SQLite database and reports the wall time, the total import time and the heaviest imports.
+"import pipeline" imports every pipeline module, i.e. what any command paid before imports were lazy.
+
+Usage:
+    python -m benchmarks.bench_import [--repeat 5] [--top 5] [--json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "--help":["main.py", "--help"],
+    "status":["main.py", "status"],
+    "dry-run":["main.py", "dry-run"],
+    "import pipeline":["-c", "from utils.pipeline import Extract, Transform, Load, Crawl, Stream, Refresh"],
+}
+
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_import_times(stderr:str):
+    """
+    Parse the -X importtime report
+
+    Returns:
+        (total, modules) (tuple): Cumulative microseconds of the top-level imports, and cumulative microseconds per module
+    """
+    total = 0
+    modules = {}
+    for line in stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, module = int(match.group(2)), len(match.group(3)), match.group(4)
+        modules[module] = cumulative
+        if indent == 1:
+            total += cumulative
+    return total, modules
+
+def run_command(arguments, env):
+    start_time = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", *arguments], cwd=ROOT, env=env, capture_output=True, text=True)
+    duration = time.perf_counter() - start_time
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(arguments)} failed:\n{process.stderr[-2000:]}")
+    total, modules = parse_import_times(process.stderr)
+    return duration, total, modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per command, the median is reported")
+    parser.add_argument("--top", type=int, default=5, help="heaviest imports listed per command")
+    parser.add_argument("--json", action="store_true", help="print one JSON record per command")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="spotify_etl_bench_")
+    env = {
+        **os.environ,
+        "DB_URL":f"sqlite:///{os.path.join(workdir, 'bench.sqlite3')}",
+        "METRICS_DIR":workdir,
+        "LOG_DIR":os.path.join(workdir, "log"),
+    }
+    subprocess.run([sys.executable, "-c", "from utils import database; database.create_tables(database.get_engine())"],
+                   cwd=ROOT, env=env, check=True, capture_output=True)
+
+    results = []
+    for name, arguments in COMMANDS.items():
+        runs = [run_command(arguments, env) for _ in range(max(1, args.repeat))]
+        durations = [duration for duration, _, _ in runs]
+        totals = [total for _, total, _ in runs]
+        modules = runs[-1][2]
+        heaviest = sorted(((module, cumulative) for module, cumulative in modules.items() if "." not in module), key=lambda item: -item[1])[:args.top]
+        results.append({
+            "command":name,
+            "wall_ms":round(statistics.median(durations) * 1000, 1),
+            "import_ms":round(statistics.median(totals) / 1000, 1),
+            "heaviest":{module:round(cumulative / 1000, 1) for module, cumulative in heaviest},
+        })
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    print(f"{'command':<16} {'wall ms':>8} {'import ms':>9}  heaviest imports (ms)")
+    for result in results:
+        heaviest = ", ".join(f"{module} {cumulative}" for module, cumulative in result["heaviest"].items())
+        print(f"{result['command']:<16} {result['wall_ms']:>8.1f} {result['import_ms']:>9.1f}  {heaviest}")
+
+if __name__ == "__main__":
+    main()
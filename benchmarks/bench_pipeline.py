@@ -0,0 +1,135 @@
+"""
+End-to-end pipeline benchmark against the local fake Spotify API (benchmarks/fake_spotify.py)
+and a throwaway SQLite database, or any database given with --db-url (its pipeline tables are recreated).
+
+Reports per run: tracks loaded per second, HTTP calls per loaded track and peak RSS of the pipeline process.
+The fake server runs in a separate process so its catalog does not count in the RSS.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--tracks 5000] [--pages 8] [--runs 3] [--mode batch|stream]
+                                        [--latency-ms 20] [--rate-limit-probability 0.02] [--db-url URL] [--json]
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_fake_spotify(args) -> tuple:
+    port = get_free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_spotify", "--port", str(port), "--tracks", str(args.tracks),
+         "--artists", str(args.artists), "--latency-ms", str(args.latency_ms),
+         "--rate-limit-probability", str(args.rate_limit_probability)],
+        stdout=subprocess.PIPE, text=True
+    )
+    process.stdout.readline()
+    return process, f"http://127.0.0.1:{port}"
+
+def get_server_requests(url:str) -> int:
+    with urllib.request.urlopen(f"{url}/__stats") as response:
+        return sum(json.load(response).values())
+
+def get_peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=5000, help="catalog size of the fake API")
+    parser.add_argument("--artists", type=int, default=500)
+    parser.add_argument("--pages", type=int, default=8, help="search pages of 50 tracks per run")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--mode", choices=["batch", "stream"], default="batch")
+    parser.add_argument("--genres", default="dubstep,house")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--client-rate-limit", type=float, default=1000.0, help="client-side requests per second")
+    parser.add_argument("--db-url", default=None, help="defaults to a temporary SQLite file")
+    parser.add_argument("--json", action="store_true", help="print one JSON record per run")
+    args = parser.parse_args()
+
+    server, server_url = start_fake_spotify(args)
+    workdir = tempfile.mkdtemp(prefix="spotify_etl_bench_")
+    os.environ.update({
+        "SPOTIFY_API_URL":f"{server_url}/v1",
+        "SPOTIFY_ACCOUNTS_URL":server_url,
+        "SPOTIFY_CLIENT_ID":"bench",
+        "SPOTIFY_CLIENT_SECRET":"bench",
+        "SPOTIFY_RATE_LIMIT_PER_SECOND":str(args.client_rate_limit),
+        "SPOTIFY_RATE_LIMIT_BURST":str(max(10, int(args.client_rate_limit))),
+        "SPOTIFY_BACKOFF_BASE":"0.01",
+        "METADATA_CACHE_PATH":os.path.join(workdir, "metadata.sqlite3"),
+        "CRAWL_GENRES":args.genres,
+        "CRAWL_PAGES_PER_RUN":str(args.pages),
+        "DB_URL":args.db_url or f"sqlite:///{os.path.join(workdir, 'bench.sqlite3')}",
+    })
+    os.environ.pop("SPOTIFY_TOKEN_CACHE", None)
+
+    try:
+        #Imported after the environment is set, the pipeline reads its configuration at import
+        import sqlalchemy
+        import main as pipeline
+        from utils import database, logger
+        from utils.pipeline import Crawl, Stream
+
+        logger.setup_logging()
+
+        engine = database.get_engine()
+        database.create_tables(engine)
+
+        def count_tracks():
+            with engine.begin() as conn:
+                return conn.execute(sqlalchemy.text("SELECT count(*) FROM track")).scalar()
+
+        results = []
+        for run in range(1, args.runs + 1):
+            tracks_before, requests_before = count_tracks(), get_server_requests(server_url)
+            start_time = time.perf_counter()
+            if args.mode == "stream":
+                Stream.run_streaming(engine=engine, pages=args.pages)
+            else:
+                extract_result = pipeline.extract_task(engine=engine)
+                transform_result = pipeline.transform_task(extract_result=extract_result, engine=engine)
+                if pipeline.load_task(transform_result=transform_result, engine=engine) is None:
+                    raise RuntimeError("Load failed")
+                Crawl.save_checkpoints(engine=engine, checkpoints=extract_result["checkpoints"])
+            duration = time.perf_counter() - start_time
+            tracks = count_tracks() - tracks_before
+            http_calls = get_server_requests(server_url) - requests_before
+            results.append({
+                "run":run,
+                "mode":args.mode,
+                "tracks":tracks,
+                "duration":round(duration, 4),
+                "tracks_per_second":round(tracks / duration, 1) if duration else 0.0,
+                "http_calls":http_calls,
+                "http_calls_per_track":round(http_calls / tracks, 3) if tracks else None,
+                "peak_rss_mb":round(get_peak_rss_mb(), 1),
+            })
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    print(f"{'run':>3} {'tracks':>7} {'seconds':>8} {'tracks/s':>9} {'http calls':>10} {'calls/track':>11} {'peak RSS MB':>11}")
+    for result in results:
+        print(f"{result['run']:>3} {result['tracks']:>7} {result['duration']:>8.3f} {result['tracks_per_second']:>9.1f} "
+              f"{result['http_calls']:>10} {str(result['http_calls_per_track']):>11} {result['peak_rss_mb']:>11.1f}")
+
+if __name__ == "__main__":
+    main()
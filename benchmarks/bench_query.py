@@ -0,0 +1,202 @@
+"""
+Read-side benchmark over a synthetic catalog loaded straight into a throwaway SQLite database:
+latency of the query API (database.aggregates) without and with the read indexes, the full rebuild
+of the aggregates, reading a genre from genre_stats against computing it live, and the incremental
+refresh of the aggregates after a run adds --run-tracks tracks, checked against a full rebuild
+
+Usage:
+    python -m benchmarks.bench_query [--tracks 1000000] [--run-tracks 1000] [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+import sqlalchemy
+from utils import database
+from utils.database import aggregates
+
+#Enough genres for selective queries, unlike the 8 genres crawled by the pipeline
+N_GENRES = 400
+CHUNK_SIZE = 100000
+
+#Genre aggregate computed from the link tables, what a query would cost without genre_stats
+LIVE_GENRE_STATS = (
+    'SELECT gt."genre", COUNT(*), SUM(t."duration_ms"), SUM(CASE WHEN t."explicit" THEN 1 ELSE 0 END) '
+    'FROM (SELECT DISTINCT ag."genre", at."track_id" FROM "artist_genre" ag JOIN "artist_track" at ON at."artist_id" = ag."artist_id" '
+    'WHERE ag."genre" = :genre) gt JOIN "track" t ON t."id" = gt."track_id" GROUP BY gt."genre"'
+)
+
+
+def generate_catalog(path:str, n_tracks:int, seed:int=42, first_track:int=0, n_artists:int=None):
+    """
+    Insert a catalog of n_tracks tracks, n_tracks / 4 albums and n_tracks / 10 artists.
+    Tracks have 1 to 3 artists and artists 0 to 3 genres. With first_track, only adds the tracks
+    first_track to first_track + n_tracks to an existing catalog of n_artists artists, like a run
+
+    Returns:
+        row_counts (Dict[str,int]): Rows inserted per table
+    """
+    rng = random.Random(seed)
+    n_albums = max(1, n_tracks // 4)
+    new_artists = n_artists is None
+    n_artists = n_artists or max(1, n_tracks // 10)
+    genres = [f"genre {index}" for index in range(N_GENRES)]
+    start_date = datetime(2000, 1, 1)
+    row_counts = dict.fromkeys(["artist", "album", "track", "artist_genre", "artist_track", "artist_album", "track_album"], 0)
+    conn = sqlite3.connect(path)
+
+    def insert(table_name, rows):
+        if rows:
+            #Rows give the leading columns of the table, the enrichment columns stay NULL
+            column_names = [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')][:len(rows[0])]
+            column_list = ", ".join(f'"{column}"' for column in column_names)
+            conn.executemany(f'INSERT OR IGNORE INTO "{table_name}" ({column_list}) VALUES ({", ".join("?" * len(rows[0]))})', rows)
+            row_counts[table_name] += len(rows)
+
+    if new_artists:
+        insert("artist", [(f"ar{index}", f"Artist {index}", f"https://open.spotify.com/artist/ar{index}", None, None, None, start_date.isoformat())
+                          for index in range(n_artists)])
+        insert("artist_genre", [(f"ar{index}", genre) for index in range(n_artists) for genre in rng.sample(genres, k=rng.randint(0, 3))])
+    album_artists = [rng.randrange(n_artists) for _ in range(n_albums)]
+    insert("album", [(f"al{first_track}-{index}", f"Album {index}", (start_date + timedelta(days=rng.randrange(9000))).isoformat(),
+                      f"https://open.spotify.com/album/al{index}", 4, "album", None, None, None, start_date.isoformat())
+                     for index in range(n_albums)])
+    insert("artist_album", [(f"ar{artist}", f"al{first_track}-{index}") for index, artist in enumerate(album_artists)])
+    for chunk_start in range(first_track, first_track + n_tracks, CHUNK_SIZE):
+        tracks, artist_tracks, track_albums = [], [], []
+        for index in range(chunk_start, min(first_track + n_tracks, chunk_start + CHUNK_SIZE)):
+            album = rng.randrange(n_albums)
+            tracks.append((f"tr{index}", f"Track {index}", f"https://open.spotify.com/track/tr{index}", rng.randint(60000, 600000),
+                           (start_date + timedelta(days=rng.randrange(9000))).isoformat(), False, rng.random() < 0.2))
+            track_albums.append((f"tr{index}", f"al{first_track}-{album}"))
+            artist_ids = {album_artists[album]} | {rng.randrange(n_artists) for _ in range(rng.choice([0, 0, 0, 1, 2]))}
+            artist_tracks.extend((f"ar{artist}", f"tr{index}") for artist in artist_ids)
+        insert("track", tracks)
+        insert("artist_track", artist_tracks)
+        insert("track_album", track_albums)
+    conn.commit()
+    conn.close()
+    return row_counts
+
+def best_of(function, repeat:int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start_time = perf_counter()
+        function()
+        timings.append(perf_counter() - start_time)
+    return min(timings)
+
+def timed_once(function) -> float:
+    start_time = perf_counter()
+    function()
+    return perf_counter() - start_time
+
+def get_all_stats(engine):
+    with engine.connect() as conn:
+        return (conn.execute(sqlalchemy.text('SELECT "genre", "track_count", "total_duration_ms", "explicit_count" FROM "genre_stats" ORDER BY "genre"')).fetchall(),
+                conn.execute(sqlalchemy.text('SELECT "artist_id", "album_count", "track_count" FROM "artist_stats" ORDER BY "artist_id"')).fetchall())
+
+def drop_read_indexes(engine):
+    with engine.begin() as conn:
+        for index_name in aggregates.READ_INDEXES:
+            conn.execute(sqlalchemy.text(f'DROP INDEX IF EXISTS "{index_name}"'))
+
+def bench_reads(engine, genres, artist_ids, repeat):
+    def tracks_by_genre():
+        for genre in genres:
+            aggregates.get_tracks_by_genre(engine, genre, limit=100)
+
+    def albums_by_artist():
+        for artist_id in artist_ids:
+            aggregates.get_albums_by_artist(engine, artist_id)
+    return {
+        "tracks_by_genre":best_of(tracks_by_genre, repeat) / len(genres),
+        "albums_by_artist":best_of(albums_by_artist, repeat) / len(artist_ids),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=1000000, help="tracks of the catalog, defaults to 1,000,000")
+    parser.add_argument("--run-tracks", type=int, default=1000, help="tracks added by a run, refreshed incrementally")
+    parser.add_argument("--queries", type=int, default=20, help="genres and artists queried")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "catalog.sqlite3")
+        engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+        database.create_tables(engine)
+        drop_read_indexes(engine)
+
+        start_time = perf_counter()
+        row_counts = generate_catalog(path, args.tracks)
+        generate_duration = perf_counter() - start_time
+
+        rng = random.Random(7)
+        n_artists = row_counts["artist"]
+        genres = rng.sample([f"genre {index}" for index in range(N_GENRES)], k=min(args.queries, N_GENRES))
+        artist_ids = [f"ar{rng.randrange(n_artists)}" for _ in range(args.queries)]
+
+        #get_tracks_by_genre reads genre_track, filled by the rebuild
+        aggregates.ensure_aggregate_tables(engine)
+        rebuild = timed_once(lambda: aggregates.rebuild_aggregates(engine))
+        drop_read_indexes(engine)
+
+        without_indexes = bench_reads(engine, genres, artist_ids, repeat=1)
+        create_indexes = timed_once(lambda: aggregates.ensure_aggregate_tables(engine))
+        with_indexes = bench_reads(engine, genres, artist_ids, repeat=args.repeat)
+
+        stats_read = best_of(lambda: aggregates.get_genre_stats(engine, genres=genres), args.repeat) / len(genres)
+
+        def live_genre_stats():
+            with engine.connect() as conn:
+                for genre in genres:
+                    conn.execute(sqlalchemy.text(LIVE_GENRE_STATS), {"genre":genre}).fetchall()
+        live_read = best_of(live_genre_stats, args.repeat) / len(genres)
+
+        #A run: new tracks and albums of existing artists, then the aggregates of these artists
+        generate_catalog(path, args.run_tracks, seed=1, first_track=args.tracks, n_artists=n_artists)
+        with engine.connect() as conn:
+            batch = [row[0] for row in conn.execute(sqlalchemy.text(
+                'SELECT "artist_id" FROM "artist_track" WHERE "track_id" IN (SELECT "id" FROM "track" WHERE "rowid" > :track_rowid) '
+                'UNION SELECT "artist_id" FROM "artist_album" WHERE "album_id" IN (SELECT "id" FROM "album" WHERE "rowid" > :album_rowid)'
+            ), {"track_rowid":row_counts["track"], "album_rowid":row_counts["album"]})]
+        incremental = timed_once(lambda: aggregates.refresh_aggregates(engine, artist_ids=batch))
+        incremental_stats = get_all_stats(engine)
+        aggregates.rebuild_aggregates(engine)
+        if incremental_stats != get_all_stats(engine):
+            raise AssertionError("Incrementally refreshed aggregates differ from a rebuild")
+        engine.dispose()
+
+    results = {
+        "rows":row_counts,
+        "generate_s":generate_duration,
+        "create_indexes_s":create_indexes,
+        "tracks_by_genre_ms":{"without_indexes":without_indexes["tracks_by_genre"] * 1000, "with_indexes":with_indexes["tracks_by_genre"] * 1000},
+        "albums_by_artist_ms":{"without_indexes":without_indexes["albums_by_artist"] * 1000, "with_indexes":with_indexes["albums_by_artist"] * 1000},
+        "rebuild_aggregates_s":rebuild,
+        "genre_stats_ms":{"aggregate":stats_read * 1000, "live":live_read * 1000},
+        "incremental_refresh_s":{"tracks":args.run_tracks, "artists":len(batch), "duration":incremental},
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("rows: " + ", ".join(f"{table_name} {total_records}" for table_name, total_records in row_counts.items()))
+    print(f"generate: {generate_duration:.1f}s, create read indexes: {create_indexes:.2f}s")
+    for name in ["tracks_by_genre_ms", "albums_by_artist_ms"]:
+        timings = results[name]
+        print(f"{name[:-3]}: {timings['without_indexes']:.2f}ms without indexes, {timings['with_indexes']:.2f}ms with indexes "
+              f"({timings['without_indexes'] / timings['with_indexes']:.0f}x)")
+    print(f"rebuild aggregates: {rebuild:.2f}s")
+    print(f"genre stats: {stats_read * 1000:.3f}ms from genre_stats, {live_read * 1000:.2f}ms computed live")
+    print(f"incremental refresh after a run of {args.run_tracks} tracks ({len(batch)} artists): {incremental:.3f}s "
+          f"({incremental / rebuild:.1%} of a rebuild), same aggregates as a rebuild")
+
+
+if __name__ == "__main__":
+    main()
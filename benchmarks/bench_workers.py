@@ -0,0 +1,119 @@
+"""
+Scale-out benchmark of the worker mode (pipeline.worker): crawls the fake Spotify API
+(benchmarks/fake_spotify.py) with 1, 2, 4... `main.py worker` processes sharing one database,
+each with its own metadata cache like workers on separate hosts. The database is a throwaway
+SQLite file, or any database given with --db-url (its pipeline tables are recreated before each run).
+
+Reports per worker count: tracks loaded per second, and the search and artist calls received by the
+fake API against the work items, which shows whether any page or artist batch was fetched twice.
+
+Usage:
+    python -m benchmarks.bench_workers [--workers 1,2,4] [--genres dubstep,house,techno] [--latency-ms 50]
+                                       [--client-rate-limit 1000] [--db-url URL] [--json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from benchmarks.bench_pipeline import start_fake_spotify
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_server_stats(url:str) -> dict:
+    with urllib.request.urlopen(f"{url}/__stats") as response:
+        return json.load(response)
+
+def run_workers(n_workers:int, env:dict, workdir:str) -> float:
+    """Start n_workers worker processes and wait for all of them. Returns the wall time"""
+    start_time = time.perf_counter()
+    processes = [
+        subprocess.Popen([sys.executable, "main.py", "worker"], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         env={**env, "METADATA_CACHE_PATH":os.path.join(workdir, f"metadata_{n_workers}_{index}.sqlite3")})
+        for index in range(n_workers)
+    ]
+    for process in processes:
+        if process.wait() != 0:
+            raise RuntimeError(f"Worker exited with {process.returncode}")
+    return time.perf_counter() - start_time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--tracks", type=int, default=5000, help="catalog size of the fake API")
+    parser.add_argument("--artists", type=int, default=500)
+    parser.add_argument("--genres", default="dubstep,house,techno")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--client-rate-limit", type=float, default=1000.0, help="requests per second shared by all workers")
+    parser.add_argument("--db-url", default=None, help="defaults to a temporary SQLite file per run")
+    parser.add_argument("--json", action="store_true", help="print one JSON record per worker count")
+    args = parser.parse_args()
+
+    server, server_url = start_fake_spotify(args)
+    workdir = tempfile.mkdtemp(prefix="spotify_etl_workers_")
+    env = {
+        **os.environ,
+        "SPOTIFY_API_URL":f"{server_url}/v1",
+        "SPOTIFY_ACCOUNTS_URL":server_url,
+        "SPOTIFY_CLIENT_ID":"bench",
+        "SPOTIFY_CLIENT_SECRET":"bench",
+        "SPOTIFY_RATE_LIMIT_PER_SECOND":str(args.client_rate_limit),
+        "SPOTIFY_RATE_LIMIT_BURST":str(max(10, int(args.client_rate_limit))),
+        "SPOTIFY_BACKOFF_BASE":"0.01",
+        "CRAWL_GENRES":args.genres,
+        "WORKER_POLL_INTERVAL":"0.2",
+        "LOG_DIR":os.path.join(workdir, "log"),
+        "METRICS_DIR":os.path.join(workdir, "log"),
+    }
+    env.pop("SPOTIFY_TOKEN_CACHE", None)
+
+    try:
+        import sqlalchemy
+        from utils import database
+
+        results = []
+        for n_workers in [int(value) for value in args.workers.split(",")]:
+            env["DB_URL"] = args.db_url or f"sqlite:///{os.path.join(workdir, f'bench_{n_workers}.sqlite3')}"
+            engine = sqlalchemy.create_engine(env["DB_URL"])
+            database.create_tables(engine)
+            requests_before = get_server_stats(server_url)
+            duration = run_workers(n_workers, env, workdir)
+            requests_after = get_server_stats(server_url)
+            calls = {route:requests_after.get(route, 0) - requests_before.get(route, 0) for route in requests_after}
+            with engine.connect() as conn:
+                tracks = conn.execute(sqlalchemy.text('SELECT count(*) FROM "track"')).scalar()
+                items = dict(conn.execute(sqlalchemy.text(
+                    'SELECT "kind", count(*) FROM "work_item" WHERE "status" = \'done\' GROUP BY "kind"'
+                )).fetchall())
+            engine.dispose()
+            results.append({
+                "workers":n_workers,
+                "tracks":tracks,
+                "duration":round(duration, 3),
+                "tracks_per_second":round(tracks / duration, 1) if duration else 0.0,
+                "search_items":items.get("search", 0),
+                "search_calls":calls.get("GET /v1/search", 0),
+                "artist_items":items.get("artists", 0),
+                "artist_calls":calls.get("GET /v1/artists", 0),
+            })
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    print(f"{'workers':>7} {'tracks':>7} {'seconds':>8} {'tracks/s':>9} {'speedup':>7} {'search items/calls':>18} {'artist items/calls':>18}")
+    for result in results:
+        speedup = result["tracks_per_second"] / results[0]["tracks_per_second"] if results[0]["tracks_per_second"] else 0.0
+        print(f"{result['workers']:>7} {result['tracks']:>7} {result['duration']:>8.3f} {result['tracks_per_second']:>9.1f} {speedup:>6.2f}x "
+              f"{result['search_items']:>8}/{result['search_calls']:<9} {result['artist_items']:>8}/{result['artist_calls']:<9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Local stand-in for the Spotify Web API and accounts service, serving a synthetic catalog.
+
+Supported routes:
+    POST /api/token           client credentials token
+    GET  /v1/search           q=genre:<genre> [year:<from>-<to>], type=track, offset, limit
+    GET  /v1/artists?ids=     up to 50 artists, null for unknown ids
+    GET  /v1/artists/{id}     single artist
+    GET  /v1/albums?ids=      up to 20 full albums, null for unknown ids
+    GET  /v1/tracks?ids=      up to 50 full tracks, null for unknown ids
+    GET  /__stats             requests served per route, not counted itself
+
+Point the pipeline at it with SPOTIFY_API_URL=http://host:port/v1 and SPOTIFY_ACCOUNTS_URL=http://host:port
+
+Usage:
+    python -m benchmarks.fake_spotify [--port 8765] [--tracks 5000] [--latency-ms 20] [--rate-limit-probability 0.05]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from benchmarks.synthetic import Catalog
+
+_SPOTIFY_ID_PATTERN = re.compile(r"^[0-9A-Za-z]{22}$")
+
+
+class FakeSpotifyServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the catalog and the behaviour settings
+
+    Params:
+        address (tuple): (host, port), port 0 picks a free port
+        catalog (Catalog): Synthetic catalog to serve
+        latency (float): Seconds added to every response
+        rate_limit_probability (float): Probability of answering 429 to an API request
+        retry_after (int): Retry-After header of 429 responses
+    """
+    daemon_threads = True
+
+    def __init__(self, address, catalog:Catalog, latency:float=0.0, rate_limit_probability:float=0.0, retry_after:int=0):
+        super().__init__(address, FakeSpotifyHandler)
+        self.catalog = catalog
+        self.latency = latency
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, route:str):
+        with self.lock:
+            self.requests[route] += 1
+
+    def should_rate_limit(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.rate_limit_probability
+
+    def start(self):
+        """Serve in a daemon thread and return self"""
+        threading.Thread(target=self.serve_forever, name="fake-spotify", daemon=True).start()
+        return self
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server:FakeSpotifyServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status:int, body, headers:dict=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def get_route(self, path:str) -> str:
+        return "/".join("{id}" if _SPOTIFY_ID_PATTERN.match(segment) else segment for segment in path.split("/"))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        path = urlparse(self.path).path
+        self.server.count(f"POST {path}")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if path != "/api/token":
+            return self.send_json(404, {"error":{"status":404, "message":"Not found"}})
+        self.send_json(200, {"access_token":f"fake-{time.time_ns()}", "token_type":"Bearer", "expires_in":3600})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        route = self.get_route(url.path)
+        if route == "/__stats":
+            with self.server.lock:
+                return self.send_json(200, dict(self.server.requests))
+        self.server.count(f"GET {route}")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self.send_json(401, {"error":{"status":401, "message":"No token provided"}})
+        if self.server.should_rate_limit():
+            return self.send_json(429, {"error":{"status":429, "message":"API rate limit exceeded"}}, {"Retry-After":self.server.retry_after})
+
+        catalog = self.server.catalog
+        if route == "/v1/search":
+            filters = dict(re.findall(r"(\w+):(\S+)", query.get("q", [""])[0]))
+            offset, limit = int(query.get("offset", [0])[0]), int(query.get("limit", [20])[0])
+            if offset + limit > 1000:
+                return self.send_json(400, {"error":{"status":400, "message":"Invalid offset"}})
+            return self.send_json(200, {"tracks":catalog.search(filters.get("genre", ""), offset=offset, limit=limit, years=filters.get("year"))})
+        if route == "/v1/artists":
+            ids = query.get("ids", [""])[0].split(",")
+            if len(ids) > 50:
+                return self.send_json(400, {"error":{"status":400, "message":"Too many ids requested"}})
+            return self.send_json(200, {"artists":[catalog.artists.get(artist_id) for artist_id in ids]})
+        if route == "/v1/albums":
+            ids = query.get("ids", [""])[0].split(",")
+            if len(ids) > 20:
+                return self.send_json(400, {"error":{"status":400, "message":"Too many ids requested"}})
+            return self.send_json(200, {"albums":[catalog.get_album(album_id) if album_id in catalog.albums else None for album_id in ids]})
+        if route == "/v1/tracks":
+            ids = query.get("ids", [""])[0].split(",")
+            if len(ids) > 50:
+                return self.send_json(400, {"error":{"status":400, "message":"Too many ids requested"}})
+            return self.send_json(200, {"tracks":[catalog.get_track(track_id) if track_id in catalog.tracks else None for track_id in ids]})
+        if route == "/v1/artists/{id}":
+            artist = catalog.artists.get(url.path.rsplit("/", 1)[-1])
+            if artist is None:
+                return self.send_json(404, {"error":{"status":404, "message":"Resource not found"}})
+            return self.send_json(200, artist)
+        self.send_json(404, {"error":{"status":404, "message":"Service not found"}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tracks", type=int, default=5000, help="catalog size")
+    parser.add_argument("--artists", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=0)
+    args = parser.parse_args()
+
+    catalog = Catalog(n_tracks=args.tracks, n_artists=args.artists)
+    server = FakeSpotifyServer((args.host, args.port), catalog, latency=args.latency_ms / 1000,
+                               rate_limit_probability=args.rate_limit_probability, retry_after=args.retry_after)
+    print(f"Fake Spotify API on {server.url}/v1, accounts on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import random
+import string
+import zlib
+from typing import Dict, List
+
+GENRES = ["dubstep", "house", "techno", "drum and bass", "trance", "garage", "grime", "ambient"]
+
+
+def make_id(rng:random.Random) -> str:
+    """Returns a random 22 characters base62 id, like a Spotify ID"""
+    return "".join(rng.choices(string.ascii_letters + string.digits, k=22))
+
+def make_images(base_url:str, sizes:List[int]) -> List[Dict[str,any]]:
+    return [{"url":f"{base_url}/{size}", "height":size, "width":size} for size in sizes]
+
+class Catalog:
+    """
+    Deterministic synthetic Spotify catalog shaped like the Web API objects used by the pipeline
+
+    Params:
+        n_tracks (int): Number of tracks
+        n_artists (int): Number of artists
+        tracks_per_album (int): Average number of tracks per album
+        seed (int): Random seed
+    """
+    def __init__(self, n_tracks:int=5000, n_artists:int=500, tracks_per_album:int=4, seed:int=42):
+        rng = random.Random(seed)
+        self.artists = {}
+        for _ in range(n_artists):
+            artist_id = make_id(rng)
+            self.artists[artist_id] = {
+                "id":artist_id,
+                "name":f"Artist {artist_id[:6]}",
+                "type":"artist",
+                "external_urls":{"spotify":f"https://open.spotify.com/artist/{artist_id}"},
+                "genres":rng.sample(GENRES, k=rng.randint(0, 3)),
+                "images":make_images(f"https://i.scdn.co/image/{artist_id}", [640, 320, 160])[:rng.choice([0, 3, 3, 3])],
+                "popularity":rng.randint(0, 100),
+            }
+        artist_ids = list(self.artists)
+
+        self.albums = {}
+        self.tracks = {}
+        album = None
+        for _ in range(n_tracks):
+            if album is None or rng.random() < 1 / tracks_per_album:
+                album_id = make_id(rng)
+                precision = rng.choice(["year", "month", "day", "day", "day"])
+                year, month, day = rng.randint(1990, 2025), rng.randint(1, 12), rng.randint(1, 28)
+                release_date = {"year":f"{year}", "month":f"{year}-{month:02d}", "day":f"{year}-{month:02d}-{day:02d}"}[precision]
+                album_artists = rng.sample(artist_ids, k=rng.choice([1, 1, 1, 2]))
+                album = {
+                    "id":album_id,
+                    "name":f"Album {album_id[:6]}",
+                    "type":"album",
+                    "album_type":rng.choice(["album", "single", "compilation"]),
+                    "release_date":release_date,
+                    "release_date_precision":precision,
+                    "total_tracks":0,
+                    "external_urls":{"spotify":f"https://open.spotify.com/album/{album_id}"},
+                    "images":make_images(f"https://i.scdn.co/image/{album_id}", [640, 300, 64])[:rng.choice([0, 3, 3, 3])],
+                    "artists":[{"id":artist_id, "name":self.artists[artist_id]["name"]} for artist_id in album_artists],
+                    "label":f"Label {rng.randint(1, 200)}",
+                    "popularity":rng.randint(0, 100),
+                    "external_ids":{"upc":f"{zlib.crc32(album_id.encode()):012d}"},
+                }
+                self.albums[album_id] = album
+            track_id = make_id(rng)
+            track_artists = list(dict.fromkeys([album["artists"][0]["id"], *rng.sample(artist_ids, k=rng.choice([0, 0, 1]))]))
+            album["total_tracks"] += 1
+            self.tracks[track_id] = {
+                "id":track_id,
+                "name":f"Track {track_id[:6]}",
+                "type":"track",
+                "duration_ms":rng.randint(60000, 480000),
+                "explicit":rng.random() < 0.2,
+                "popularity":rng.randint(0, 100),
+                "disc_number":1,
+                "track_number":album["total_tracks"],
+                "external_ids":{"isrc":f"QZ{rng.randint(10**9, 10**10 - 1)}"},
+                "external_urls":{"spotify":f"https://open.spotify.com/track/{track_id}"},
+                "artists":[{"id":artist_id, "name":self.artists[artist_id]["name"]} for artist_id in track_artists],
+                "album_id":album["id"],
+            }
+        self.track_ids = list(self.tracks)
+
+    def get_track(self, track_id:str) -> Dict[str,any]:
+        """Full track object with its simplified album, as returned by search"""
+        track = dict(self.tracks[track_id])
+        album = {key:value for key, value in self.albums[track.pop("album_id")].items() if key not in ("label", "popularity", "external_ids")}
+        track["album"] = album
+        return track
+
+    def get_album(self, album_id:str) -> Dict[str,any]:
+        """Full album object, with the label, popularity and external ids that search results leave out"""
+        return self.albums[album_id]
+
+    def search(self, genre:str, offset:int, limit:int, years:str=None) -> Dict[str,any]:
+        """
+        Search page of tracks. Every genre sees the catalog in a different, stable order.
+        years ("2000-2009" or "2005") keeps only tracks whose album was released in that range
+        """
+        order = random.Random(genre).sample(range(len(self.track_ids)), k=len(self.track_ids))
+        if years:
+            first_year, _, last_year = years.partition("-")
+            first_year, last_year = int(first_year), int(last_year or first_year)
+            order = [index for index in order if first_year <= int(self.albums[self.tracks[self.track_ids[index]]["album_id"]]["release_date"][:4]) <= last_year]
+        total = min(len(order), 1000)
+        items = [self.get_track(self.track_ids[index]) for index in order[offset:min(offset + limit, total)]]
+        return {
+            "href":"",
+            "items":items,
+            "limit":limit,
+            "offset":offset,
+            "total":total,
+            "next":"next" if offset + limit < total else None,
+            "previous":None,
+        }
+
+    def search_pages(self, genre:str, pages:int, limit:int=50) -> List[Dict[str,any]]:
+        return [self.search(genre, offset=page*limit, limit=limit) for page in range(pages)]
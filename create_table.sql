@@ -9,6 +9,12 @@ DROP TABLE IF EXISTS "artist_album" CASCADE;
 
 DROP TABLE IF EXISTS "artist_genre" CASCADE;
 DROP TABLE IF EXISTS "track_album" CASCADE;
+DROP TABLE IF EXISTS "crawl_checkpoint" CASCADE;
+DROP TABLE IF EXISTS "genre_track" CASCADE;
+DROP TABLE IF EXISTS "genre_stats" CASCADE;
+DROP TABLE IF EXISTS "artist_stats" CASCADE;
+DROP TABLE IF EXISTS "work_item" CASCADE;
+DROP TABLE IF EXISTS "rate_budget" CASCADE;
 
 
 
@@ -21,7 +27,12 @@ CREATE TABLE "track" (
   "duration_ms" integer,
   "release_date" timestamp,
   "is_single" BOOLEAN,
-  "explicit" boolean
+  "explicit" boolean,
+  "popularity" integer,
+  "isrc" text,
+  "track_number" integer,
+  "disc_number" integer,
+  "enriched_at" timestamp
 );
 
 CREATE TABLE "album" (
@@ -33,7 +44,12 @@ CREATE TABLE "album" (
   "type" text,
   "image_640_url" text,
   "image_300_url" text,
-  "image_64_url" text
+  "image_64_url" text,
+  "fetched_at" timestamp,
+  "label" text,
+  "popularity" integer,
+  "upc" text,
+  "enriched_at" timestamp
 );
 
 CREATE TABLE "artist" (
@@ -42,29 +58,50 @@ CREATE TABLE "artist" (
   "url" text,
   "image_640_url" text,
   "image_320_url" text,
-  "image_160_url" text
+  "image_160_url" text,
+  "fetched_at" timestamp
 );
 
 CREATE TABLE "artist_track" (
-  "artist_id" text,
-  "track_id" text
+  "artist_id" text NOT NULL,
+  "track_id" text NOT NULL,
+  PRIMARY KEY ("artist_id", "track_id")
 );
 
 CREATE TABLE "artist_album" (
-  "artist_id" text,
-  "album_id" text
+  "artist_id" text NOT NULL,
+  "album_id" text NOT NULL,
+  PRIMARY KEY ("artist_id", "album_id")
 );
 
 CREATE TABLE "artist_genre" (
-  "artist_id" text,
-  "genre" text
+  "artist_id" text NOT NULL,
+  "genre" text NOT NULL,
+  PRIMARY KEY ("artist_id", "genre")
 );
 
 CREATE TABLE "track_album" (
-  "track_id" text,
-  "album_id" text
+  "track_id" text NOT NULL,
+  "album_id" text NOT NULL,
+  PRIMARY KEY ("track_id", "album_id")
 );
 
+CREATE INDEX "artist_fetched_at_idx" ON "artist" ("fetched_at");
+
+CREATE INDEX "album_fetched_at_idx" ON "album" ("fetched_at");
+
+CREATE INDEX "album_enriched_at_idx" ON "album" ("enriched_at");
+
+CREATE INDEX "track_enriched_at_idx" ON "track" ("enriched_at");
+
+CREATE INDEX "artist_track_track_id_idx" ON "artist_track" ("track_id");
+
+CREATE INDEX "artist_album_album_id_idx" ON "artist_album" ("album_id");
+
+CREATE INDEX "artist_genre_genre_idx" ON "artist_genre" ("genre");
+
+CREATE INDEX "track_album_album_id_idx" ON "track_album" ("album_id");
+
 ALTER TABLE "artist_track" ADD FOREIGN KEY ("artist_id") REFERENCES "artist" ("id");
 
 ALTER TABLE "artist_album" ADD FOREIGN KEY ("artist_id") REFERENCES "artist" ("id");
@@ -78,3 +115,62 @@ ALTER TABLE "artist_genre" ADD FOREIGN KEY ("artist_id") REFERENCES "artist" ("i
 ALTER TABLE "track_album" ADD FOREIGN KEY ("track_id") REFERENCES "track" ("id");
 
 ALTER TABLE "track_album" ADD FOREIGN KEY ("album_id") REFERENCES "album" ("id");
+
+
+CREATE TABLE "crawl_checkpoint" (
+  "genre" text NOT NULL,
+  "query_partition" text NOT NULL,
+  "next_offset" integer NOT NULL DEFAULT 0,
+  "exhausted" boolean NOT NULL DEFAULT FALSE,
+  "updated_at" timestamp,
+  PRIMARY KEY ("genre", "query_partition")
+);
+
+CREATE TABLE "genre_track" (
+  "genre" text NOT NULL,
+  "track_id" text NOT NULL,
+  PRIMARY KEY ("genre", "track_id")
+);
+
+CREATE TABLE "genre_stats" (
+  "genre" text PRIMARY KEY,
+  "track_count" integer NOT NULL DEFAULT 0,
+  "total_duration_ms" bigint NOT NULL DEFAULT 0,
+  "explicit_count" integer NOT NULL DEFAULT 0,
+  "updated_at" timestamp
+);
+
+CREATE TABLE "artist_stats" (
+  "artist_id" text PRIMARY KEY,
+  "album_count" integer NOT NULL DEFAULT 0,
+  "track_count" integer NOT NULL DEFAULT 0,
+  "updated_at" timestamp
+);
+
+CREATE INDEX "genre_stats_track_count_idx" ON "genre_stats" ("track_count");
+
+CREATE TABLE "work_item" (
+  "kind" text NOT NULL,
+  "item_key" text NOT NULL,
+  "partition_key" text,
+  "payload" text,
+  "status" text NOT NULL DEFAULT 'pending',
+  "attempts" integer NOT NULL DEFAULT 0,
+  "lease_owner" text,
+  "lease_expires_at" timestamp,
+  "last_error" text,
+  "created_at" timestamp,
+  "updated_at" timestamp,
+  PRIMARY KEY ("kind", "item_key")
+);
+
+CREATE INDEX "work_item_status_idx" ON "work_item" ("kind", "status", "created_at");
+
+CREATE INDEX "work_item_partition_idx" ON "work_item" ("kind", "partition_key", "status");
+
+CREATE TABLE "rate_budget" (
+  "name" text PRIMARY KEY,
+  "tokens" double precision NOT NULL,
+  "refilled_at" double precision NOT NULL,
+  "paused_until" double precision NOT NULL DEFAULT 0
+);
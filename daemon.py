@@ -0,0 +1,97 @@
+from time import time
+import os
+import random
+import signal
+import threading
+import sqlalchemy
+from utils import database, logger, spotify
+import main
+
+#Seconds between the start of two cycles, each delay randomized by +/- DAEMON_JITTER of it
+DAEMON_INTERVAL = float(os.getenv("DAEMON_INTERVAL", 3600))
+DAEMON_JITTER = float(os.getenv("DAEMON_JITTER", 0.1))
+#The interval is doubled after a cycle hit 429 responses, up to this factor, and halved back after a clean cycle
+DAEMON_MAX_BACKOFF_FACTOR = float(os.getenv("DAEMON_MAX_BACKOFF_FACTOR", 8))
+#Stop after this many cycles, 0 runs until SIGTERM
+DAEMON_MAX_CYCLES = int(os.getenv("DAEMON_MAX_CYCLES", 0))
+
+
+def get_rate_limited_count():
+    """Total number of 429 responses received by the Spotify client since the process started"""
+    return sum(counters["rate_limited"] for counters in spotify.client.get_stats().values())
+
+def get_delay(interval:float, backoff_factor:float, jitter:float=DAEMON_JITTER, elapsed:float=0.0):
+    """
+    Seconds to wait before the next cycle: the interval scaled by the backoff factor, randomized by
+    +/- jitter so that several daemons do not hit Spotify at the same time, minus the time the cycle took
+    """
+    delay = interval * backoff_factor
+    delay *= 1 + random.uniform(-jitter, jitter)
+    return max(0.0, delay - elapsed)
+
+def warm_up():
+    """Create the database pool, the Spotify token and the HTTP session once for every cycle"""
+    engine = database.get_engine()
+    with engine.connect() as conn:
+        conn.execute(sqlalchemy.text("SELECT 1"))
+    spotify.get_token()
+    spotify.client.get_session()
+    logger.info("Daemon warmed up database pool, Spotify token and HTTP session")
+
+def run_daemon(interval:float=DAEMON_INTERVAL, max_cycles:int=DAEMON_MAX_CYCLES, stop:threading.Event=None):
+    """
+    Run pipeline cycles (main.main) in the current process until stopped, reusing the engine,
+    the HTTP pool and the token between cycles. A cycle that fails is logged and the next one runs as planned.
+    SIGTERM and SIGINT let the running cycle finish and then stop the daemon
+
+    Params:
+        interval (float, optional): Seconds between cycles. Defaults to DAEMON_INTERVAL
+        max_cycles (int, optional): Number of cycles before stopping, 0 for no limit. Defaults to DAEMON_MAX_CYCLES
+        stop (threading.Event, optional): Event that stops the daemon. Defaults to a new event set by the signals
+
+    Returns:
+        cycles (int): Number of cycles run
+    """
+    if stop is None:
+        stop = threading.Event()
+        def handle_signal(signum, frame):
+            logger.info(f"Daemon received signal {signum}, stopping after the current cycle")
+            stop.set()
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
+
+    warm_up()
+    backoff_factor = 1.0
+    cycles = 0
+    while not stop.is_set():
+        rate_limited_before = get_rate_limited_count()
+        cycle_start_time = time()
+        try:
+            main.main()
+        except spotify.client.RateLimitError as err:
+            logger.error(f"Daemon cycle stopped by rate limit: {err}")
+        except Exception as err:
+            logger.error(f"Error in daemon cycle: {err}")
+        elapsed = time() - cycle_start_time
+        cycles += 1
+
+        rate_limited = get_rate_limited_count() - rate_limited_before
+        if rate_limited > 0:
+            backoff_factor = min(DAEMON_MAX_BACKOFF_FACTOR, backoff_factor * 2)
+        else:
+            backoff_factor = max(1.0, backoff_factor / 2)
+        if max_cycles and cycles >= max_cycles:
+            break
+
+        delay = get_delay(interval, backoff_factor, elapsed=elapsed)
+        logger.info(f"Daemon cycle {cycles} took {elapsed:.3f}s with {rate_limited} rate limited responses, next cycle in {delay:.1f}s")
+        stop.wait(delay)
+
+    logger.info(f"Daemon stopped after {cycles} cycles")
+    return cycles
+
+
+if __name__ == '__main__':
+    logger.setup_logging()
+    run_daemon()
+    print("ETL daemon stopped")
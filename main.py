@@ -1,112 +1,383 @@
-from utils import *
-from utils.pipeline import *
-from time import time
+import argparse
+import json
 import os
+import sys
+from datetime import datetime
+from time import time
+from typing import Dict, List
 
+#Only the light utils are imported here. pandas, SQLAlchemy and requests are imported by the commands
+#that need them, so `--help`, `status` and `dry-run` start without loading the whole pipeline
+from utils import logger, metrics
+
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "batch")
+PIPELINE_MODES = ["batch", "stream", "refresh", "worker"]
 
 
 def extract_task(engine):
+    from utils import spotify
+    from utils.pipeline import Crawl, Enrich, Extract
     #Spotify handler
     token = spotify.get_token()
-    #Database Session
-    offset = int(Extract.count_records(engine=engine,table_name="track"))
-    dupstep_tracks = Extract.get_tracks_by_genre(genre="dubstep", offset=offset, limit=20, token=token)
-    
-    
-    artist_ids = Extract.get_artist_ids_from_tracks(dupstep_tracks)
-    
-    artists = Extract.get_artist_details_from_ids(artist_ids, token=token)
-    aritst_genre = Extract.get_artist_genre_from_artist_details(artist_details=artists) 
-    artist_track = Extract.get_artist_track_from_tracks(tracks=dupstep_tracks)
-    artist_album = Extract.get_artist_album_dict_from_tracks(tracks=dupstep_tracks)
-    albums = Extract.get_album_details_from_tracks(tracks=dupstep_tracks)
-    tracks = Extract.get_track_details_from_tracks(tracks=dupstep_tracks)
-    track_album = Extract.get_track_album_from_tracks(tracks=dupstep_tracks)
-    
-    return {
-        "artist":artists, 
-        "artist_genre":aritst_genre, 
-        "artist_track":artist_track, 
-        "artist_album":artist_album, 
-        "albums":albums, 
-        "tracks":tracks, 
-        "track_album":track_album}
-    
+    #Crawl plan from the stored checkpoints
+    Crawl.ensure_checkpoint_table(engine=engine)
+    plan = Crawl.plan_pages(engine=engine)
+    if not plan:
+        logger.error("All crawl partitions are exhausted")
+        raise ValueError("All crawl partitions are exhausted")
+    pages = Crawl.fetch_pages(plan=plan, token=token)
+    genre_tracks = Extract.merge_track_pages([page["tracks"] for page in pages])
+    extract_result = Extract.extract_from_tracks(tracks=genre_tracks, token=token)
+    #Full album and track objects of the ids not stored yet, in batches of 20 albums and 50 tracks
+    if Enrich.ENRICH_ENABLED:
+        extract_result["enrichment"] = Enrich.get_enrichment(engine=engine, columns=extract_result["columns"], token=token)
+    extract_result["checkpoints"] = Crawl.get_next_checkpoints(pages)
+    extract_result["genre_track_ids"] = Crawl.get_genre_track_ids(pages)
+    return extract_result
+
 def transform_task(extract_result:Dict[str,any],engine):
-    artists, artist_genre, artist_track,artist_album,albums, tracks, track_album = extract_result.values()
-
-    artist_df = Transform.create_artist_df(artist_details=artists)
-    artist_genre_df = Transform.create_artist_genre_df(artist_genre=artist_genre)
-    artist_track_df = Transform.create_artist_track_df(artist_track=artist_track)
-    artist_album_df = Transform.create_artist_album_df(artist_album=artist_album)
-    album_df = Transform.create_album_df(album_details=albums)
-    track_df = Transform.create_track_df(track_details=tracks)
-    track_album_df = Transform.create_track_album_df(track_in_album=track_album)
-    
-    #filter duplicate
-    artist_df = Transform.filter_duplicate(df=artist_df,ids= Transform.get_existing_ids(engine=engine,table_name="artist"))
-    album_df = Transform.filter_duplicate(df=album_df,ids= Transform.get_existing_ids(engine=engine,table_name="album"))
-    track_df = Transform.filter_duplicate(df=track_df,ids= Transform.get_existing_ids(engine=engine,table_name="track"))
-    
+    from utils.pipeline import Load, Transform
+    #filter duplicate in Python only in append mode, in upsert mode the database skips existing ids itself
+    dfs = Transform.create_dfs(extract_result=extract_result, engine=engine, filter_existing=Load.LOAD_MODE == "append")
     return {
-        "dfs": [artist_df, album_df, track_df, artist_genre_df, artist_track_df, artist_album_df,track_album_df],
-        "tables": ["artist",'album','track','artist_genre','artist_track','artist_album','track_album']
+        "dfs": list(dfs.values()),
+        "tables": list(dfs.keys())
     }
 
-def load_task(transform_result:Dict[str,list], engine):
+def load_task(transform_result:Dict[str,list], engine, genre_track_ids:Dict[str,List[str]]=None):
+    from utils.pipeline import Load, Sink
     dfs, tables = transform_result.values()
-    for df,table in zip(dfs,tables):
+    dfs = dict(zip(tables, dfs))
+    #Partitioned sinks (Parquet) are written once per crawled genre, the database once per run
+    genre_dfs = Sink.split_dfs_by_genre(dfs, genre_track_ids) if genre_track_ids else {None:dfs}
+    load_result = {}
+    for sink in Sink.get_sinks(engine=engine):
         try:
-            Load.load_to_db(df=df,table_name=table,engine=engine)
+            if sink.partitioned:
+                load_result[sink.name] = {genre:sink.write(dfs=genre_dfs[genre], genre=genre) for genre in genre_dfs}
+            else:
+                load_result[sink.name] = sink.write(dfs=dfs)
         except Exception as err:
-            print(f"Error when loading to table {table}")
+            if sink.name != "database":
+                print(f"Error when writing to the {sink.name} sink")
+            elif Load.LOAD_STRATEGY == "parallel":
+                print("Error when loading to database, tables loaded before the error were kept")
+            else:
+                print("Error when loading to database, no table was changed")
             print(err)
             return
-    
+    return load_result
+
+
+def main(mode:str=PIPELINE_MODE):
+    from utils import database
+    from utils.pipeline import Crawl, Refresh, Stream, Worker
 
-def main():
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Pipeline mode {mode} is not supported")
+
+    #Per-run metrics, exported next to the logs
+    metrics.reset()
 
     #Database Session
     engine = database.get_engine()
-    
-    #Extract task
-    extract_start_time = time()
-    extract_result = extract_task(engine=engine)
-    extract_end_time = time()
-    
-    #Transform task
-    transform_start_time = time()
-    transform_result = transform_task(extract_result=extract_result,engine=engine)
-    transform_end_time = time()
-    
-    #Load task
-    load_start_time = time()
-    load_task(engine=engine, transform_result=transform_result)
-    load_end_time = time()
-    
-   
-        
+
+    if mode == "refresh":
+        try:
+            with metrics.span("pipeline"):
+                Refresh.run_refresh(engine=engine)
+        finally:
+            metrics.export_run()
+        return
+
+    if mode == "stream":
+        try:
+            with metrics.span("pipeline"):
+                Stream.run_streaming(engine=engine)
+        finally:
+            metrics.export_run()
+        return
+
+    if mode == "worker":
+        try:
+            with metrics.span("pipeline"):
+                Worker.run_worker(engine=engine)
+        finally:
+            metrics.export_run()
+        return
+
+    try:
+        #Extract task
+        extract_start_time = time()
+        with metrics.span("extract_task"):
+            extract_result = extract_task(engine=engine)
+        extract_end_time = time()
+
+        #Transform task
+        transform_start_time = time()
+        with metrics.span("transform_task"):
+            transform_result = transform_task(extract_result=extract_result,engine=engine)
+        transform_end_time = time()
+
+        #Load task
+        load_start_time = time()
+        with metrics.span("load_task"):
+            load_result = load_task(engine=engine, transform_result=transform_result, genre_track_ids=extract_result["genre_track_ids"])
+            if load_result is not None:
+                Crawl.save_checkpoints(engine=engine, checkpoints=extract_result["checkpoints"])
+        load_end_time = time()
+    finally:
+        metrics.export_run()
+
+
+
     extract_duration = extract_end_time - extract_start_time
     transform_duration = transform_end_time - transform_start_time
-    load_duration = load_end_time - load_start_time   
+    load_duration = load_end_time - load_start_time
     logger.info(f"Pipeline duration:{extract_duration + transform_duration + load_duration}")
     logger.info(f"Extract duration:{extract_duration}")
     logger.info(f"Transform duration:{transform_duration}")
     logger.info(f"Load duration:{load_duration}")
-    
 
-    
-    
 
-if __name__ == '__main__':
+def extract_only(output:str):
+    """Run the extract task and write its result to a JSON file, without loading it or moving the checkpoints"""
+    from utils import database
+    metrics.reset()
     try:
-        main()
+        with metrics.span("extract_task"):
+            extract_result = extract_task(engine=database.get_engine())
+    finally:
+        metrics.export_run()
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(extract_result, file)
+    print(f"Extracted {len(extract_result['columns']['track']['id'])} tracks to {output}")
+
+def load_from_file(path:str):
+    """Transform and load an extract result written by extract-only, then store its checkpoints"""
+    from utils import database
+    from utils.pipeline import Crawl
+    with open(path, "r", encoding="utf-8") as file:
+        extract_result = json.load(file)
+    engine = database.get_engine()
+    metrics.reset()
+    try:
+        with metrics.span("transform_task"):
+            transform_result = transform_task(extract_result=extract_result, engine=engine)
+        with metrics.span("load_task"):
+            load_result = load_task(engine=engine, transform_result=transform_result, genre_track_ids=extract_result.get("genre_track_ids"))
+    finally:
+        metrics.export_run()
+    if load_result is None:
+        raise ValueError(f"Could not load {path}")
+    Crawl.ensure_checkpoint_table(engine=engine)
+    Crawl.save_checkpoints(engine=engine, checkpoints=extract_result.get("checkpoints", []))
+    print(f"Loaded {path}")
+
+def refresh(artist_limit:int=None, album_limit:int=None):
+    """Refresh the stalest artists and albums (see pipeline.refresh)"""
+    from utils import database
+    from utils.pipeline import Refresh
+    metrics.reset()
+    try:
+        with metrics.span("pipeline"):
+            refresh_stats = Refresh.run_refresh(
+                engine=database.get_engine(),
+                artist_limit=Refresh.REFRESH_ARTIST_LIMIT if artist_limit is None else artist_limit,
+                album_limit=Refresh.REFRESH_ALBUM_LIMIT if album_limit is None else album_limit)
+    finally:
+        metrics.export_run()
+    for table_name, stats in refresh_stats.items():
+        print(f"{table_name}: " + ", ".join(f"{key} {value}" for key, value in stats.items()))
+
+def enrich(album_limit:int=None, track_limit:int=None):
+    """Enrich the stored albums and tracks that were loaded before the enrichment stage (see pipeline.enrich)"""
+    from utils import database
+    from utils.pipeline import Enrich
+    metrics.reset()
+    try:
+        with metrics.span("pipeline"):
+            enrich_stats = Enrich.run_enrichment(
+                engine=database.get_engine(),
+                album_limit=Enrich.ENRICH_ALBUM_LIMIT if album_limit is None else album_limit,
+                track_limit=Enrich.ENRICH_TRACK_LIMIT if track_limit is None else track_limit)
+    finally:
+        metrics.export_run()
+    for table_name, stats in enrich_stats.items():
+        print(f"{table_name}: " + ", ".join(f"{key} {value}" for key, value in stats.items()))
+
+def worker(max_items:int=None):
+    """Process work items from the shared queue until it is drained (see pipeline.worker)"""
+    from utils import database
+    from utils.pipeline import Worker
+    metrics.reset()
+    try:
+        with metrics.span("pipeline"):
+            worker_stats = Worker.run_worker(engine=database.get_engine(), max_items=Worker.WORKER_MAX_ITEMS if max_items is None else max_items)
+    finally:
+        metrics.export_run()
+    print(", ".join(f"{key} {value}" for key, value in worker_stats.items()))
+
+def status():
+    """Print the crawl checkpoints, the row count of every table and the last exported run"""
+    import sqlalchemy
+    from utils import database
+    from utils.database import work_queue
+    from utils.pipeline import Crawl
+    engine = database.get_engine()
+    #Read only: tables that do not exist yet are reported, not created
+    table_names = set(sqlalchemy.inspect(engine).get_table_names())
+    print("Crawl partitions:")
+    if Crawl.CHECKPOINT_TABLE in table_names:
+        checkpoints = Crawl.get_checkpoints(engine)
+        for partition in Crawl.get_partitions():
+            checkpoint = checkpoints.get((partition["genre"], partition["query_partition"]), {"next_offset":0, "exhausted":False})
+            print(f"  {partition['query']}: offset {checkpoint['next_offset']}{', exhausted' if checkpoint['exhausted'] else ''}")
+    else:
+        print("  no checkpoints")
+
+    print("Tables:")
+    with engine.begin() as conn:
+        for table_name in ["artist", "album", "track", "artist_genre", "artist_track", "artist_album", "track_album"]:
+            if table_name in table_names:
+                total_records = conn.execute(sqlalchemy.text(f'SELECT count(*) FROM "{table_name}"')).scalar()
+                print(f"  {table_name}: {total_records} records")
+            else:
+                print(f"  {table_name}: missing")
+
+    if work_queue.WORK_ITEM_TABLE in table_names:
+        print("Work queue:")
+        for kind, kind_stats in sorted(work_queue.get_queue_stats(engine).items()):
+            print(f"  {kind}: " + ", ".join(f"{count} {status}" for status, count in sorted(kind_stats.items())))
+
+    metrics_path = os.path.join(metrics.METRICS_DIR, "metrics.jsonl")
+    if os.path.exists(metrics_path):
+        with open(metrics_path, "r", encoding="utf-8") as file:
+            lines = file.read().splitlines()
+        if lines:
+            record = json.loads(lines[-1])
+            print(f"Last run: {datetime.fromtimestamp(record['finished_at']).strftime('%Y-%m-%d %H:%M:%S')}, {record['duration']:.3f}s")
+
+def compact():
+    """Remove duplicated links and add the keys, columns and aggregate tables of create_table.sql to an existing database"""
+    from utils import database
+    from utils.database import aggregates, maintenance
+    engine = database.get_engine()
+    for table_name, total_records in maintenance.compact_link_tables(engine).items():
+        print(f"{table_name}: removed {total_records} duplicate records")
+    for table_name in maintenance.add_fetched_at_columns(engine):
+        print(f"{table_name}: added column fetched_at")
+    for table_name, columns in maintenance.add_enrichment_columns(engine).items():
+        print(f"{table_name}: added columns {', '.join(columns)}")
+    aggregates.ensure_aggregate_tables(engine)
+
+def rebuild_aggregates():
+    """Recompute the genre and artist aggregates of the whole catalog"""
+    from utils import database
+    from utils.database import aggregates
+    rebuild_stats = aggregates.rebuild_aggregates(database.get_engine())
+    print(f"Rebuilt aggregates of {rebuild_stats['artists']} artists and {rebuild_stats['genres']} genres")
+
+def genre_stats(limit:int=20):
+    """Print the largest genres from the genre aggregates"""
+    from utils import database
+    from utils.database import aggregates
+    for stats in aggregates.get_genre_stats(database.get_engine(), limit=limit):
+        print(f"{stats['genre']}: {stats['track_count']} tracks, {stats['total_duration_ms'] / 3600000:.1f}h, "
+              f"{stats['explicit_ratio']:.0%} explicit")
+
+def compact_parquet(tables:List[str]=None):
+    """Merge the per-run Parquet files of every partition"""
+    from utils.pipeline import Sink
+    for table_name, stats in Sink.compact_parquet(tables=tables).items():
+        print(f"{table_name}: merged {stats['files']} files into {stats['partitions']} with {stats['rows']} records")
+
+def dry_run():
+    """Print the search pages the next run would fetch, without calling Spotify"""
+    from utils import database
+    from utils.pipeline import Crawl
+    engine = database.get_engine()
+    Crawl.ensure_checkpoint_table(engine=engine)
+    plan = Crawl.plan_pages(engine=engine)
+    if not plan:
+        print("All crawl partitions are exhausted")
+    for page in plan:
+        print(f"{page['query']}: offset {page['offset']}, limit {page['limit']}")
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Spotify genre ETL pipeline. Without a command, runs the pipeline once")
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="run the pipeline once")
+    run_parser.add_argument("--mode", choices=PIPELINE_MODES, default=PIPELINE_MODE, help="defaults to PIPELINE_MODE")
+
+    extract_parser = commands.add_parser("extract-only", help="extract the next pages to a JSON file without loading them")
+    extract_parser.add_argument("output", help="path of the JSON file")
+
+    load_parser = commands.add_parser("load-from-file", help="transform and load a JSON file from extract-only")
+    load_parser.add_argument("path", help="path of the JSON file")
+
+    worker_parser = commands.add_parser("worker", help="process the shared work queue, several workers can run at once")
+    worker_parser.add_argument("--max-items", type=int, default=None, help="items processed before stopping, defaults to WORKER_MAX_ITEMS")
+
+    refresh_parser = commands.add_parser("refresh", help="refresh the stalest artists and albums")
+    refresh_parser.add_argument("--artists", type=int, default=None, help="artists refreshed, defaults to REFRESH_ARTIST_LIMIT")
+    refresh_parser.add_argument("--albums", type=int, default=None, help="albums refreshed, defaults to REFRESH_ALBUM_LIMIT")
+
+    enrich_parser = commands.add_parser("enrich", help="fetch the full objects of stored albums and tracks that were never enriched")
+    enrich_parser.add_argument("--albums", type=int, default=None, help="albums enriched, defaults to ENRICH_ALBUM_LIMIT")
+    enrich_parser.add_argument("--tracks", type=int, default=None, help="tracks enriched, defaults to ENRICH_TRACK_LIMIT")
+
+    commands.add_parser("status", help="show crawl checkpoints, table sizes and the last run")
+    commands.add_parser("compact", help="remove duplicated links and migrate an existing database")
+    compact_parquet_parser = commands.add_parser("compact-parquet", help="merge the per-run files of the Parquet sink")
+    compact_parquet_parser.add_argument("--table", action="append", dest="tables", help="table to compact, can be repeated, defaults to every table")
+    commands.add_parser("rebuild-aggregates", help="recompute the genre and artist aggregates from scratch")
+    genre_stats_parser = commands.add_parser("genre-stats", help="show the largest genres")
+    genre_stats_parser.add_argument("--limit", type=int, default=20, help="genres shown, defaults to 20")
+    commands.add_parser("dry-run", help="show the search pages the next run would fetch")
+    return parser
+
+def run_command(args:argparse.Namespace):
+    if args.command in (None, "run"):
+        main(mode=getattr(args, "mode", PIPELINE_MODE))
         print("ETL pipeline completed")
+    elif args.command == "extract-only":
+        extract_only(output=args.output)
+    elif args.command == "load-from-file":
+        load_from_file(path=args.path)
+    elif args.command == "worker":
+        worker(max_items=args.max_items)
+    elif args.command == "refresh":
+        refresh(artist_limit=args.artists, album_limit=args.albums)
+    elif args.command == "enrich":
+        enrich(album_limit=args.albums, track_limit=args.tracks)
+    elif args.command == "status":
+        status()
+    elif args.command == "compact":
+        compact()
+    elif args.command == "compact-parquet":
+        compact_parquet(tables=args.tables)
+    elif args.command == "rebuild-aggregates":
+        rebuild_aggregates()
+    elif args.command == "genre-stats":
+        genre_stats(limit=args.limit)
+    elif args.command == "dry-run":
+        dry_run()
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    logger.setup_logging()
+    try:
+        run_command(args)
     except ValueError as err:
         print(f"Error in ETL pipeline:\n{err}")
+        sys.exit(1)
     except Exception as err:
         print(f"Error in ETL pipeline:\n{err}")
-    
-   
-   
-    
\ No newline at end of file
+        sys.exit(1)
+
+
+
+
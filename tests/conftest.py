@@ -0,0 +1,16 @@
+import pytest
+import sqlalchemy
+from utils import database
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """SQLite database file with every table of create_table.sql"""
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'test.sqlite3'}")
+    database.create_tables(engine)
+    yield engine
+    engine.dispose()
+
+def count_rows(engine:sqlalchemy.engine.base.Engine, table_name:str) -> int:
+    with engine.connect() as conn:
+        return conn.execute(sqlalchemy.text(f'SELECT count(*) FROM "{table_name}"')).scalar()
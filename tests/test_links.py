@@ -0,0 +1,42 @@
+import pandas as pd
+import sqlalchemy
+from utils.database import maintenance
+from utils.pipeline import Transform
+from conftest import count_rows
+
+KEY_COLUMNS = maintenance.LINK_TABLE_KEYS["artist_track"]
+
+
+def test_dedupe_links_drops_duplicated_and_missing_keys():
+    df = pd.DataFrame({"artist_id":["ar1", "ar1", "ar2", None], "track_id":["t1", "t1", "t1", "t2"]})
+    deduped = Transform.dedupe_links(df, KEY_COLUMNS)
+    assert deduped.values.tolist() == [["ar1", "t1"], ["ar2", "t1"]]
+
+def test_filter_existing_keys_keeps_new_keys_only():
+    df = pd.DataFrame({"artist_id":["ar1", "ar1", "ar2"], "track_id":["t1", "t2", "t1"]})
+    existing_keys = pd.DataFrame({"artist_id":["ar1", "ar2"], "track_id":["t1", "t2"]})
+    filtered = Transform.filter_existing_keys(df, existing_keys, KEY_COLUMNS)
+    assert filtered.values.tolist() == [["ar1", "t2"], ["ar2", "t1"]]
+    assert Transform.filter_existing_keys(df, None, KEY_COLUMNS).equals(df)
+
+def test_compact_removes_duplicated_links_and_adds_the_key(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'legacy.sqlite3'}")
+    with engine.begin() as conn:
+        #Association table as created before it had a composite key
+        conn.execute(sqlalchemy.text('CREATE TABLE "artist_track" ("artist_id" text, "track_id" text)'))
+        conn.execute(sqlalchemy.text('INSERT INTO "artist_track" VALUES (:artist_id, :track_id)'), [
+            {"artist_id":"ar1", "track_id":"t1"}, {"artist_id":"ar1", "track_id":"t1"},
+            {"artist_id":"ar1", "track_id":"t2"}, {"artist_id":None, "track_id":"t3"},
+        ])
+    assert maintenance.compact_link_tables(engine, tables=["artist_track"]) == {"artist_track":2}
+    assert count_rows(engine, "artist_track") == 2
+    index_names = {index["name"] for index in sqlalchemy.inspect(engine).get_indexes("artist_track")}
+    assert index_names == {"artist_track_key_idx", "artist_track_track_id_idx"}
+    assert maintenance.compact_link_tables(engine, tables=["artist_track"]) == {"artist_track":0}
+
+def test_compact_keeps_the_primary_key_of_create_table(engine):
+    maintenance.compact_link_tables(engine)
+    for table_name, key_columns in maintenance.LINK_TABLE_KEYS.items():
+        index_names = {index["name"] for index in sqlalchemy.inspect(engine).get_indexes(table_name)}
+        assert f"{table_name}_key_idx" not in index_names
+        assert f"{table_name}_{key_columns[1]}_idx" in index_names
@@ -0,0 +1,44 @@
+import pandas as pd
+from utils.pipeline import Load
+from conftest import count_rows
+
+
+def get_dfs():
+    return {
+        "artist":pd.DataFrame({"id":["ar1", "ar2"], "name":["Artist 1", "Artist 2"]}),
+        "album":pd.DataFrame({"id":["al1"], "name":["Album 1"], "release_date":[pd.Timestamp("2019-05-01")]}),
+        "track":pd.DataFrame({"id":["t1", "t2", "t3"], "name":["Track 1", "Track 2", "Track 3"], "duration_ms":[1000, 2000, 3000]}),
+        "artist_genre":pd.DataFrame({"artist_id":["ar1", "ar2"], "genre":["house", "techno"]}),
+        "artist_track":pd.DataFrame({"artist_id":["ar1", "ar1", "ar2"], "track_id":["t1", "t2", "t3"]}),
+        "artist_album":pd.DataFrame({"artist_id":["ar1"], "album_id":["al1"]}),
+        "track_album":pd.DataFrame({"track_id":["t1", "t2", "t3"], "album_id":["al1", "al1", "al1"]}),
+    }
+
+def test_upsert_rerun_inserts_no_duplicates(engine):
+    dfs = get_dfs()
+    first_stats = Load.load_tables(engine, dfs, mode="upsert")
+    second_stats = Load.load_tables(engine, dfs, mode="upsert")
+    for table_name, df in dfs.items():
+        assert first_stats[table_name]["inserted"] == len(df)
+        assert second_stats[table_name]["inserted"] == 0
+        assert count_rows(engine, table_name) == len(df)
+
+def test_upsert_inserts_only_new_keys(engine):
+    Load.load_tables(engine, get_dfs(), mode="upsert")
+    track_df = pd.DataFrame({"id":["t3", "t4"], "name":["Track 3 renamed", "Track 4"], "duration_ms":[3000, 4000]})
+    with engine.begin() as conn:
+        assert Load.load_table(conn, track_df, "track", mode="upsert") == 1
+    assert count_rows(engine, "track") == 4
+
+def test_upsert_skips_duplicates_within_a_batch(engine):
+    track_df = pd.DataFrame({"id":["t1", "t1"], "name":["Track 1", "Track 1"], "duration_ms":[1000, 1000]})
+    with engine.begin() as conn:
+        Load.load_table(conn, track_df, "track", mode="upsert")
+    assert count_rows(engine, "track") == 1
+
+def test_parallel_upsert_rerun_inserts_no_duplicates(engine):
+    dfs = get_dfs()
+    Load.load_tables(engine, dfs, mode="upsert", strategy="parallel")
+    Load.load_tables(engine, dfs, mode="upsert", strategy="parallel")
+    for table_name, df in dfs.items():
+        assert count_rows(engine, table_name) == len(df)
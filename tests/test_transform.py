@@ -0,0 +1,16 @@
+import pandas as pd
+from utils.pipeline import Transform
+
+
+def test_parse_release_dates_by_precision():
+    release_dates = Transform.parse_release_dates(["2019", "2019-05", "2019-05-17"], ["year", "month", "day"])
+    assert list(release_dates) == [pd.Timestamp("2019-01-01"), pd.Timestamp("2019-05-01"), pd.Timestamp("2019-05-17")]
+
+def test_parse_release_dates_infers_missing_precision():
+    release_dates = Transform.parse_release_dates(["1987", "1987-11", "1987-11-02"], [None, None, None])
+    assert list(release_dates) == [pd.Timestamp("1987-01-01"), pd.Timestamp("1987-11-01"), pd.Timestamp("1987-11-02")]
+    assert list(Transform.parse_release_dates(["1987", "1987-11"])) == [pd.Timestamp("1987-01-01"), pd.Timestamp("1987-11-01")]
+
+def test_parse_release_dates_invalid_dates_are_nat():
+    release_dates = Transform.parse_release_dates(["0000", None, "2019-13", "not a date"], ["year", "day", "month", "day"])
+    assert release_dates.isna().all()
@@ -0,0 +1,68 @@
+import threading
+import sqlalchemy
+from utils.pipeline import Worker
+
+N_ITEMS = 60
+N_WORKERS = 4
+
+
+def enqueue(engine, kind:str, items:dict):
+    with Worker.write_transaction(engine) as conn:
+        Worker.enqueue_items(conn, kind, items)
+
+def get_statuses(engine) -> dict:
+    with engine.connect() as conn:
+        return dict(conn.execute(sqlalchemy.text('SELECT "item_key", "status" FROM "work_item"')).fetchall())
+
+def test_concurrent_claimers_never_get_the_same_item(engine):
+    enqueue(engine, "artists", {f"item|{index}":{"artist_ids":[f"ar{index}"], "genre":"house"} for index in range(N_ITEMS)})
+    claimed = {owner:[] for owner in range(N_WORKERS)}
+    barrier = threading.Barrier(N_WORKERS)
+
+    def claim(owner):
+        barrier.wait()
+        while True:
+            items = Worker.claim_items(engine, owner=f"worker-{owner}", kind="artists", limit=2)
+            if not items:
+                return
+            claimed[owner].extend(item["item_key"] for item in items)
+
+    threads = [threading.Thread(target=claim, args=(owner,)) for owner in range(N_WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    item_keys = [item_key for owner_keys in claimed.values() for item_key in owner_keys]
+    assert len(item_keys) == N_ITEMS
+    assert len(set(item_keys)) == N_ITEMS
+
+def test_expired_lease_is_claimed_again_and_the_old_owner_loses_it(engine):
+    enqueue(engine, "artists", {"item|0":{"artist_ids":["ar0"], "genre":"house"}})
+    [item] = Worker.claim_items(engine, owner="worker-a", kind="artists", lease_seconds=-1)
+    [reclaimed] = Worker.claim_items(engine, owner="worker-b", kind="artists")
+    assert reclaimed["item_key"] == item["item_key"]
+    assert reclaimed["attempts"] == 2
+    assert not Worker.complete_item(engine, item, owner="worker-a")
+    assert Worker.complete_item(engine, reclaimed, owner="worker-b")
+    assert get_statuses(engine) == {"item|0":"done"}
+
+def test_cancel_search_pages_cancels_the_later_pages_of_the_partition(engine):
+    pages = [{"genre":genre, "query_partition":"all", "query":f"genre:{genre}", "offset":offset, "limit":50}
+             for genre in ["house", "techno"] for offset in range(0, 200, 50)]
+    enqueue(engine, "search", {Worker.get_search_item_key(page):page for page in pages})
+    assert Worker.cancel_search_pages(engine, pages[1]) == 2
+    cancelled = {item_key for item_key, status in get_statuses(engine).items() if status == "cancelled"}
+    assert cancelled == {"house|all|0100", "house|all|0150"}
+
+def test_placeholders_of_failed_batches_are_requeued_once(engine):
+    new_ids = Worker.add_artist_placeholders(engine, ["ar1", "ar2"], source_key="house|all|0000", genre="house")
+    assert new_ids == ["ar1", "ar2"]
+    assert Worker.add_artist_placeholders(engine, ["ar1", "ar2"], source_key="house|all|0050", genre="house") == []
+    assert Worker.requeue_placeholder_artists(engine) == 0
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text('UPDATE "work_item" SET "status" = \'failed\''))
+    assert Worker.requeue_placeholder_artists(engine) == 2
+    [item] = Worker.claim_items(engine, owner="worker-a", kind="artists")
+    assert item["payload"]["artist_ids"] == ["ar1", "ar2"]
+    Worker.release_item(engine, item, owner="worker-a", error="failed", max_attempts=1)
+    assert Worker.requeue_placeholder_artists(engine) == 0
@@ -1,4 +1,13 @@
-from .database import *
-from .pipeline import *
-from .spotify import *
-from .logger import *
+import importlib
+
+#Subpackages are imported on first access (PEP 562), so a command only pays for the subsystems it uses
+_SUBMODULES = ["cache", "database", "logger", "metrics", "pipeline", "spotify"]
+
+
+def __getattr__(name:str):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + _SUBMODULES)
@@ -0,0 +1 @@
+from .metadata import *
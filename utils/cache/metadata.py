@@ -0,0 +1,143 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+from dotenv import load_dotenv
+from .. import logger
+
+load_dotenv(dotenv_path=".env")
+
+#Constants
+#Defaults to cache/ in the project root, whatever the working directory of the process
+METADATA_CACHE_PATH = os.getenv("METADATA_CACHE_PATH", os.path.join(os.path.dirname(__file__), "..", "..", "cache", "metadata.sqlite3"))
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", 100000))
+METADATA_CACHE_TTLS = {
+    "artist": int(os.getenv("ARTIST_CACHE_TTL", 7*24*3600)),
+    "album": int(os.getenv("ALBUM_CACHE_TTL", 30*24*3600)),
+}
+
+# Global cache instance
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class MetadataCache:
+    """
+    Persistent cache of Spotify objects keyed by namespace (e.g. "artist") and Spotify ID, stored in a SQLite file.
+    Entries older than the namespace TTL are misses, and the least recently used entries are evicted
+    once a namespace holds more than max_entries.
+
+    Params:
+        path (str): Path of the SQLite file, ":memory:" for a non-persistent cache
+        ttls (Dict[str,int]): Time to live in seconds per namespace
+        max_entries (int): Maximum number of entries per namespace
+    """
+    def __init__(self, path:str, ttls:Dict[str,int]=None, max_entries:int=METADATA_CACHE_MAX_ENTRIES):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttls = dict(METADATA_CACHE_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats:Dict[str,Dict[str,int]] = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS metadata_cache ("
+                "namespace TEXT NOT NULL, id TEXT NOT NULL, payload TEXT NOT NULL, "
+                "fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, id))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_metadata_cache_lru ON metadata_cache (namespace, accessed_at)")
+
+    def _count(self, namespace:str, key:str, value:int=1):
+        counters = self.stats.setdefault(namespace, {"hits":0, "misses":0, "expired":0, "evictions":0})
+        counters[key] += value
+
+    def get_many(self, namespace:str, ids:List[str], with_fetched_at:bool=False) -> Dict[str,Dict[str,any]]:
+        """
+        Look up several ids
+
+        Params:
+            namespace (str): Kind of object, e.g. "artist"
+            ids (List[str]): Spotify IDs to look up
+            with_fetched_at (bool, optional): Return (payload, fetched_at) pairs, fetched_at being the UNIX time
+                the entry was stored. Defaults to False
+
+        Returns:
+            found (Dict[str,Dict[str,any]]): Cached payloads of fresh entries keyed by id. Missing and expired ids are absent
+        """
+        if not ids:
+            return {}
+        now = time.time()
+        min_fetched_at = now - self.ttls.get(namespace, 0)
+        found = {}
+        expired = 0
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start+500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT id, payload, fetched_at FROM metadata_cache WHERE namespace = ? AND id IN ({placeholders})",
+                    [namespace, *batch]
+                ).fetchall()
+                for id, payload, fetched_at in rows:
+                    if fetched_at >= min_fetched_at:
+                        found[id] = (json.loads(payload), fetched_at) if with_fetched_at else json.loads(payload)
+                    else:
+                        expired += 1
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE metadata_cache SET accessed_at = ? WHERE namespace = ? AND id = ?",
+                    [(now, namespace, id) for id in found]
+                )
+            self._count(namespace, "hits", len(found))
+            self._count(namespace, "misses", len(set(ids)) - len(found))
+            self._count(namespace, "expired", expired)
+        return found
+
+    def set_many(self, namespace:str, items:Dict[str,Dict[str,any]]):
+        """
+        Store several payloads, replacing existing entries, then evict least recently used entries above max_entries
+
+        Params:
+            namespace (str): Kind of object, e.g. "artist"
+            items (Dict[str,Dict[str,any]]): JSON serializable payloads keyed by Spotify ID
+        """
+        if not items:
+            return
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metadata_cache (namespace, id, payload, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                [(namespace, id, json.dumps(payload), now, now) for id, payload in items.items()]
+            )
+            total = self.conn.execute("SELECT count(*) FROM metadata_cache WHERE namespace = ?", (namespace,)).fetchone()[0]
+            if total > self.max_entries:
+                evicted = self.conn.execute(
+                    "DELETE FROM metadata_cache WHERE namespace = ? AND id IN "
+                    "(SELECT id FROM metadata_cache WHERE namespace = ? ORDER BY accessed_at LIMIT ?)",
+                    (namespace, namespace, total - self.max_entries)
+                ).rowcount
+                self._count(namespace, "evictions", evicted)
+
+    def get_stats(self) -> Dict[str,Dict[str,int]]:
+        """Returns a copy of the hits, misses, expired and evictions counters per namespace"""
+        with self.lock:
+            return {namespace:dict(counters) for namespace, counters in self.stats.items()}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def get_cache():
+    """Creates or returns the shared metadata cache. Returns None when METADATA_CACHE_PATH is empty."""
+    global _cache
+    if not METADATA_CACHE_PATH:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache(path=METADATA_CACHE_PATH)
+            logger.info(f"Opened metadata cache {METADATA_CACHE_PATH}")
+    return _cache
@@ -1 +1,2 @@
-from .db import *
\ No newline at end of file
+from .db import *
+from .schema import *
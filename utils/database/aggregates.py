@@ -0,0 +1,258 @@
+import os
+from datetime import datetime
+from typing import Dict, List, Iterable
+import sqlalchemy
+from .. import logger
+from .maintenance import LINK_TABLE_KEYS
+
+#Aggregates are refreshed after every database load unless disabled
+AGGREGATES_ENABLED = os.getenv("AGGREGATES_ENABLED", "1") not in ("0", "false", "False")
+#Maximum number of ids bound in one IN clause
+AGGREGATE_BATCH_SIZE = 1000
+
+AGGREGATE_TABLES = {
+    "genre_track":(
+        'CREATE TABLE IF NOT EXISTS "genre_track" ('
+        '"genre" text NOT NULL, "track_id" text NOT NULL, PRIMARY KEY ("genre", "track_id"))'
+    ),
+    "genre_stats":(
+        'CREATE TABLE IF NOT EXISTS "genre_stats" ('
+        '"genre" text PRIMARY KEY, "track_count" integer NOT NULL DEFAULT 0, "total_duration_ms" bigint NOT NULL DEFAULT 0, '
+        '"explicit_count" integer NOT NULL DEFAULT 0, "updated_at" timestamp)'
+    ),
+    "artist_stats":(
+        'CREATE TABLE IF NOT EXISTS "artist_stats" ('
+        '"artist_id" text PRIMARY KEY, "album_count" integer NOT NULL DEFAULT 0, "track_count" integer NOT NULL DEFAULT 0, '
+        '"updated_at" timestamp)'
+    ),
+}
+
+#Secondary indexes of the read queries, the leading key columns are covered by the primary keys
+READ_INDEXES = {
+    **{f"{table_name}_{key_columns[1]}_idx":(table_name, [key_columns[1]]) for table_name, key_columns in LINK_TABLE_KEYS.items()},
+    "genre_stats_track_count_idx":("genre_stats", ["track_count"]),
+}
+
+#Distinct (genre, track) pairs: a track belongs to the genres of all its artists
+_GENRE_TRACK_SELECT = (
+    'SELECT DISTINCT ag."genre", at."track_id" FROM "artist_genre" ag JOIN "artist_track" at ON at."artist_id" = ag."artist_id"{where}'
+)
+_GENRE_STATS_SELECT = (
+    'SELECT gt."genre", COUNT(*), COALESCE(SUM(t."duration_ms"), 0), SUM(CASE WHEN t."explicit" THEN 1 ELSE 0 END), :updated_at '
+    'FROM "genre_track" gt JOIN "track" t ON t."id" = gt."track_id"{where} GROUP BY gt."genre"'
+)
+_ARTIST_STATS_SELECT = (
+    'SELECT a."id", '
+    '(SELECT COUNT(DISTINCT aa."album_id") FROM "artist_album" aa WHERE aa."artist_id" = a."id"), '
+    '(SELECT COUNT(DISTINCT at."track_id") FROM "artist_track" at WHERE at."artist_id" = a."id"), :updated_at '
+    'FROM "artist" a{where}'
+)
+
+
+def ensure_aggregate_tables(engine:sqlalchemy.engine.base.Engine):
+    """
+    Creates the aggregate tables and the read indexes if they do not exist yet (same definitions as in create_table.sql),
+    for databases created before create_table.sql declared them. Run by `main.py compact` and rebuild_aggregates
+    """
+    with engine.begin() as conn:
+        for stmt in AGGREGATE_TABLES.values():
+            conn.execute(sqlalchemy.text(stmt))
+        for index_name, (table_name, columns) in READ_INDEXES.items():
+            column_list = ", ".join(f'"{column}"' for column in columns)
+            conn.execute(sqlalchemy.text(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_list})'))
+
+def _batches(values:Iterable[str], size:int=AGGREGATE_BATCH_SIZE):
+    values = sorted(set(values))
+    return [values[i:i+size] for i in range(0, len(values), size)]
+
+def add_genre_tracks(conn:sqlalchemy.engine.Connection, artist_ids:List[str], updated_at:datetime) -> int:
+    """
+    Insert the (genre, track) pairs of the given artists that genre_track does not have yet and add
+    their tracks to genre_stats. Only the pairs this insert created are counted (ON CONFLICT DO NOTHING RETURNING),
+    so a track shared by several artists of the same genre, loaded again by a later run or added at the
+    same time by another worker, is counted once
+
+    Returns:
+        total_records (int): Number of new pairs
+    """
+    insert_stmt = sqlalchemy.text(
+        'INSERT INTO "genre_track" ("genre", "track_id") SELECT p."genre", p."track_id" FROM ('
+        + _GENRE_TRACK_SELECT.format(where=' WHERE ag."artist_id" IN :artist_ids')
+        + ') p JOIN "track" t ON t."id" = p."track_id" '
+        'WHERE NOT EXISTS (SELECT 1 FROM "genre_track" gt WHERE gt."genre" = p."genre" AND gt."track_id" = p."track_id") '
+        'ON CONFLICT ("genre", "track_id") DO NOTHING RETURNING "genre", "track_id"'
+    ).bindparams(sqlalchemy.bindparam("artist_ids", expanding=True))
+    track_stmt = sqlalchemy.text('SELECT "id", "duration_ms", "explicit" FROM "track" WHERE "id" IN :track_ids').bindparams(
+        sqlalchemy.bindparam("track_ids", expanding=True))
+    deltas = {}
+    total_records = 0
+    for batch in _batches(artist_ids):
+        rows = conn.execute(insert_stmt, {"artist_ids":batch}).fetchall()
+        if not rows:
+            continue
+        tracks = {}
+        for track_batch in _batches(track_id for _, track_id in rows):
+            tracks.update((track_id, (duration_ms, explicit)) for track_id, duration_ms, explicit in conn.execute(track_stmt, {"track_ids":track_batch}))
+        for genre, track_id in rows:
+            duration_ms, explicit = tracks[track_id]
+            delta = deltas.setdefault(genre, {"genre":genre, "track_count":0, "total_duration_ms":0, "explicit_count":0, "updated_at":updated_at})
+            delta["track_count"] += 1
+            delta["total_duration_ms"] += duration_ms or 0
+            delta["explicit_count"] += 1 if explicit else 0
+        total_records += len(rows)
+    if deltas:
+        conn.execute(sqlalchemy.text(
+            'INSERT INTO "genre_stats" ("genre", "track_count", "total_duration_ms", "explicit_count", "updated_at") '
+            'VALUES (:genre, :track_count, :total_duration_ms, :explicit_count, :updated_at) ON CONFLICT ("genre") DO UPDATE SET '
+            '"track_count" = "genre_stats"."track_count" + excluded."track_count", '
+            '"total_duration_ms" = "genre_stats"."total_duration_ms" + excluded."total_duration_ms", '
+            '"explicit_count" = "genre_stats"."explicit_count" + excluded."explicit_count", '
+            '"updated_at" = excluded."updated_at"'
+        ), list(deltas.values()))
+    return total_records
+
+def recompute_genres(conn:sqlalchemy.engine.Connection, genres:List[str], updated_at:datetime):
+    """Rebuild the genre_track and genre_stats rows of the given genres, for genres that lost artists"""
+    for batch in _batches(genres):
+        params = {"genres":batch, "updated_at":updated_at}
+        for stmt in [
+            'DELETE FROM "genre_track" WHERE "genre" IN :genres',
+            'INSERT INTO "genre_track" ("genre", "track_id") ' + _GENRE_TRACK_SELECT.format(where=' WHERE ag."genre" IN :genres'),
+            'DELETE FROM "genre_stats" WHERE "genre" IN :genres',
+            'INSERT INTO "genre_stats" ("genre", "track_count", "total_duration_ms", "explicit_count", "updated_at") '
+            + _GENRE_STATS_SELECT.format(where=' WHERE gt."genre" IN :genres'),
+        ]:
+            conn.execute(sqlalchemy.text(stmt).bindparams(sqlalchemy.bindparam("genres", expanding=True)), params)
+
+def refresh_aggregates(engine:sqlalchemy.engine.base.Engine, artist_ids:Iterable[str], genres:Iterable[str]=()):
+    """
+    Update the aggregates from the artists of a run instead of the whole catalog: the artist_stats rows
+    of the given artists are recomputed, and the (genre, track) pairs they add are appended to genre_track
+    and added to genre_stats. Links are only ever added by a load, the given genres (e.g. genres an artist
+    lost in a refresh) are recomputed from scratch instead
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        artist_ids (Iterable[str]): Artists whose links changed
+        genres (Iterable[str], optional): Genres to recompute
+
+    Returns:
+        refresh_stats (Dict[str,int]): Number of artists recomputed, genre_track pairs added and genres recomputed
+    """
+    artist_ids = sorted(set(artist_ids))
+    genres = sorted(set(genres))
+    if not artist_ids and not genres:
+        return {"artists":0, "genre_tracks":0, "genres":0}
+    updated_at = datetime.now()
+    with engine.begin() as conn:
+        for batch in _batches(artist_ids):
+            params = {"artist_ids":batch, "updated_at":updated_at}
+            conn.execute(sqlalchemy.text('DELETE FROM "artist_stats" WHERE "artist_id" IN :artist_ids').bindparams(
+                sqlalchemy.bindparam("artist_ids", expanding=True)), params)
+            conn.execute(sqlalchemy.text(
+                'INSERT INTO "artist_stats" ("artist_id", "album_count", "track_count", "updated_at") '
+                + _ARTIST_STATS_SELECT.format(where=' WHERE a."id" IN :artist_ids')
+            ).bindparams(sqlalchemy.bindparam("artist_ids", expanding=True)), params)
+        recompute_genres(conn, genres, updated_at)
+        genre_tracks = add_genre_tracks(conn, artist_ids, updated_at)
+    logger.info(f"Refreshed aggregates of {len(artist_ids)} artists, added {genre_tracks} genre tracks and recomputed {len(genres)} genres")
+    return {"artists":len(artist_ids), "genre_tracks":genre_tracks, "genres":len(genres)}
+
+def rebuild_aggregates(engine:sqlalchemy.engine.base.Engine):
+    """
+    Recompute every aggregate from scratch, e.g. to fill the tables of an existing database once
+
+    Returns:
+        rebuild_stats (Dict[str,int]): Number of artist_stats, genre_track and genre_stats rows
+    """
+    ensure_aggregate_tables(engine)
+    params = {"updated_at":datetime.now()}
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text('DELETE FROM "artist_stats"'))
+        artists = conn.execute(sqlalchemy.text(
+            'INSERT INTO "artist_stats" ("artist_id", "album_count", "track_count", "updated_at") ' + _ARTIST_STATS_SELECT.format(where="")
+        ), params).rowcount
+        conn.execute(sqlalchemy.text('DELETE FROM "genre_track"'))
+        genre_tracks = conn.execute(sqlalchemy.text(
+            'INSERT INTO "genre_track" ("genre", "track_id") ' + _GENRE_TRACK_SELECT.format(where="")
+        )).rowcount
+        conn.execute(sqlalchemy.text('DELETE FROM "genre_stats"'))
+        genres = conn.execute(sqlalchemy.text(
+            'INSERT INTO "genre_stats" ("genre", "track_count", "total_duration_ms", "explicit_count", "updated_at") ' + _GENRE_STATS_SELECT.format(where="")
+        ), params).rowcount
+    logger.info(f"Rebuilt aggregates of {artists} artists and {genres} genres from {genre_tracks} genre tracks")
+    return {"artists":artists, "genre_tracks":genre_tracks, "genres":genres}
+
+def get_genre_stats(engine:sqlalchemy.engine.base.Engine, genres:List[str]=None, limit:int=50) -> List[Dict[str,any]]:
+    """
+    Read the genre aggregates, largest genres first
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        genres (List[str], optional): Genres to read. Defaults to the largest genres
+        limit (int, optional): Maximum number of genres. Defaults to 50
+
+    Returns:
+        genre_stats (List[Dict[str,any]]): genre, track_count, total_duration_ms and explicit_ratio per genre
+    """
+    stmt = 'SELECT "genre", "track_count", "total_duration_ms", "explicit_count" FROM "genre_stats"'
+    params = {"limit":limit}
+    if genres is not None:
+        stmt += ' WHERE "genre" IN :genres'
+        params["genres"] = list(genres)
+    stmt = sqlalchemy.text(stmt + ' ORDER BY "track_count" DESC, "genre" LIMIT :limit')
+    if genres is not None:
+        stmt = stmt.bindparams(sqlalchemy.bindparam("genres", expanding=True))
+    with engine.connect() as conn:
+        rows = conn.execute(stmt, params).mappings().all()
+    return [{
+        "genre":row["genre"],
+        "track_count":row["track_count"],
+        "total_duration_ms":row["total_duration_ms"],
+        "explicit_ratio":row["explicit_count"] / row["track_count"] if row["track_count"] else 0.0,
+    } for row in rows]
+
+def get_artist_stats(engine:sqlalchemy.engine.base.Engine, artist_ids:List[str]) -> Dict[str,Dict[str,int]]:
+    """
+    Read the artist aggregates
+
+    Returns:
+        artist_stats (Dict[str,Dict[str,int]]): album_count and track_count keyed by artist id
+    """
+    stmt = sqlalchemy.text('SELECT "artist_id", "album_count", "track_count" FROM "artist_stats" WHERE "artist_id" IN :artist_ids').bindparams(
+        sqlalchemy.bindparam("artist_ids", expanding=True))
+    artist_stats = {}
+    with engine.connect() as conn:
+        for batch in _batches(artist_ids):
+            for row in conn.execute(stmt, {"artist_ids":batch}).mappings():
+                artist_stats[row["artist_id"]] = {"album_count":row["album_count"], "track_count":row["track_count"]}
+    return artist_stats
+
+def get_tracks_by_genre(engine:sqlalchemy.engine.base.Engine, genre:str, limit:int=100, offset:int=0) -> List[Dict[str,any]]:
+    """
+    Tracks of a genre (tracks of any artist of the genre), ordered by id. Reads genre_track on its
+    (genre, track_id) key, so a page costs an index range scan instead of a scan of the genre's artists
+
+    Returns:
+        tracks (List[Dict[str,any]]): id, name, url, duration_ms, release_date and explicit per track
+    """
+    stmt = sqlalchemy.text(
+        'SELECT t."id", t."name", t."url", t."duration_ms", t."release_date", t."explicit" FROM "genre_track" gt '
+        'JOIN "track" t ON t."id" = gt."track_id" WHERE gt."genre" = :genre ORDER BY gt."track_id" LIMIT :limit OFFSET :offset'
+    )
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(stmt, {"genre":genre, "limit":limit, "offset":offset}).mappings()]
+
+def get_albums_by_artist(engine:sqlalchemy.engine.base.Engine, artist_id:str) -> List[Dict[str,any]]:
+    """
+    Albums of an artist, newest first
+
+    Returns:
+        albums (List[Dict[str,any]]): id, name, release_date, total_tracks and type per album
+    """
+    stmt = sqlalchemy.text(
+        'SELECT al."id", al."name", al."release_date", al."total_tracks", al."type" FROM "artist_album" aa '
+        'JOIN "album" al ON al."id" = aa."album_id" WHERE aa."artist_id" = :artist_id ORDER BY al."release_date" DESC'
+    )
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(stmt, {"artist_id":artist_id}).mappings()]
@@ -1,5 +1,4 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import create_engine, make_url
 import os
 from dotenv import load_dotenv
 from .. import logger  # Adjust import based on your project structure
@@ -7,6 +6,11 @@ from .. import logger  # Adjust import based on your project structure
 # Load environment variables
 load_dotenv(dotenv_path=".env")
 
+# Connection pool, not used by SQLite which keeps its own pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 4))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+
 # Global variables for engine and session factory
 _engine = None
 _SessionFactory = None
@@ -19,15 +23,20 @@ def get_engine():
         if not db_url:
             raise ValueError("DB_URL is not set in the environment variables.")
         
-        _engine = create_engine(db_url)
+        pool_options = {}
+        if make_url(db_url).get_backend_name() != "sqlite":
+            pool_options = {"pool_size":DB_POOL_SIZE, "max_overflow":DB_MAX_OVERFLOW, "pool_timeout":DB_POOL_TIMEOUT, "pool_pre_ping":True}
+        _engine = create_engine(db_url, **pool_options)
         logger.info("Created new database engine")
 
     return _engine
 
-def get_session() -> Session:
-    """Creates and returns a new SQLAlchemy session."""
+def get_session():
+    """Creates and returns a new SQLAlchemy session (sqlalchemy.orm.Session)."""
     global _SessionFactory
     if _SessionFactory is None:
+        #The ORM is only imported by the code that uses sessions
+        from sqlalchemy.orm import sessionmaker
         _SessionFactory = sessionmaker(bind=get_engine())
         logger.info("Initialized session factory")
 
@@ -0,0 +1,129 @@
+import sqlalchemy
+from datetime import datetime
+from typing import Dict, List
+from .. import logger
+
+#Composite keys of the association tables, as in create_table.sql
+LINK_TABLE_KEYS:Dict[str,List[str]] = {
+    "artist_track":["artist_id", "track_id"],
+    "artist_album":["artist_id", "album_id"],
+    "artist_genre":["artist_id", "genre"],
+    "track_album":["track_id", "album_id"],
+}
+
+#Tables whose rows record when they were last fetched from Spotify
+FETCHED_AT_TABLES = ["artist", "album"]
+
+#Columns that search results lack or may lack, filled by the enrichment stage (pipeline.enrich), with their types
+ENRICHMENT_COLUMNS:Dict[str,Dict[str,str]] = {
+    "album":{"label":"text", "popularity":"integer", "upc":"text"},
+    "track":{"popularity":"integer", "isrc":"text", "track_number":"integer", "disc_number":"integer"},
+}
+
+
+def remove_duplicate_links(conn:sqlalchemy.engine.Connection, table_name:str, key_columns:List[str]) -> int:
+    """
+    Delete rows with a NULL key and every copy but one of duplicated keys,
+    using ctid on PostgreSQL and rowid on SQLite to tell copies apart
+
+    Returns:
+        total_records (int): Number of rows deleted
+    """
+    not_null = " OR ".join(f'"{column}" IS NULL' for column in key_columns)
+    deleted = conn.execute(sqlalchemy.text(f'DELETE FROM "{table_name}" WHERE {not_null}')).rowcount
+    key_list = ", ".join(f'"{column}"' for column in key_columns)
+    if conn.dialect.name == "postgresql":
+        key_match = " AND ".join(f'a."{column}" = b."{column}"' for column in key_columns)
+        stmt = f'DELETE FROM "{table_name}" a USING "{table_name}" b WHERE a.ctid > b.ctid AND {key_match}'
+    elif conn.dialect.name == "sqlite":
+        stmt = f'DELETE FROM "{table_name}" WHERE rowid NOT IN (SELECT MIN(rowid) FROM "{table_name}" GROUP BY {key_list})'
+    else:
+        raise ValueError(f"Compaction is not supported on {conn.dialect.name}")
+    deleted += conn.execute(sqlalchemy.text(stmt)).rowcount
+    return deleted
+
+def has_unique_key(conn:sqlalchemy.engine.Connection, table_name:str, key_columns:List[str]) -> bool:
+    """Whether the table has a primary key, unique constraint or unique index on exactly key_columns"""
+    inspector = sqlalchemy.inspect(conn)
+    keys = [inspector.get_pk_constraint(table_name)["constrained_columns"]]
+    keys += [constraint["column_names"] for constraint in inspector.get_unique_constraints(table_name)]
+    keys += [index["column_names"] for index in inspector.get_indexes(table_name) if index["unique"]]
+    return any(set(columns) == set(key_columns) for columns in keys)
+
+def create_link_indexes(conn:sqlalchemy.engine.Connection, table_name:str, key_columns:List[str]):
+    """
+    Create the unique index on the composite key and the index on the second key column,
+    for tables created before create_table.sql declared them. The unique index is only created
+    when the table has no key on these columns yet, such as the primary key of create_table.sql
+    """
+    if not has_unique_key(conn, table_name, key_columns):
+        key_list = ", ".join(f'"{column}"' for column in key_columns)
+        conn.execute(sqlalchemy.text(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table_name}_key_idx" ON "{table_name}" ({key_list})'))
+    conn.execute(sqlalchemy.text(f'CREATE INDEX IF NOT EXISTS "{table_name}_{key_columns[1]}_idx" ON "{table_name}" ("{key_columns[1]}")'))
+
+def compact_link_tables(engine:sqlalchemy.engine.base.Engine, tables:List[str]=None):
+    """
+    One-off compaction of the association tables: removes the duplicated links loaded before
+    the tables had a composite key, then adds the key and foreign key side indexes so that
+    later loads skip existing links with ON CONFLICT DO NOTHING. Each table is compacted in its own transaction
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        tables (List[str], optional): Tables to compact. Defaults to every table of LINK_TABLE_KEYS
+
+    Returns:
+        deleted (Dict[str,int]): Number of rows deleted per table
+    """
+    tables = list(LINK_TABLE_KEYS) if tables is None else tables
+    deleted = {}
+    for table_name in tables:
+        if table_name not in LINK_TABLE_KEYS:
+            raise ValueError(f"Table name {table_name} is not supported")
+        key_columns = LINK_TABLE_KEYS[table_name]
+        with engine.begin() as conn:
+            deleted[table_name] = remove_duplicate_links(conn, table_name, key_columns)
+            create_link_indexes(conn, table_name, key_columns)
+        logger.info(f"Compacted table {table_name}, removed {deleted[table_name]} duplicate records")
+    return deleted
+
+def add_fetched_at_columns(engine:sqlalchemy.engine.base.Engine, tables:List[str]=FETCHED_AT_TABLES):
+    """
+    Add the fetched_at column and its index to tables created before create_table.sql declared them.
+    Existing rows get the epoch as fetched_at so that the refresh job picks them first
+
+    Returns:
+        added (List[str]): Tables the column was added to
+    """
+    existing_columns = {table_name:[column["name"] for column in sqlalchemy.inspect(engine).get_columns(table_name)] for table_name in tables}
+    added = []
+    with engine.begin() as conn:
+        for table_name in tables:
+            if "fetched_at" not in existing_columns[table_name]:
+                conn.execute(sqlalchemy.text(f'ALTER TABLE "{table_name}" ADD COLUMN "fetched_at" timestamp'))
+                added.append(table_name)
+            conn.execute(sqlalchemy.text(f'UPDATE "{table_name}" SET "fetched_at" = :epoch WHERE "fetched_at" IS NULL'), {"epoch":datetime(1970, 1, 1)})
+            conn.execute(sqlalchemy.text(f'CREATE INDEX IF NOT EXISTS "{table_name}_fetched_at_idx" ON "{table_name}" ("fetched_at")'))
+    for table_name in added:
+        logger.info(f"Added column fetched_at to table {table_name}")
+    return added
+
+def add_enrichment_columns(engine:sqlalchemy.engine.base.Engine, tables:List[str]=list(ENRICHMENT_COLUMNS)):
+    """
+    Add the enrichment columns, enriched_at and its index to tables created before create_table.sql declared them.
+    Existing rows keep a NULL enriched_at so that `main.py enrich` picks them up
+
+    Returns:
+        added (Dict[str,List[str]]): Columns added per table, only tables that changed
+    """
+    existing_columns = {table_name:[column["name"] for column in sqlalchemy.inspect(engine).get_columns(table_name)] for table_name in tables}
+    added = {}
+    with engine.begin() as conn:
+        for table_name in tables:
+            for column, column_type in {**ENRICHMENT_COLUMNS[table_name], "enriched_at":"timestamp"}.items():
+                if column not in existing_columns[table_name]:
+                    conn.execute(sqlalchemy.text(f'ALTER TABLE "{table_name}" ADD COLUMN "{column}" {column_type}'))
+                    added.setdefault(table_name, []).append(column)
+            conn.execute(sqlalchemy.text(f'CREATE INDEX IF NOT EXISTS "{table_name}_enriched_at_idx" ON "{table_name}" ("enriched_at")'))
+    for table_name, columns in added.items():
+        logger.info(f"Added columns {', '.join(columns)} to table {table_name}")
+    return added
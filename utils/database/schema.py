@@ -0,0 +1,41 @@
+import os
+import re
+import sqlalchemy
+from .. import logger
+
+CREATE_TABLE_SQL_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "create_table.sql")
+
+
+def get_schema_statements(dialect_name:str, sql_path:str=CREATE_TABLE_SQL_PATH):
+    """
+    Split create_table.sql into statements for the given dialect.
+    SQLite cannot add foreign keys with ALTER TABLE and does not know DROP ... CASCADE, so those are adapted
+
+    Params:
+        dialect_name (str): SQLAlchemy dialect name, e.g. "postgresql" or "sqlite"
+        sql_path (str, optional): Path of the schema file. Defaults to create_table.sql
+
+    Returns:
+        statements (List[str]): SQL statements in file order
+    """
+    with open(sql_path, "r", encoding="utf-8") as file:
+        sql = file.read()
+    sql = re.sub(r"--[^\n]*", "", sql)
+    statements = [statement.strip() for statement in sql.split(";") if statement.strip()]
+    if dialect_name == "sqlite":
+        statements = [statement.replace(" CASCADE", "") for statement in statements if not re.match(r"ALTER TABLE .* ADD FOREIGN KEY", statement, re.S)]
+    return statements
+
+def create_tables(engine:sqlalchemy.engine.base.Engine, sql_path:str=CREATE_TABLE_SQL_PATH):
+    """
+    (Re)creates every table of create_table.sql. Existing pipeline tables are dropped
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        sql_path (str, optional): Path of the schema file. Defaults to create_table.sql
+    """
+    statements = get_schema_statements(engine.dialect.name, sql_path)
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(sqlalchemy.text(statement))
+    logger.info(f"Created tables from {sql_path}")
@@ -0,0 +1,23 @@
+import sqlalchemy
+from typing import Dict
+
+#Work items of the worker mode (see pipeline.worker), as in create_table.sql
+WORK_ITEM_TABLE = "work_item"
+
+
+def get_queue_stats(engine:sqlalchemy.engine.base.Engine) -> Dict[str,Dict[str,int]]:
+    """
+    Number of work items per kind and status. Only needs SQLAlchemy, so `main.py status`
+    can show the queue without importing the pipeline
+
+    Returns:
+        queue_stats (Dict[str,Dict[str,int]]): Counts keyed by kind, then by status
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(sqlalchemy.text(
+            f'SELECT "kind", "status", count(*) FROM "{WORK_ITEM_TABLE}" GROUP BY "kind", "status"'
+        )).fetchall()
+    queue_stats = {}
+    for kind, status, total_records in rows:
+        queue_stats.setdefault(kind, {})[status] = total_records
+    return queue_stats
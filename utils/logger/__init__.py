@@ -1,19 +1,135 @@
 from logging import *
+import logging
+import logging.handlers
+import atexit
+import json
+import os
+import queue
 from datetime import datetime
 
-today = datetime.now().strftime("%Y-%m-%d")
+#Configuration
+LOG_DIR = os.getenv("LOG_DIR", "log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10*1024*1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+#Third-party loggers are quiet by default, override with LOG_LEVELS="urllib3=DEBUG,sqlalchemy.engine=INFO"
+DEFAULT_LOGGER_LEVELS = {"urllib3":"WARNING", "requests":"WARNING", "sqlalchemy":"WARNING"}
 
+_listener = None
 
 
-basicConfig(
-    filename=f"log/{today}.log",
-    encoding="utf-8",
-    filemode="a",
-    format="{asctime},{levelname},{message}",
-    style="{",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    level=NOTSET
-)
+class DailyRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    Writes to {directory}/{YYYY-MM-DD}.log and switches to a new file when the date changes,
+    so a long-running process keeps the one-file-per-day layout. A file growing over max_bytes
+    is rotated to {YYYY-MM-DD}.1.log, {YYYY-MM-DD}.2.log, ... keeping backup_count pieces per day
 
+    Params:
+        directory (str): Log folder
+        max_bytes (int): Size that triggers a rotation, 0 to disable
+        backup_count (int): Rotated pieces kept per day. With 0 the file is never rotated by size,
+            like logging.handlers.RotatingFileHandler
+    """
+    def __init__(self, directory:str, max_bytes:int=0, backup_count:int=0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.day = self.get_day()
+        super().__init__(self.get_filename(self.day), mode="a", encoding="utf-8", delay=True)
 
+    def get_day(self) -> str:
+        return datetime.now().strftime("%Y-%m-%d")
 
+    def get_filename(self, day:str, piece:int=0) -> str:
+        return os.path.abspath(os.path.join(self.directory, f"{day}.{piece}.log" if piece else f"{day}.log"))
+
+    def shouldRollover(self, record) -> bool:
+        if self.get_day() != self.day:
+            return True
+        if self.max_bytes > 0 and self.backup_count > 0 and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        day = self.get_day()
+        if day != self.day:
+            self.day = day
+            self.baseFilename = self.get_filename(day)
+        else:
+            for piece in range(self.backup_count - 1, 0, -1):
+                source = self.get_filename(day, piece)
+                if os.path.exists(source):
+                    os.replace(source, self.get_filename(day, piece + 1))
+            os.replace(self.baseFilename, self.get_filename(day, 1))
+        self.stream = self._open()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON lines with time, level, logger name and message"""
+    def format(self, record) -> str:
+        entry = {
+            "time":self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level":record.levelname,
+            "logger":record.name,
+            "message":record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def get_logger_levels(overrides:str=None):
+    """Merges DEFAULT_LOGGER_LEVELS with "name=LEVEL" pairs separated by commas (LOG_LEVELS by default)"""
+    levels = dict(DEFAULT_LOGGER_LEVELS)
+    overrides = os.getenv("LOG_LEVELS", "") if overrides is None else overrides
+    for pair in overrides.split(","):
+        name, _, level = pair.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def setup_logging(directory:str=LOG_DIR, level:str=LOG_LEVEL, log_format:str=LOG_FORMAT):
+    """
+    Configures the root logger once: records are put on an in-memory queue by a QueueHandler and
+    written to the daily rotating file by a background QueueListener thread, so logging never waits
+    on disk I/O in the calling thread. Calling it again does nothing.
+    Entry points (main.py, daemon.py) call it before running; until then records go to the logging defaults
+
+    Params:
+        directory (str, optional): Log folder. Defaults to LOG_DIR
+        level (str, optional): Level of the root logger. Defaults to LOG_LEVEL
+        log_format (str, optional): "text" (asctime,levelname,message) or "json" (JSON lines). Defaults to LOG_FORMAT
+    """
+    global _listener
+    if _listener is not None:
+        return
+    file_handler = DailyRotatingFileHandler(directory=directory, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT)
+    if log_format == "json":
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(Formatter(fmt="{asctime},{levelname},{message}", style="{", datefmt="%Y-%m-%d %H:%M:%S"))
+
+    log_queue = queue.SimpleQueue()
+    root = getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    for name, logger_level in get_logger_levels().items():
+        getLogger(name).setLevel(logger_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Stops the background writer after flushing the queued records"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
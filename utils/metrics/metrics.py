@@ -0,0 +1,186 @@
+import os
+import json
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from time import perf_counter, time
+from typing import Dict, List
+
+#Constants
+METRICS_DIR = os.getenv("METRICS_DIR", "log")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "False")
+HTTP_LATENCY_BUCKETS:List[float] = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+_lock = threading.RLock()
+_run = {}
+
+
+def reset(run_id:str=None):
+    """Start a new run: clears every metric and sets the run id (random when not given)."""
+    with _lock:
+        _run.clear()
+        _run.update({
+            "run_id":run_id or uuid.uuid4().hex[:12],
+            "started_at":time(),
+            "spans":{},
+            "http":{},
+            "tables":{},
+            "counters":{},
+        })
+
+def _get(section:str, key:str, default):
+    if not _run:
+        reset()
+    return _run[section].setdefault(key, default)
+
+def record_span(name:str, seconds:float):
+    """Add a duration to the span (timer) with the given name"""
+    with _lock:
+        span = _get("spans", name, {"count":0, "total":0.0, "max":0.0})
+        span["count"] += 1
+        span["total"] += seconds
+        span["max"] = max(span["max"], seconds)
+
+@contextmanager
+def span(name:str):
+    """
+    Time a block of code, e.g.
+    ```python
+    with metrics.span("extract_task"):
+        ...
+    ```
+    """
+    start_time = perf_counter()
+    try:
+        yield
+    finally:
+        if METRICS_ENABLED:
+            record_span(name, perf_counter() - start_time)
+
+def timed(name:str=None):
+    """Decorator timing every call of a function, the span name defaults to module.function"""
+    def decorator(function):
+        span_name = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def observe_http(endpoint:str, seconds:float, status:int):
+    """Record the latency and status of one HTTP request"""
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        http = _get("http", endpoint, {"count":0, "sum":0.0, "buckets":[0]*len(HTTP_LATENCY_BUCKETS), "statuses":{}})
+        http["count"] += 1
+        http["sum"] += seconds
+        for index, bound in enumerate(HTTP_LATENCY_BUCKETS):
+            if seconds <= bound:
+                http["buckets"][index] += 1
+        http["statuses"][str(status)] = http["statuses"].get(str(status), 0) + 1
+
+def count_rows(table_name:str, rows_in:int, rows_out:int, stage:str="load"):
+    """
+    Record rows received and kept by a stage for a table. For the load stage, rows_in - rows_out are
+    duplicates skipped by the database, giving the dedup hit rate
+    """
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        table = _get("tables", table_name, {})
+        rows = table.setdefault(stage, {"rows_in":0, "rows_out":0})
+        rows["rows_in"] += int(rows_in)
+        rows["rows_out"] += int(rows_out)
+
+def increment(name:str, value:float=1):
+    """Increment a free-form counter, e.g. cache hits"""
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _get("counters", name, 0)
+        _run["counters"][name] += value
+
+def get_run_record() -> Dict[str,any]:
+    """
+    Returns the metrics of the current run as a JSON serializable dictionary, with the dedup hit rate
+    (share of rows skipped as duplicates) of every table and stage
+    """
+    with _lock:
+        if not _run:
+            reset()
+        record = json.loads(json.dumps(_run))
+    record["finished_at"] = time()
+    record["duration"] = record["finished_at"] - record["started_at"]
+    for table in record["tables"].values():
+        for rows in table.values():
+            rows["dedup_hit_rate"] = 1 - rows["rows_out"] / rows["rows_in"] if rows["rows_in"] else 0.0
+    return record
+
+def _escape(value:str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def to_prometheus(record:Dict[str,any], prefix:str="spotify_etl") -> str:
+    """Format a run record in the Prometheus text exposition format"""
+    lines = [
+        f"# HELP {prefix}_last_run_timestamp_seconds End of the last pipeline run",
+        f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+        f"{prefix}_last_run_timestamp_seconds {record['finished_at']}",
+        f"# TYPE {prefix}_last_run_duration_seconds gauge",
+        f"{prefix}_last_run_duration_seconds {record['duration']}",
+        f"# TYPE {prefix}_span_seconds summary",
+    ]
+    for name, span in sorted(record["spans"].items()):
+        lines.append(f'{prefix}_span_seconds_sum{{span="{_escape(name)}"}} {span["total"]}')
+        lines.append(f'{prefix}_span_seconds_count{{span="{_escape(name)}"}} {span["count"]}')
+    lines.append(f"# TYPE {prefix}_http_request_duration_seconds histogram")
+    for endpoint, http in sorted(record["http"].items()):
+        label = f'endpoint="{_escape(endpoint)}"'
+        for bound, count in zip(HTTP_LATENCY_BUCKETS, http["buckets"]):
+            lines.append(f'{prefix}_http_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'{prefix}_http_request_duration_seconds_bucket{{{label},le="+Inf"}} {http["count"]}')
+        lines.append(f'{prefix}_http_request_duration_seconds_sum{{{label}}} {http["sum"]}')
+        lines.append(f'{prefix}_http_request_duration_seconds_count{{{label}}} {http["count"]}')
+    lines.append(f"# TYPE {prefix}_http_responses gauge")
+    for endpoint, http in sorted(record["http"].items()):
+        for status, count in sorted(http["statuses"].items()):
+            lines.append(f'{prefix}_http_responses{{endpoint="{_escape(endpoint)}",status="{status}"}} {count}')
+    #Every sample of a metric must follow its TYPE line, without samples of another metric in between
+    table_rows = [(f'table="{_escape(table_name)}",stage="{_escape(stage)}"', rows)
+                  for table_name, table in sorted(record["tables"].items()) for stage, rows in sorted(table.items())]
+    lines.append(f"# TYPE {prefix}_rows gauge")
+    for labels, rows in table_rows:
+        lines.append(f'{prefix}_rows{{{labels},direction="in"}} {rows["rows_in"]}')
+        lines.append(f'{prefix}_rows{{{labels},direction="out"}} {rows["rows_out"]}')
+    lines.append(f"# TYPE {prefix}_dedup_hit_rate gauge")
+    for labels, rows in table_rows:
+        lines.append(f'{prefix}_dedup_hit_rate{{{labels}}} {rows["dedup_hit_rate"]}')
+    lines.append(f"# TYPE {prefix}_counter gauge")
+    for name, value in sorted(record["counters"].items()):
+        lines.append(f'{prefix}_counter{{name="{_escape(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+def export_run(directory:str=METRICS_DIR) -> Dict[str,any]:
+    """
+    Write the current run next to the log files:
+        - metrics.jsonl: one JSON record appended per run, to compare runs over time
+        - metrics.prom: Prometheus textfile of the last run, replaced atomically
+
+    Returns:
+        record (Dict[str,any]): The exported run record
+    """
+    record = get_run_record()
+    if not METRICS_ENABLED:
+        return record
+    record["exported_at"] = datetime.now().isoformat(timespec="seconds")
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "metrics.jsonl"), "a", encoding="utf-8") as file:
+        file.write(json.dumps(record) + "\n")
+    prom_path = os.path.join(directory, "metrics.prom")
+    with open(f"{prom_path}.tmp", "w", encoding="utf-8") as file:
+        file.write(to_prometheus(record))
+    os.replace(f"{prom_path}.tmp", prom_path)
+    return record
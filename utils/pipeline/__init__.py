@@ -1,7 +1,23 @@
-# from .extract import *
-# from .load import *
-# from .transform import *
+import importlib
 
-from . import extract as Extract
-from . import load as Load
-from . import transform as Transform
\ No newline at end of file
+#Pipeline modules are imported on first access (PEP 562), e.g. `from utils.pipeline import Crawl` does not load pandas
+_MODULES = {
+    "Extract":"extract",
+    "Load":"load",
+    "Transform":"transform",
+    "Crawl":"crawl",
+    "Stream":"stream",
+    "Refresh":"refresh",
+    "Sink":"sink",
+    "Worker":"worker",
+    "Enrich":"enrich",
+}
+
+
+def __getattr__(name:str):
+    if name in _MODULES:
+        return importlib.import_module(f".{_MODULES[name]}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(_MODULES))
@@ -0,0 +1,187 @@
+import os
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
+import sqlalchemy
+from .. import logger
+
+#Crawl configuration
+CRAWL_GENRES = [genre.strip() for genre in os.getenv("CRAWL_GENRES", "dubstep").split(",") if genre.strip()]
+CRAWL_YEAR_PARTITIONS = [years.strip() for years in os.getenv("CRAWL_YEAR_PARTITIONS", "").split(",") if years.strip()]
+CRAWL_PAGES_PER_RUN = int(os.getenv("CRAWL_PAGES_PER_RUN", 4))
+SEARCH_LIMIT = 50
+#Spotify search returns nothing past this offset
+MAX_SEARCH_OFFSET = 1000
+
+CHECKPOINT_TABLE = "crawl_checkpoint"
+
+
+def ensure_checkpoint_table(engine:sqlalchemy.engine.base.Engine):
+    """Creates the checkpoint table if it does not exist yet (same definition as in create_table.sql)."""
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text(
+            f'CREATE TABLE IF NOT EXISTS "{CHECKPOINT_TABLE}" ('
+            '"genre" text NOT NULL, "query_partition" text NOT NULL, "next_offset" integer NOT NULL DEFAULT 0, '
+            '"exhausted" boolean NOT NULL DEFAULT FALSE, "updated_at" timestamp, PRIMARY KEY ("genre", "query_partition"))'
+        ))
+
+def get_partitions(genres:List[str]=None, year_partitions:List[str]=None):
+    """
+    Build the list of crawl partitions: every genre, split by year range when given.
+    Each partition is a separate search query, so each one has its own 1000 offset cap
+
+    Params:
+        genres (List[str], optional): Genres to crawl. Defaults to CRAWL_GENRES
+        year_partitions (List[str], optional): Year ranges such as "2010-2019". Defaults to CRAWL_YEAR_PARTITIONS
+
+    Returns:
+        partitions (List[Dict[str,str]]): A list of partitions, containing:
+            - genre (str): The genre
+            - query_partition (str): The year range, empty string when not partitioned
+            - query (str): The search query
+    """
+    genres = CRAWL_GENRES if genres is None else genres
+    year_partitions = CRAWL_YEAR_PARTITIONS if year_partitions is None else year_partitions
+    partitions = []
+    for genre in genres:
+        for years in (year_partitions or [""]):
+            query = f"genre:{genre} year:{years}" if years else f"genre:{genre}"
+            partitions.append({"genre":genre, "query_partition":years, "query":query})
+    return partitions
+
+def get_checkpoints(engine:sqlalchemy.engine.base.Engine):
+    """
+    Retrieves stored checkpoints
+
+    Returns:
+        checkpoints (Dict[tuple,Dict[str,any]]): next_offset and exhausted keyed by (genre, query_partition)
+    """
+    with engine.begin() as conn:
+        rows = conn.execute(sqlalchemy.text(
+            f'SELECT "genre", "query_partition", "next_offset", "exhausted" FROM "{CHECKPOINT_TABLE}"'
+        )).fetchall()
+    return {(genre, query_partition):{"next_offset":next_offset, "exhausted":bool(exhausted)} for genre, query_partition, next_offset, exhausted in rows}
+
+def plan_pages(engine:sqlalchemy.engine.base.Engine, partitions:List[Dict[str,str]]=None, pages:int=CRAWL_PAGES_PER_RUN, limit:int=SEARCH_LIMIT):
+    """
+    Choose the search pages of the next run. Pages are handed out round-robin over the partitions
+    that are not exhausted, starting at each partition's checkpoint
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        partitions (List[Dict[str,str]], optional): From get_partitions. Defaults to get_partitions()
+        pages (int, optional): Number of pages of the run. Defaults to CRAWL_PAGES_PER_RUN
+        limit (int, optional): Number of tracks per page. Defaults to SEARCH_LIMIT
+
+    Returns:
+        plan (List[Dict[str,any]]): A list of pages, each a partition with its offset and limit
+    """
+    partitions = get_partitions() if partitions is None else partitions
+    checkpoints = get_checkpoints(engine)
+    next_offsets = {}
+    for partition in partitions:
+        checkpoint = checkpoints.get((partition["genre"], partition["query_partition"]), {"next_offset":0, "exhausted":False})
+        if not checkpoint["exhausted"]:
+            next_offsets[(partition["genre"], partition["query_partition"])] = checkpoint["next_offset"]
+
+    plan = []
+    active = [partition for partition in partitions if (partition["genre"], partition["query_partition"]) in next_offsets]
+    while len(plan) < pages and active:
+        for partition in list(active):
+            if len(plan) == pages:
+                break
+            key = (partition["genre"], partition["query_partition"])
+            offset = next_offsets[key]
+            if offset + limit >= MAX_SEARCH_OFFSET:
+                active.remove(partition)
+                continue
+            plan.append({**partition, "offset":offset, "limit":limit})
+            next_offsets[key] = offset + limit
+    return plan
+
+def fetch_pages(plan:List[Dict[str,any]], token:Dict[str,any], max_workers:int=None):
+    """
+    Fetch the planned search pages concurrently. extract (and with it requests) is imported here,
+    so that planning pages (`main.py dry-run`, `main.py status`) does not load the Spotify client
+
+    Params:
+        plan (List[Dict[str,any]]): Pages from plan_pages
+        token (Dict[str,any]): Spotify authentication token
+        max_workers (int, optional): Maximum number of requests in flight. Defaults to EXTRACT_MAX_WORKERS
+
+    Returns:
+        pages (List[Dict[str,any]]): The planned pages, each with the response under "tracks"
+    """
+    def fetch(page):
+        tracks = Extract.get_tracks_by_query(query=page["query"], token=token, offset=page["offset"], limit=page["limit"])
+        return {**page, "tracks":tracks}
+
+    from . import extract as Extract
+    max_workers = Extract.EXTRACT_MAX_WORKERS if max_workers is None else max_workers
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(fetch, plan))
+
+def get_next_checkpoints(pages:List[Dict[str,any]]):
+    """
+    Compute the checkpoint of each crawled partition after the given pages are loaded.
+    A partition is exhausted when a page is not full, has no next page, or the next page would pass the offset cap
+
+    Params:
+        pages (List[Dict[str,any]]): Fetched pages from fetch_pages
+
+    Returns:
+        checkpoints (List[Dict[str,any]]): genre, query_partition, next_offset and exhausted per partition
+    """
+    checkpoints:Dict[tuple,Dict[str,any]] = {}
+    for page in pages:
+        key = (page["genre"], page["query_partition"])
+        next_offset = page["offset"] + page["limit"]
+        tracks = page["tracks"]
+        exhausted = (
+            len(tracks["items"]) < page["limit"]
+            or tracks.get("next") is None
+            or next_offset + page["limit"] >= MAX_SEARCH_OFFSET
+        )
+        checkpoint = checkpoints.setdefault(key, {"genre":page["genre"], "query_partition":page["query_partition"], "next_offset":0, "exhausted":False})
+        checkpoint["next_offset"] = max(checkpoint["next_offset"], next_offset)
+        checkpoint["exhausted"] = checkpoint["exhausted"] or exhausted
+    return list(checkpoints.values())
+
+def get_genre_track_ids(pages:List[Dict[str,any]]):
+    """
+    Track ids of every crawled genre, so that the rows of a run over several genres can be written per genre
+
+    Params:
+        pages (List[Dict[str,any]]): Fetched pages from fetch_pages
+
+    Returns:
+        genre_track_ids (Dict[str,List[str]]): Track ids keyed by genre, in crawl order
+    """
+    genre_track_ids:Dict[str,List[str]] = {}
+    for page in pages:
+        genre_track_ids.setdefault(page["genre"], []).extend(item["id"] for item in page["tracks"]["items"])
+    return genre_track_ids
+
+def save_checkpoints(engine:sqlalchemy.engine.base.Engine, checkpoints:List[Dict[str,any]]):
+    """
+    Store checkpoints from get_next_checkpoints. Call it only once the pages are loaded,
+    so a failed run is crawled again from the same offsets. A checkpoint never moves back, so workers
+    that finish pages of the same partition out of order (see pipeline.worker) keep the furthest offset
+    """
+    if not checkpoints:
+        return
+    now = datetime.now()
+    with engine.begin() as conn:
+        for checkpoint in checkpoints:
+            params = {**checkpoint, "updated_at":now}
+            conn.execute(sqlalchemy.text(
+                f'INSERT INTO "{CHECKPOINT_TABLE}" ("genre", "query_partition", "next_offset", "exhausted", "updated_at") '
+                'VALUES (:genre, :query_partition, :next_offset, :exhausted, :updated_at) ON CONFLICT ("genre", "query_partition") DO NOTHING'
+            ), params)
+            conn.execute(sqlalchemy.text(
+                f'UPDATE "{CHECKPOINT_TABLE}" SET "next_offset" = CASE WHEN "next_offset" > :next_offset THEN "next_offset" ELSE :next_offset END, '
+                '"exhausted" = ("exhausted" OR :exhausted), "updated_at" = :updated_at '
+                'WHERE "genre" = :genre AND "query_partition" = :query_partition'
+            ), params)
+    for checkpoint in checkpoints:
+        logger.info(f"Crawl checkpoint {checkpoint['genre']} {checkpoint['query_partition']}: offset {checkpoint['next_offset']}{', exhausted' if checkpoint['exhausted'] else ''}")
@@ -0,0 +1,135 @@
+import os
+from datetime import datetime
+from typing import Dict, List, Set
+import sqlalchemy
+import pandas as pd
+from . import extract as Extract
+from . import transform as Transform
+from . import refresh as Refresh
+from .. import spotify, logger, metrics
+from ..database.maintenance import ENRICHMENT_COLUMNS
+
+#Fetch the full album and track objects of new ids before loading them
+ENRICH_ENABLED = os.getenv("ENRICH_ENABLED", "1") not in ("0", "false", "False")
+#Rows stored before enrichment existed that `main.py enrich` completes per run
+ENRICH_ALBUM_LIMIT = int(os.getenv("ENRICH_ALBUM_LIMIT", 1000))
+ENRICH_TRACK_LIMIT = int(os.getenv("ENRICH_TRACK_LIMIT", 1000))
+#Ids per query when looking up stored ids
+LOOKUP_BATCH_SIZE = 500
+
+#Multi-id endpoint of each table
+_FETCH_DETAILS = {
+    "album":Extract.get_album_details_from_ids,
+    "track":Extract.get_track_details_from_ids,
+}
+
+
+def get_stored_ids(engine:sqlalchemy.engine.base.Engine, table_name:str, ids:List[str]) -> Set[str]:
+    """
+    Retrieves which of the given ids are already stored, looking them up by primary key
+    instead of reading every id of the table
+
+    Returns:
+        stored_ids (Set[str]): The ids found in table_name
+    """
+    if table_name not in ENRICHMENT_COLUMNS:
+        raise ValueError(f"Table name {table_name} is not supported")
+    stmt = sqlalchemy.text(f'SELECT "id" FROM "{table_name}" WHERE "id" IN :ids').bindparams(sqlalchemy.bindparam("ids", expanding=True))
+    stored_ids = set()
+    with engine.connect() as conn:
+        for batch in Extract.chunk_ids(list(ids), LOOKUP_BATCH_SIZE):
+            stored_ids.update(row[0] for row in conn.execute(stmt, {"ids":batch}))
+    return stored_ids
+
+@metrics.timed()
+def get_enrichment(engine:sqlalchemy.engine.base.Engine, columns:Dict[str,Dict[str,list]], token:Dict[str,any]=None,
+                   seen_ids:Dict[str,Set[str]]=None):
+    """
+    Fetch the full objects of the albums and tracks of a batch that are not stored yet, with the multi-id
+    endpoints (20 albums or 50 tracks per request). Stored rows are skipped: they were enriched when
+    loaded, or are left to `main.py enrich`. Tracks from search already are full objects, so only
+    the ones without popularity are requested
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        columns (Dict[str,Dict[str,list]]): From extract.flatten_tracks
+        token (Dict[str,any], optional): Spotify authentication token
+        seen_ids (Dict[str,Set[str]], optional): Ids already requested by earlier batches of the run, keyed by table.
+            They are skipped and the requested ids are added
+
+    Returns:
+        enrichment (Dict[str,Dict[str,list]]): Per table "album" and "track", containing:
+            - ids (List[str]): Ids requested
+            - details (List[Dict[str,any]]): Details returned, see extract.parse_album_doc and extract.parse_track_doc
+    """
+    candidates = {
+        "album":list(dict.fromkeys(columns["album"]["id"])),
+        "track":list(dict.fromkeys(track_id for track_id, popularity in zip(columns["track"]["id"], columns["track"]["popularity"]) if popularity is None)),
+    }
+    enrichment = {}
+    for table_name, ids in candidates.items():
+        skipped = set(seen_ids.get(table_name, ())) if seen_ids is not None else set()
+        ids = [row_id for row_id in ids if row_id not in skipped]
+        stored_ids = get_stored_ids(engine, table_name, ids) if ids else set()
+        new_ids = [row_id for row_id in ids if row_id not in stored_ids]
+        enrichment[table_name] = {"ids":new_ids, "details":_FETCH_DETAILS[table_name](new_ids, token=token)}
+        if seen_ids is not None:
+            seen_ids.setdefault(table_name, set()).update(new_ids)
+        metrics.increment(f"enrich.{table_name}.requested", len(new_ids))
+        metrics.increment(f"enrich.{table_name}.skipped", len(candidates[table_name]) - len(new_ids))
+    logger.info(f"Enriched {len(enrichment['album']['ids'])} new albums and {len(enrichment['track']['ids'])} new tracks")
+    return enrichment
+
+def get_unenriched_ids(engine:sqlalchemy.engine.base.Engine, table_name:str, limit:int):
+    """Retrieves up to limit ids of rows that were never enriched, using the enriched_at index"""
+    if table_name not in ENRICHMENT_COLUMNS:
+        raise ValueError(f"Table name {table_name} is not supported")
+    with engine.begin() as conn:
+        rows = conn.execute(sqlalchemy.text(
+            f'SELECT "id" FROM "{table_name}" WHERE "enriched_at" IS NULL LIMIT :limit'
+        ), {"limit":limit}).fetchall()
+    return [row[0] for row in rows]
+
+@metrics.timed()
+def enrich_stored_rows(engine:sqlalchemy.engine.base.Engine, table_name:str, token:Dict[str,any], limit:int):
+    """
+    Enrich rows stored before the enrichment stage existed. enriched_at is set on every selected row,
+    including the ones no longer on Spotify, so that they are not requested again
+
+    Returns:
+        enrich_stats (Dict[str,int]): selected, fetched and changed
+    """
+    row_ids = get_unenriched_ids(engine, table_name, limit)
+    if not row_ids:
+        return {"selected":0, "fetched":0, "changed":0}
+    enriched_at = datetime.now()
+    details = _FETCH_DETAILS[table_name](row_ids, token=token)
+    enrichment_columns = list(ENRICHMENT_COLUMNS[table_name])
+    df = Transform.cast_enrichment_columns(pd.DataFrame(details, columns=["id", *enrichment_columns]), table_name)
+    with engine.begin() as conn:
+        changed = Refresh.update_changed_rows(conn, table_name, df, enrichment_columns)
+        Refresh.set_fetched_at(conn, table_name, row_ids, enriched_at, column="enriched_at")
+    metrics.count_rows(table_name, rows_in=len(row_ids), rows_out=changed, stage="enrich")
+    return {"selected":len(row_ids), "fetched":len(details), "changed":changed}
+
+def run_enrichment(engine:sqlalchemy.engine.base.Engine, album_limit:int=ENRICH_ALBUM_LIMIT, track_limit:int=ENRICH_TRACK_LIMIT):
+    """
+    Enrich the stored albums and tracks that were never enriched. Each run costs at most
+    album_limit / 20 + track_limit / 50 API requests
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        album_limit (int, optional): Albums enriched. Defaults to ENRICH_ALBUM_LIMIT
+        track_limit (int, optional): Tracks enriched. Defaults to ENRICH_TRACK_LIMIT
+
+    Returns:
+        enrich_stats (Dict[str,Dict[str,int]]): Stats of enrich_stored_rows keyed by table
+    """
+    token = spotify.get_token()
+    enrich_stats = {
+        "album":enrich_stored_rows(engine=engine, table_name="album", token=token, limit=album_limit),
+        "track":enrich_stored_rows(engine=engine, table_name="track", token=token, limit=track_limit),
+    }
+    for table_name, stats in enrich_stats.items():
+        logger.info(f"Enriched {stats['selected']} stored {table_name}s, {stats['fetched']} found and {stats['changed']} changed")
+    return enrich_stats
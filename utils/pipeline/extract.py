@@ -1,9 +1,17 @@
 from typing import List, Dict
-import requests
-from .. import spotify, logger
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+from urllib.parse import quote
+from .. import spotify, logger, cache, metrics
+from .crawl import MAX_SEARCH_OFFSET
 import sqlalchemy
 
-SPOTIFY_API_URL_PREFIX = "https://api.spotify.com/v1"
+SPOTIFY_API_URL_PREFIX = spotify.SPOTIFY_API_URL_PREFIX
+MAX_ARTIST_IDS_PER_REQUEST = 50
+MAX_ALBUM_IDS_PER_REQUEST = 20
+MAX_TRACK_IDS_PER_REQUEST = 50
+EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", 4))
 
 
 def get_tracks_by_genre(genre:str, token:Dict[str,any],offset:int=0,limit:int=20):
@@ -20,16 +28,168 @@ def get_tracks_by_genre(genre:str, token:Dict[str,any],offset:int=0,limit:int=20
         tracks (Dict[str,any]): A response detail from Spotify API
     
     """
-    if offset+limit >= 1000:
+    return get_tracks_by_query(query=f"genre:{genre}", token=token, offset=offset, limit=limit)
+
+@metrics.timed()
+def get_tracks_by_query(query:str, token:Dict[str,any], offset:int=0, limit:int=20):
+    """
+    Fetch tracks matching a search query from Spotify
+
+    Params:
+        query (str): Search query, with field filters such as "genre:dubstep year:2010-2019"
+        token (Dict[str,any]): Spotify authentication token
+        offset (int, optional): Pagination offset, Default to 0
+        limit (int, optional): Number of tracks to fetch per request. Defaults to 20
+
+    Returns:
+        tracks (Dict[str,any]): A response detail from Spotify API
+    """
+    if offset+limit >= MAX_SEARCH_OFFSET:
         logger.error("Exceed maximum offset")
         raise ValueError("Exceed maximum offset")
-    ENDPOINT = f"{SPOTIFY_API_URL_PREFIX}/search?q=genre:{genre}&type=track&offset={offset}&limit={limit}"
-    headers = spotify.get_auth_header(token=token)
-    response = requests.get(url=ENDPOINT, headers=headers)
+    ENDPOINT = f"{SPOTIFY_API_URL_PREFIX}/search?q={quote(query, safe=':')}&type=track&offset={offset}&limit={limit}"
+    response = spotify.authorized_get(url=ENDPOINT, token=token)
+    response.raise_for_status()
     tracks = response.json()['tracks']
-    logger.info(f"Get {genre} tracks from Spotify API")
+    logger.info(f"Get {query} tracks from Spotify API")
+    return tracks
+
+def merge_track_pages(pages:List[Dict[str,any]]):
+    """
+    Merge several search pages into one, so that the *_from_tracks functions can be used unchanged
+
+    Params:
+        pages (List[Dict[str,any]]): tracks from get_tracks_by_query, in offset order
+
+    Returns:
+        tracks (Dict[str,any]): The first page with the items of all pages
+    """
+    if not pages:
+        return {"items":[]}
+    tracks = dict(pages[0])
+    tracks['items'] = [item for page in pages for item in page['items']]
+    tracks['limit'] = len(tracks['items'])
+    tracks['next'] = pages[-1].get('next')
     return tracks
 
+def iter_track_pages(plan:List[Dict[str,any]], token:Dict[str,any]):
+    """
+    Fetch search pages one at a time, as a generator
+
+    Params:
+        plan (List[Dict[str,any]]): Pages to fetch, each with query, offset and limit (see crawl.plan_pages)
+        token (Dict[str,any]): Spotify authentication token
+
+    Yields:
+        page (Dict[str,any]): The planned page with the response under "tracks"
+    """
+    for page in plan:
+        tracks = get_tracks_by_query(query=page["query"], token=token, offset=page["offset"], limit=page["limit"])
+        yield {**page, "tracks":tracks}
+
+@metrics.timed()
+def extract_from_tracks(tracks:Dict[str,any], token:Dict[str,any]=None):
+    """
+    Extract every entity of the pipeline from search results, fetching the artist details
+
+    Params:
+        tracks (Dict[str,any]): tracks from get_tracks_by_query or merge_track_pages
+        token (Dict[str,any], optional): Spotify authentication token
+
+    Returns:
+        extract_result (Dict[str,any]): A dictionary containing:
+            - artist (List[Dict[str,str]]): Artist details, see get_artist_detail
+            - artist_genre (Dict[str,List[str]]): Genres keyed by artist id
+            - columns (Dict[str,Dict[str,list]]): Column arrays from flatten_tracks
+    """
+    columns = flatten_tracks(tracks)
+    artists = get_artist_details_from_ids(columns.pop("artist_ids"), token=token)
+    return {
+        "artist":artists,
+        "artist_genre":get_artist_genre_from_artist_details(artist_details=artists),
+        "columns":columns}
+
+@metrics.timed()
+def flatten_tracks(tracks:Dict[str,any]):
+    """
+    Flatten search results into column arrays for every entity, in a single pass over the items.
+    Gives the same rows as the get_*_from_tracks functions without building one dictionary per row
+
+    Params:
+        tracks (Dict[str,any]): tracks from get_tracks_by_query or merge_track_pages
+
+    Returns:
+        columns (Dict[str,Dict[str,list]]): Column arrays keyed by table, containing:
+            - track: id, name, url, duration_ms, release_date, release_date_precision, is_single, explicit, popularity, isrc, track_number, disc_number
+            - album: id, name, release_date, release_date_precision, album_url, total_tracks, type, image_640_url, image_300_url, image_64_url
+            - artist_track: artist_id, track_id
+            - artist_album: artist_id, album_id
+            - track_album: track_id, album_id
+            - artist_ids (List[str]): Unique ids of track and album artists
+    """
+    track = {key:[] for key in ["id", "name", "url", "duration_ms", "release_date", "release_date_precision", "is_single", "explicit",
+                                "popularity", "isrc", "track_number", "disc_number"]}
+    album = {key:[] for key in ["id", "name", "release_date", "release_date_precision", "album_url", "total_tracks", "type", "image_640_url", "image_300_url", "image_64_url"]}
+    artist_track = {"artist_id":[], "track_id":[]}
+    artist_album = {"artist_id":[], "album_id":[]}
+    track_album = {"track_id":[], "album_id":[]}
+    artist_ids = {}
+
+    for item in tracks['items']:
+        track_id = item['id']
+        item_album = item['album']
+        album_id = item_album['id']
+        release_date = item_album['release_date']
+        release_date_precision = item_album.get('release_date_precision')
+        images = item_album.get('images') or []
+
+        track["id"].append(track_id)
+        track["name"].append(item['name'])
+        track["url"].append(item['external_urls']['spotify'])
+        track["duration_ms"].append(item['duration_ms'])
+        track["release_date"].append(release_date)
+        track["release_date_precision"].append(release_date_precision)
+        track["is_single"].append(item_album['album_type'] == 'single')
+        track["explicit"].append(item['explicit'])
+        #Search returns full track objects, simplified ones (without popularity) are enriched with get_track_details_from_ids
+        track["popularity"].append(item.get('popularity'))
+        track["isrc"].append((item.get('external_ids') or {}).get('isrc'))
+        track["track_number"].append(item.get('track_number'))
+        track["disc_number"].append(item.get('disc_number'))
+
+        album["id"].append(album_id)
+        album["name"].append(item_album['name'])
+        album["release_date"].append(release_date)
+        album["release_date_precision"].append(release_date_precision)
+        album["album_url"].append(item_album['external_urls']['spotify'])
+        album["total_tracks"].append(item_album['total_tracks'])
+        album["type"].append(item_album['type'])
+        album["image_640_url"].append(images[0]['url'] if len(images) > 0 else "")
+        album["image_300_url"].append(images[1]['url'] if len(images) > 1 else "")
+        album["image_64_url"].append(images[2]['url'] if len(images) > 2 else "")
+
+        track_album["track_id"].append(track_id)
+        track_album["album_id"].append(album_id)
+
+        for artist in item['artists']:
+            artist_id = artist['id']
+            artist_ids[artist_id] = None
+            artist_track["artist_id"].append(artist_id)
+            artist_track["track_id"].append(track_id)
+            artist_album["artist_id"].append(artist_id)
+            artist_album["album_id"].append(album_id)
+        for artist in item_album['artists']:
+            artist_ids[artist['id']] = None
+
+    return {
+        "track":track,
+        "album":album,
+        "artist_track":artist_track,
+        "artist_album":artist_album,
+        "track_album":track_album,
+        "artist_ids":list(artist_ids)}
+
+@metrics.timed()
 def get_track_details_from_tracks(tracks:Dict[str,any]):
     """
     Retrieves a list of track details 
@@ -67,6 +227,7 @@ def get_track_details_from_tracks(tracks:Dict[str,any]):
         
     return track_details
     
+@metrics.timed()
 def get_album_details_from_tracks(tracks:Dict[str,any]):
     """
     Retrieves a list of album details from tracks
@@ -88,6 +249,7 @@ def get_album_details_from_tracks(tracks:Dict[str,any]):
     album_details = []
     for item in tracks['items']:
         album = item['album']
+        images = album.get('images') or []
         album_artist_ids = [artist['id'] for artist in album['artists']]
         album_detail= {
             "id":album['id'],
@@ -97,14 +259,15 @@ def get_album_details_from_tracks(tracks:Dict[str,any]):
             'album_url':album['external_urls']['spotify'],
             'total_tracks':album['total_tracks'],
             "type":album['type'],
-            "image_640_url":album['images'][0]["url"] if album['images'] else "",
-            "image_300_url":album['images'][1]["url"] if album['images'] else "",
-            'image_64_url':album['images'][2]['url'] if album['images'] else ""
+            "image_640_url":images[0]["url"] if len(images) > 0 else "",
+            "image_300_url":images[1]["url"] if len(images) > 1 else "",
+            'image_64_url':images[2]['url'] if len(images) > 2 else ""
         }
         album_details.append(album_detail)
         
     return album_details
 
+@metrics.timed()
 def get_artist_track_from_tracks(tracks:Dict[str,any]):
     """
     Retrieves artist who procduces the track
@@ -125,6 +288,7 @@ def get_artist_track_from_tracks(tracks:Dict[str,any]):
             artist_track_dict[artist_id].append(track_id)
     return artist_track_dict
         
+@metrics.timed()
 def get_artist_album_dict_from_tracks(tracks:Dict[str,any]):
     """
     Retrieves artist who procduces the album
@@ -147,6 +311,7 @@ def get_artist_album_dict_from_tracks(tracks:Dict[str,any]):
             artist_album_dict[artist_id].append(album_id)
     return artist_album_dict
         
+@metrics.timed()
 def get_artist_detail(artist_id:str, token:Dict[str,any]):
     '''
     Retrieve artist information from Spotify
@@ -166,23 +331,203 @@ def get_artist_detail(artist_id:str, token:Dict[str,any]):
         
     '''
     ENDPOINT = f"{SPOTIFY_API_URL_PREFIX}/artists/{artist_id}"
-    headers = spotify.get_auth_header(token=token)
-    response = requests.get(url=ENDPOINT, headers=headers)
-    if response.status_code == 429:
-        logger.error("Exceed rate limit")
-        raise "Exceed rate limit"
+    response = spotify.authorized_get(url=ENDPOINT, token=token)
+    response.raise_for_status()
     artist_doc = response.json()
+    return parse_artist_doc(artist_doc)
+    
+def parse_artist_doc(artist_doc:Dict[str,any]):
+    '''
+    Map an artist object from Spotify API to an artist detail
+
+    Params:
+        artist_doc (Dict[str,any]): Artist object from Spotify API
+
+    Returns:
+        artist_detail (Dict[str,str]): A dictionary of artist detail, same shape as get_artist_detail
+    '''
+    images = artist_doc.get('images') or []
     artist_detail = {
         "id": artist_doc['id'],
         "name": artist_doc['name'],
         "url":artist_doc['external_urls']['spotify'],
         'genres':artist_doc['genres'],
-        'image_640_url':artist_doc['images'][0]['url'] if artist_doc['images'] else "",
-        'image_320_url':artist_doc['images'][1]['url'] if artist_doc['images'] else "",
-        'image_160_url':artist_doc['images'][2]['url'] if artist_doc['images'] else ""
+        'image_640_url':images[0]['url'] if len(images) > 0 else "",
+        'image_320_url':images[1]['url'] if len(images) > 1 else "",
+        'image_160_url':images[2]['url'] if len(images) > 2 else ""
     }
     return artist_detail
-    
+
+@metrics.timed()
+def get_several_artists(artist_ids:List[str], token:Dict[str,any]):
+    '''
+    Retrieve information of several artists from Spotify in a single request
+
+    Params:
+        artist_ids (List[str]): Spotify Ids of the artists, maximum 50
+        token (Dict[str,any]): Spotify authentication token
+
+    Returns:
+        artist_details (List[Dict[str,str]]): A list of artist details, same shape as get_artist_detail.
+            Unknown Ids (returned as null by Spotify) are skipped
+    '''
+    if len(artist_ids) > MAX_ARTIST_IDS_PER_REQUEST:
+        raise ValueError(f"Cannot request more than {MAX_ARTIST_IDS_PER_REQUEST} artists at once")
+    ENDPOINT = f"{SPOTIFY_API_URL_PREFIX}/artists?ids={','.join(artist_ids)}"
+    response = spotify.authorized_get(url=ENDPOINT, token=token)
+    response.raise_for_status()
+    artist_docs = response.json()['artists']
+    artist_details = [parse_artist_doc(artist_doc) for artist_doc in artist_docs if artist_doc is not None]
+    if len(artist_details) < len(artist_ids):
+        logger.warning(f"{len(artist_ids) - len(artist_details)} artist ids not found on Spotify")
+    return artist_details
+
+def parse_album_doc(album_doc:Dict[str,any]):
+    '''
+    Map an album object from Spotify API to an album detail
+
+    Params:
+        album_doc (Dict[str,any]): Album object from Spotify API, simplified (from a track) or full
+
+    Returns:
+        album_detail (Dict[str,any]): A dictionary of album detail, with the album columns of flatten_tracks,
+            and label, popularity and upc which only full album objects have (None otherwise)
+    '''
+    images = album_doc.get('images') or []
+    album_detail = {
+        "id": album_doc['id'],
+        "name": album_doc['name'],
+        "release_date": album_doc['release_date'],
+        "release_date_precision": album_doc.get('release_date_precision'),
+        "album_url": album_doc['external_urls']['spotify'],
+        "total_tracks": album_doc['total_tracks'],
+        "type": album_doc['type'],
+        "image_640_url": images[0]['url'] if len(images) > 0 else "",
+        "image_300_url": images[1]['url'] if len(images) > 1 else "",
+        "image_64_url": images[2]['url'] if len(images) > 2 else "",
+        "label": album_doc.get('label'),
+        "popularity": album_doc.get('popularity'),
+        "upc": (album_doc.get('external_ids') or {}).get('upc')
+    }
+    return album_detail
+
+@metrics.timed()
+def get_several_albums(album_ids:List[str], token:Dict[str,any]):
+    '''
+    Retrieve information of several albums from Spotify in a single request
+
+    Params:
+        album_ids (List[str]): Spotify Ids of the albums, maximum 20
+        token (Dict[str,any]): Spotify authentication token
+
+    Returns:
+        album_details (List[Dict[str,any]]): A list of album details, same shape as parse_album_doc.
+            Unknown Ids (returned as null by Spotify) are skipped
+    '''
+    if len(album_ids) > MAX_ALBUM_IDS_PER_REQUEST:
+        raise ValueError(f"Cannot request more than {MAX_ALBUM_IDS_PER_REQUEST} albums at once")
+    ENDPOINT = f"{SPOTIFY_API_URL_PREFIX}/albums?ids={','.join(album_ids)}"
+    response = spotify.authorized_get(url=ENDPOINT, token=token)
+    response.raise_for_status()
+    album_docs = response.json()['albums']
+    album_details = [parse_album_doc(album_doc) for album_doc in album_docs if album_doc is not None]
+    if len(album_details) < len(album_ids):
+        logger.warning(f"{len(album_ids) - len(album_details)} album ids not found on Spotify")
+    return album_details
+
+@metrics.timed()
+def get_album_details_from_ids(album_ids:List[str], token=None, max_workers:int=EXTRACT_MAX_WORKERS):
+    """
+    Retrieve album details for a list of album ids from Spotify, using batches of up to 20 ids per request
+    fetched concurrently. The metadata cache is not read, so the details are always current
+
+    Params:
+        album_ids (List[str]): Spotify Ids of the albums
+        token (Dict[str,any], optional): Spotify authentication token. A new one is fetched if needed and not given
+        max_workers (int, optional): Maximum number of requests in flight. Defaults to EXTRACT_MAX_WORKERS
+
+    Returns:
+        album_details (List[Dict[str,any]]): A list of album details, same shape as parse_album_doc
+    """
+    if not album_ids:
+        return []
+    if token is None:
+        token = spotify.get_token()
+    batches = chunk_ids(album_ids, MAX_ALBUM_IDS_PER_REQUEST)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = executor.map(lambda batch: get_several_albums(batch, token=token), batches)
+    album_details = [album_detail for result in results for album_detail in result]
+    logger.info(f"Get {len(album_details)} albums from Spotify API")
+    return album_details
+
+def parse_track_doc(track_doc:Dict[str,any]):
+    '''
+    Map a full track object from Spotify API to the track columns that search results may lack
+
+    Params:
+        track_doc (Dict[str,any]): Track object from Spotify API
+
+    Returns:
+        track_detail (Dict[str,any]): A dictionary containing id, popularity, isrc, track_number and disc_number
+    '''
+    track_detail = {
+        "id": track_doc['id'],
+        "popularity": track_doc.get('popularity'),
+        "isrc": (track_doc.get('external_ids') or {}).get('isrc'),
+        "track_number": track_doc.get('track_number'),
+        "disc_number": track_doc.get('disc_number')
+    }
+    return track_detail
+
+@metrics.timed()
+def get_several_tracks(track_ids:List[str], token:Dict[str,any]):
+    '''
+    Retrieve information of several tracks from Spotify in a single request
+
+    Params:
+        track_ids (List[str]): Spotify Ids of the tracks, maximum 50
+        token (Dict[str,any]): Spotify authentication token
+
+    Returns:
+        track_details (List[Dict[str,any]]): A list of track details, same shape as parse_track_doc.
+            Unknown Ids (returned as null by Spotify) are skipped
+    '''
+    if len(track_ids) > MAX_TRACK_IDS_PER_REQUEST:
+        raise ValueError(f"Cannot request more than {MAX_TRACK_IDS_PER_REQUEST} tracks at once")
+    ENDPOINT = f"{SPOTIFY_API_URL_PREFIX}/tracks?ids={','.join(track_ids)}"
+    response = spotify.authorized_get(url=ENDPOINT, token=token)
+    response.raise_for_status()
+    track_docs = response.json()['tracks']
+    track_details = [parse_track_doc(track_doc) for track_doc in track_docs if track_doc is not None]
+    if len(track_details) < len(track_ids):
+        logger.warning(f"{len(track_ids) - len(track_details)} track ids not found on Spotify")
+    return track_details
+
+@metrics.timed()
+def get_track_details_from_ids(track_ids:List[str], token=None, max_workers:int=EXTRACT_MAX_WORKERS):
+    """
+    Retrieve track details for a list of track ids from Spotify, using batches of up to 50 ids per request
+    fetched concurrently
+
+    Params:
+        track_ids (List[str]): Spotify Ids of the tracks
+        token (Dict[str,any], optional): Spotify authentication token. A new one is fetched if needed and not given
+        max_workers (int, optional): Maximum number of requests in flight. Defaults to EXTRACT_MAX_WORKERS
+
+    Returns:
+        track_details (List[Dict[str,any]]): A list of track details, same shape as parse_track_doc
+    """
+    if not track_ids:
+        return []
+    if token is None:
+        token = spotify.get_token()
+    batches = chunk_ids(track_ids, MAX_TRACK_IDS_PER_REQUEST)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = executor.map(lambda batch: get_several_tracks(batch, token=token), batches)
+    track_details = [track_detail for result in results for track_detail in result]
+    logger.info(f"Get {len(track_details)} tracks from Spotify API")
+    return track_details
+
 def get_genre_list_from_artist(artist_details:List[Dict[str,any]]):
     '''
     Retrieve list of genres of artists
@@ -198,6 +543,7 @@ def get_genre_list_from_artist(artist_details:List[Dict[str,any]]):
         genre_list.extend(artist_detail['genres'])
     return list(set(genre_list))
 
+@metrics.timed()
 def get_artist_ids_from_tracks(tracks):
     artists_from_album = []
     artists_from_artists = []
@@ -208,15 +554,64 @@ def get_artist_ids_from_tracks(tracks):
             artists_from_artists.append(artist['id'])
     artist_ids = list(set(artists_from_album + artists_from_artists))
     return artist_ids
-def get_artist_details_from_ids(artist_ids:List[str], token=None):
-    if token is None:
-        token = spotify.get_token()
-    artist_details = [get_artist_detail(artist_id, token=token) for artist_id in artist_ids]
+def chunk_ids(ids:List[str], size:int):
+    """
+    Split a list of ids into consecutive chunks
+
+    Params:
+        ids (List[str]): List of ids
+        size (int): Maximum number of ids per chunk
+
+    Returns:
+        chunks (List[List[str]]): List of chunks, keeping the original order
+    """
+    return [ids[i:i+size] for i in range(0, len(ids), size)]
+
+@metrics.timed()
+def get_artist_details_from_ids(artist_ids:List[str], token=None, max_workers:int=EXTRACT_MAX_WORKERS, use_cache:bool=True):
+    """
+    Retrieve artist details for a list of artist ids, using batches of up to 50 ids per request.
+    Batches are fetched concurrently. Artists found in the metadata cache are not requested again.
+    Every detail gets the time it was fetched from Spotify under "fetched_at" (ISO format), the time of
+    its cache entry for cached artists
+
+    Params:
+        artist_ids (List[str]): Spotify Ids of the artists
+        token (Dict[str,any], optional): Spotify authentication token. A new one is fetched if needed and not given
+        max_workers (int, optional): Maximum number of requests in flight. Defaults to EXTRACT_MAX_WORKERS
+        use_cache (bool, optional): Read and fill the metadata cache. Defaults to True
+
+    Returns:
+        artist_details (List[Dict[str,str]]): A list of artist details, same shape as get_artist_detail
+    """
+    metadata_cache = cache.get_cache() if use_cache else None
+    cached = metadata_cache.get_many("artist", artist_ids, with_fetched_at=True) if metadata_cache is not None else {}
+    missing_ids = [artist_id for artist_id in artist_ids if artist_id not in cached]
+    fetched_at = datetime.now().isoformat(timespec="seconds")
+
+    fetched = []
+    if missing_ids:
+        if token is None:
+            token = spotify.get_token()
+        batches = chunk_ids(missing_ids, MAX_ARTIST_IDS_PER_REQUEST)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            results = executor.map(lambda batch: get_several_artists(batch, token=token), batches)
+        fetched = [artist_detail for result in results for artist_detail in result]
+        if metadata_cache is not None:
+            metadata_cache.set_many("artist", {artist_detail['id']:artist_detail for artist_detail in fetched})
+
+    metrics.increment("metadata_cache.artist.hits", len(cached))
+    metrics.increment("metadata_cache.artist.misses", len(missing_ids))
+
+    artist_details = [{**artist_detail, "fetched_at":datetime.fromtimestamp(cached_at).isoformat(timespec="seconds")} for artist_detail, cached_at in cached.values()]
+    artist_details += [{**artist_detail, "fetched_at":fetched_at} for artist_detail in fetched]
+    logger.info(f"Get {len(artist_details)} artists, {len(cached)} from cache and {len(fetched)} from Spotify API")
     return artist_details
 def get_artist_genre_from_artist_details(artist_details):
     artist_genres_dict = {artist_detail['id']:artist_detail['genres'] for artist_detail in artist_details}
     return artist_genres_dict
 
+@metrics.timed()
 def get_track_album_from_tracks(tracks):
     track_album = {}
     for item in tracks['items']:
@@ -227,6 +622,7 @@ def get_track_album_from_tracks(tracks):
     return track_album
 
 
+@metrics.timed()
 def count_records(engine:sqlalchemy.engine.base.Engine, table_name:str):
     if table_name not in ['track','artist','album']:
         raise ValueError(f"Table name {table_name} is not supported")
@@ -1,8 +1,45 @@
+import io
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import time
 import sqlalchemy
 import pandas as pd
-from .. import logger
+from typing import Dict, List
+from .. import logger, metrics
+from ..database.maintenance import LINK_TABLE_KEYS
 
+LOAD_MODE = os.getenv("LOAD_MODE", "upsert")
+LOAD_MODES = ["append", "upsert"]
+#"transaction" loads every table in one transaction, "parallel" loads independent tables concurrently
+LOAD_STRATEGY = os.getenv("LOAD_STRATEGY", "transaction")
+LOAD_STRATEGIES = ["transaction", "parallel"]
+LOAD_MAX_WORKERS = int(os.getenv("LOAD_MAX_WORKERS", 4))
 
+#Tables in foreign key order, referenced tables first
+TABLE_LOAD_ORDER = ["artist", "album", "track", "artist_genre", "artist_track", "artist_album", "track_album"]
+
+#Foreign keys of create_table.sql, used when the database cannot report them (SQLite tables are created without them)
+TABLE_DEPENDENCIES:Dict[str,List[str]] = {
+    "artist":[],
+    "album":[],
+    "track":[],
+    "artist_genre":["artist"],
+    "artist_track":["artist", "track"],
+    "artist_album":["artist", "album"],
+    "track_album":["track", "album"],
+}
+
+#Primary key columns used for conflict detection in upsert mode
+PRIMARY_KEYS:Dict[str,List[str]] = {
+    "track":["id"],
+    "album":["id"],
+    "artist":["id"],
+    **LINK_TABLE_KEYS,
+}
+
+
+@metrics.timed()
 def load_to_db(engine: sqlalchemy.engine.base.Engine, df:pd.DataFrame, table_name:str):
     with engine.connect() as conn:
         try:
@@ -10,4 +47,326 @@ def load_to_db(engine: sqlalchemy.engine.base.Engine, df:pd.DataFrame, table_nam
             logger.info(f"Add to table {table_name} with {total_records} records")
         except Exception as err:
             logger.error(f"Error when loading to table {table_name}: {err}")
-            return 
+            return
+
+def get_records(df:pd.DataFrame) -> List[Dict[str,any]]:
+    """
+    Convert a DataFrame into a list of records suitable for DBAPI parameters, with NaN/NaT as None
+    and timestamps as datetime objects
+    """
+    columns = list(df.columns)
+    records = []
+    for row in df.astype(object).itertuples(index=False, name=None):
+        records.append({
+            column:(None if pd.isna(value) else value.to_pydatetime() if isinstance(value, pd.Timestamp) else value)
+            for column, value in zip(columns, row)
+        })
+    return records
+
+@metrics.timed()
+def insert_rows(conn:sqlalchemy.engine.Connection, table_name:str, df:pd.DataFrame):
+    """
+    Insert a DataFrame with a single multi-row executemany
+
+    Params:
+        conn (sqlalchemy.engine.Connection): Open connection
+        table_name (str): Target table, its columns must match the DataFrame columns
+        df (pd.DataFrame): Rows to insert
+
+    Returns:
+        total_records (int): Number of rows sent
+    """
+    if df.empty:
+        return 0
+    table = sqlalchemy.table(table_name, *[sqlalchemy.column(column) for column in df.columns])
+    conn.execute(sqlalchemy.insert(table), get_records(df))
+    return len(df)
+
+@metrics.timed()
+def copy_rows(conn:sqlalchemy.engine.Connection, table_name:str, df:pd.DataFrame):
+    """
+    Stream a DataFrame into a PostgreSQL table with COPY FROM STDIN (psycopg2 only)
+
+    Params:
+        conn (sqlalchemy.engine.Connection): Open PostgreSQL connection
+        table_name (str): Target table, its columns must match the DataFrame columns
+        df (pd.DataFrame): Rows to copy
+
+    Returns:
+        total_records (int): Number of rows copied
+    """
+    if df.empty:
+        return 0
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="\\N")
+    buffer.seek(0)
+    column_list = ", ".join(f'"{column}"' for column in df.columns)
+    cursor = conn.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY \"{table_name}\" ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+    finally:
+        cursor.close()
+    return len(df)
+
+def write_rows(conn:sqlalchemy.engine.Connection, table_name:str, df:pd.DataFrame):
+    """
+    Write a DataFrame with the fastest path of the dialect: COPY on PostgreSQL with psycopg2,
+    a multi-row executemany otherwise
+
+    Returns:
+        total_records (int): Number of rows written
+    """
+    if conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg2":
+        return copy_rows(conn, table_name, df)
+    return insert_rows(conn, table_name, df)
+
+def create_staging_table(conn:sqlalchemy.engine.Connection, table_name:str) -> str:
+    """
+    Create an empty temporary table with the same columns as table_name
+
+    Returns:
+        staging_name (str): Name of the temporary table
+    """
+    staging_name = f"staging_{table_name}_{uuid.uuid4().hex[:8]}"
+    if conn.dialect.name == "postgresql":
+        stmt = f'CREATE TEMP TABLE "{staging_name}" (LIKE "{table_name}" INCLUDING DEFAULTS) ON COMMIT DROP'
+    else:
+        stmt = f'CREATE TEMP TABLE "{staging_name}" AS SELECT * FROM "{table_name}" WHERE 1 = 0'
+    conn.execute(sqlalchemy.text(stmt))
+    return staging_name
+
+@metrics.timed()
+def merge_from_staging(conn:sqlalchemy.engine.Connection, staging_name:str, table_name:str, columns:List[str], key_columns:List[str]) -> int:
+    """
+    Insert the rows of the staging table whose key is not in table_name yet.
+    PostgreSQL uses ON CONFLICT DO NOTHING, SQLite uses INSERT OR IGNORE and other dialects an anti-join
+
+    Returns:
+        total_records (int): Number of rows inserted
+    """
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    if conn.dialect.name == "postgresql":
+        key_list = ", ".join(f'"{column}"' for column in key_columns)
+        stmt = f'INSERT INTO "{table_name}" ({column_list}) SELECT {column_list} FROM "{staging_name}" ON CONFLICT ({key_list}) DO NOTHING'
+    elif conn.dialect.name == "sqlite":
+        stmt = f'INSERT OR IGNORE INTO "{table_name}" ({column_list}) SELECT {column_list} FROM "{staging_name}"'
+    else:
+        key_match = " AND ".join(f't."{column}" = s."{column}"' for column in key_columns)
+        select_list = ", ".join(f's."{column}"' for column in columns)
+        stmt = (f'INSERT INTO "{table_name}" ({column_list}) SELECT DISTINCT {select_list} FROM "{staging_name}" s '
+                f'WHERE NOT EXISTS (SELECT 1 FROM "{table_name}" t WHERE {key_match})')
+    return conn.execute(sqlalchemy.text(stmt)).rowcount
+
+def load_table(conn:sqlalchemy.engine.Connection, df:pd.DataFrame, table_name:str, mode:str=LOAD_MODE):
+    """
+    Load a DataFrame inside an open transaction.
+    In upsert mode, tables with a known primary key (association tables included) go through a temporary
+    staging table so that rows whose key already exists are skipped by the database. Other tables, and every table in append mode, are written directly
+
+    Params:
+        conn (sqlalchemy.engine.Connection): Connection with an open transaction
+        df (pd.DataFrame): Rows to load
+        table_name (str): Target table
+        mode (str, optional): "upsert" or "append". Defaults to LOAD_MODE
+
+    Returns:
+        total_records (int): Number of rows inserted
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Load mode {mode} is not supported")
+    if df.empty:
+        return 0
+    key_columns = PRIMARY_KEYS.get(table_name)
+    with metrics.span(f"load.load_table.{table_name}"):
+        if mode == "append" or key_columns is None:
+            total_records = write_rows(conn, table_name, df)
+        else:
+            staging_name = create_staging_table(conn, table_name)
+            write_rows(conn, staging_name, df)
+            total_records = merge_from_staging(conn, staging_name, table_name, list(df.columns), key_columns)
+            if conn.dialect.name != "postgresql":
+                conn.execute(sqlalchemy.text(f'DROP TABLE "{staging_name}"'))
+    metrics.count_rows(table_name, rows_in=len(df), rows_out=total_records, stage="load")
+    return total_records
+
+@metrics.timed()
+def upsert_to_db(engine: sqlalchemy.engine.base.Engine, df:pd.DataFrame, table_name:str):
+    """
+    Load a DataFrame in its own transaction, skipping rows whose primary key already exists (see load_table)
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        df (pd.DataFrame): Rows to load
+        table_name (str): Target table
+
+    Returns:
+        total_records (int): Number of rows inserted
+    """
+    try:
+        with engine.begin() as conn:
+            total_records = load_table(conn, df, table_name, mode="upsert")
+    except Exception as err:
+        logger.error(f"Error when loading to table {table_name}: {err}")
+        raise
+    logger.info(f"Add to table {table_name} with {total_records} records, {len(df) - total_records} already existed")
+    return total_records
+
+@metrics.timed()
+def bulk_load(engine: sqlalchemy.engine.base.Engine, dfs:Dict[str,pd.DataFrame], mode:str=LOAD_MODE):
+    """
+    Load several tables in a single transaction, in foreign key order (see TABLE_LOAD_ORDER).
+    Either every table is loaded or none is
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        dfs (Dict[str,pd.DataFrame]): DataFrames keyed by table name
+        mode (str, optional): "upsert" or "append". Defaults to LOAD_MODE
+
+    Returns:
+        load_stats (Dict[str,Dict[str,float]]): Per table:
+            - rows (int): Rows received
+            - inserted (int): Rows inserted
+            - duration (float): Seconds spent on the table
+            - rows_per_second (float): Received rows per second
+    """
+    table_names = sorted(dfs, key=lambda table_name: TABLE_LOAD_ORDER.index(table_name) if table_name in TABLE_LOAD_ORDER else len(TABLE_LOAD_ORDER))
+    load_stats = {}
+    current_table = None
+    try:
+        with engine.begin() as conn:
+            for current_table in table_names:
+                df = dfs[current_table]
+                start_time = time()
+                inserted = load_table(conn, df, current_table, mode=mode)
+                duration = time() - start_time
+                load_stats[current_table] = {
+                    "rows":len(df),
+                    "inserted":inserted,
+                    "duration":duration,
+                    "rows_per_second":len(df) / duration if duration > 0 else 0.0,
+                }
+    except Exception as err:
+        logger.error(f"Error when loading to table {current_table}, rolled back all tables: {err}")
+        raise
+    for table_name, stats in load_stats.items():
+        logger.info(f"Add to table {table_name} with {stats['inserted']} of {stats['rows']} records in {stats['duration']:.3f}s ({stats['rows_per_second']:.0f} rows/s)")
+    return load_stats
+
+def get_table_dependencies(engine:sqlalchemy.engine.base.Engine, table_names:List[str]):
+    """
+    Build the foreign key graph of the given tables from the database schema.
+    Tables without reflected foreign keys fall back to TABLE_DEPENDENCIES
+
+    Returns:
+        dependencies (Dict[str,List[str]]): For each table, the tables among table_names it references
+    """
+    inspector = sqlalchemy.inspect(engine)
+    dependencies = {}
+    for table_name in table_names:
+        referred = [foreign_key["referred_table"] for foreign_key in inspector.get_foreign_keys(table_name)]
+        if not referred:
+            referred = TABLE_DEPENDENCIES.get(table_name, [])
+        dependencies[table_name] = sorted({referred_table for referred_table in referred if referred_table in table_names and referred_table != table_name})
+    return dependencies
+
+def get_load_levels(dependencies:Dict[str,List[str]]):
+    """
+    Group tables into levels: a table is in the level after the deepest table it depends on
+
+    Returns:
+        levels (List[List[str]]): Tables per level, referenced tables first
+
+    Raises:
+        ValueError: The foreign keys form a cycle
+    """
+    levels = []
+    placed = set()
+    remaining = dict(dependencies)
+    while remaining:
+        level = sorted(table_name for table_name, referred in remaining.items() if placed.issuperset(referred))
+        if not level:
+            raise ValueError(f"Foreign keys of tables {sorted(remaining)} form a cycle")
+        levels.append(level)
+        placed.update(level)
+        for table_name in level:
+            del remaining[table_name]
+    return levels
+
+@metrics.timed()
+def parallel_load(engine:sqlalchemy.engine.base.Engine, dfs:Dict[str,pd.DataFrame], mode:str=LOAD_MODE, max_workers:int=LOAD_MAX_WORKERS):
+    """
+    Load several tables concurrently over the connection pool, each table in its own transaction.
+    A table starts as soon as every table it references is loaded, so the load takes as long as the
+    slowest foreign key chain instead of the sum of all tables. When a table fails, the tables that
+    depend on it are not started and the tables already loaded are kept: upserts make the rerun safe
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine, its pool should allow max_workers connections
+        dfs (Dict[str,pd.DataFrame]): DataFrames keyed by table name
+        mode (str, optional): "upsert" or "append". Defaults to LOAD_MODE
+        max_workers (int, optional): Maximum number of tables loaded at once. Defaults to LOAD_MAX_WORKERS
+
+    Returns:
+        load_stats (Dict[str,Dict[str,float]]): Per table, same as bulk_load
+    """
+    dependencies = get_table_dependencies(engine, list(dfs))
+    get_load_levels(dependencies)
+
+    def load_one(table_name):
+        df = dfs[table_name]
+        start_time = time()
+        with engine.begin() as conn:
+            inserted = load_table(conn, df, table_name, mode=mode)
+        duration = time() - start_time
+        return {
+            "rows":len(df),
+            "inserted":inserted,
+            "duration":duration,
+            "rows_per_second":len(df) / duration if duration > 0 else 0.0,
+        }
+
+    load_stats = {}
+    pending = dict(dependencies)
+    running = {}
+    errors = {}
+    start_time = time()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while pending or running:
+            for table_name in [table_name for table_name, referred in pending.items() if set(referred).issubset(load_stats)]:
+                running[executor.submit(load_one, table_name)] = table_name
+                del pending[table_name]
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                table_name = running.pop(future)
+                try:
+                    load_stats[table_name] = future.result()
+                except Exception as err:
+                    logger.error(f"Error when loading to table {table_name}: {err}")
+                    errors[table_name] = err
+            if errors:
+                pending.clear()
+    wall_time = time() - start_time
+
+    for table_name, stats in load_stats.items():
+        logger.info(f"Add to table {table_name} with {stats['inserted']} of {stats['rows']} records in {stats['duration']:.3f}s ({stats['rows_per_second']:.0f} rows/s)")
+    logger.info(f"Loaded {len(load_stats)} tables in {wall_time:.3f}s, {sum(stats['duration'] for stats in load_stats.values()):.3f}s of table time")
+    if errors:
+        skipped = sorted(set(dfs) - set(load_stats) - set(errors))
+        table_name, err = next(iter(errors.items()))
+        raise RuntimeError(f"Error when loading to table {table_name}, tables not loaded: {sorted(errors) + skipped}") from err
+    return load_stats
+
+def load_tables(engine:sqlalchemy.engine.base.Engine, dfs:Dict[str,pd.DataFrame], mode:str=LOAD_MODE, strategy:str=LOAD_STRATEGY):
+    """
+    Load several tables with the given strategy: "transaction" (bulk_load) or "parallel" (parallel_load)
+
+    Returns:
+        load_stats (Dict[str,Dict[str,float]]): Per table, same as bulk_load
+    """
+    if strategy not in LOAD_STRATEGIES:
+        raise ValueError(f"Load strategy {strategy} is not supported")
+    if strategy == "parallel":
+        return parallel_load(engine=engine, dfs=dfs, mode=mode)
+    return bulk_load(engine=engine, dfs=dfs, mode=mode)
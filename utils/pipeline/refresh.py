@@ -0,0 +1,196 @@
+import os
+from datetime import datetime
+from typing import Dict, List
+import sqlalchemy
+import pandas as pd
+from . import extract as Extract
+from . import transform as Transform
+from . import load as Load
+from .. import spotify, logger, metrics, cache
+from ..database import aggregates
+from ..database.maintenance import LINK_TABLE_KEYS, ENRICHMENT_COLUMNS
+
+#Rows refreshed per run, which bounds the API calls (50 artists or 20 albums per request) and the rows written
+REFRESH_ARTIST_LIMIT = int(os.getenv("REFRESH_ARTIST_LIMIT", 500))
+REFRESH_ALBUM_LIMIT = int(os.getenv("REFRESH_ALBUM_LIMIT", 200))
+
+#Columns compared to decide whether a refreshed row changed
+REFRESH_COLUMNS:Dict[str,List[str]] = {
+    "artist":["name", "url", "image_640_url", "image_320_url", "image_160_url"],
+    #Full album objects also carry the enrichment columns, so a refresh keeps label and popularity current
+    "album":["name", "release_date", "album_url", "total_tracks", "type", "image_640_url", "image_300_url", "image_64_url", *ENRICHMENT_COLUMNS["album"]],
+}
+
+
+def get_stalest_ids(engine:sqlalchemy.engine.base.Engine, table_name:str, limit:int):
+    """
+    Retrieves the ids of the rows fetched the longest time ago, using the fetched_at index.
+    Rows without a name are skipped: they are artists queued by the worker mode (see worker.add_artist_placeholders),
+    fetched by their own work item
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        table_name (str): "artist" or "album"
+        limit (int): Maximum number of ids
+
+    Returns:
+        ids (List[str]): Ids, stalest first
+    """
+    if table_name not in REFRESH_COLUMNS:
+        raise ValueError(f"Table name {table_name} is not supported")
+    with engine.begin() as conn:
+        rows = conn.execute(sqlalchemy.text(
+            f'SELECT "id" FROM "{table_name}" WHERE "name" IS NOT NULL ORDER BY "fetched_at" LIMIT :limit'
+        ), {"limit":limit}).fetchall()
+    return [row[0] for row in rows]
+
+@metrics.timed()
+def update_changed_rows(conn:sqlalchemy.engine.Connection, table_name:str, df:pd.DataFrame, columns:List[str]) -> int:
+    """
+    Write refreshed rows to a staging table and update only the rows of table_name where one of the columns differs
+
+    Params:
+        conn (sqlalchemy.engine.Connection): Connection with an open transaction
+        table_name (str): Target table, keyed by "id"
+        df (pd.DataFrame): Refreshed rows, with "id" and the columns
+        columns (List[str]): Columns to compare and update
+
+    Returns:
+        total_records (int): Number of rows updated
+    """
+    if df.empty:
+        return 0
+    staging_name = Load.create_staging_table(conn, table_name)
+    Load.write_rows(conn, staging_name, df[["id", *columns]])
+    set_list = ", ".join(f'"{column}" = s."{column}"' for column in columns)
+    if conn.dialect.name == "postgresql":
+        changed = " OR ".join(f't."{column}" IS DISTINCT FROM s."{column}"' for column in columns)
+    else:
+        changed = " OR ".join(f't."{column}" IS NOT s."{column}"' for column in columns)
+    total_records = conn.execute(sqlalchemy.text(
+        f'UPDATE "{table_name}" AS t SET {set_list} FROM "{staging_name}" AS s WHERE t."id" = s."id" AND ({changed})'
+    )).rowcount
+    if conn.dialect.name != "postgresql":
+        conn.execute(sqlalchemy.text(f'DROP TABLE "{staging_name}"'))
+    return total_records
+
+def set_fetched_at(conn:sqlalchemy.engine.Connection, table_name:str, ids:List[str], fetched_at:datetime, column:str="fetched_at"):
+    """Mark rows as fetched, including the ones that did not change or are no longer on Spotify. column can be enriched_at"""
+    if ids:
+        conn.execute(sqlalchemy.text(f'UPDATE "{table_name}" SET "{column}" = :fetched_at WHERE "id" = :id'),
+                     [{"id":row_id, "fetched_at":fetched_at} for row_id in ids])
+
+@metrics.timed()
+def sync_artist_genres(conn:sqlalchemy.engine.Connection, artist_ids:List[str], artist_genre_df:pd.DataFrame):
+    """
+    Make the stored genres of the given artists match artist_genre_df: genres no longer listed are deleted
+    and new ones inserted, genres listed in both are left untouched
+
+    Params:
+        conn (sqlalchemy.engine.Connection): Connection with an open transaction
+        artist_ids (List[str]): Refreshed artists
+        artist_genre_df (pd.DataFrame): Current artist_id and genre pairs of these artists
+
+    Returns:
+        (added, removed_df) (tuple): Number of pairs inserted, and the deleted pairs
+    """
+    key_columns = LINK_TABLE_KEYS["artist_genre"]
+    if not artist_ids:
+        return 0, pd.DataFrame(columns=key_columns)
+    stmt = sqlalchemy.text('SELECT "artist_id", "genre" FROM "artist_genre" WHERE "artist_id" IN :artist_ids').bindparams(
+        sqlalchemy.bindparam("artist_ids", expanding=True))
+    stored_df = pd.DataFrame(conn.execute(stmt, {"artist_ids":artist_ids}).fetchall(), columns=key_columns)
+
+    removed_df = Transform.filter_existing_keys(df=stored_df, existing_keys=artist_genre_df, key_columns=key_columns)
+    added_df = Transform.filter_existing_keys(df=artist_genre_df, existing_keys=stored_df, key_columns=key_columns)
+    if not removed_df.empty:
+        conn.execute(sqlalchemy.text('DELETE FROM "artist_genre" WHERE "artist_id" = :artist_id AND "genre" = :genre'),
+                     removed_df.to_dict("records"))
+    added = Load.load_table(conn, added_df, "artist_genre", mode="upsert")
+    return added, removed_df
+
+@metrics.timed()
+def refresh_artists(engine:sqlalchemy.engine.base.Engine, token:Dict[str,any], limit:int=REFRESH_ARTIST_LIMIT):
+    """
+    Refetch the stalest artists from Spotify, bypassing the metadata cache, and apply the changes:
+    changed artist rows are updated, artist_genre is diffed, and fetched_at is set on every selected artist
+
+    Returns:
+        refresh_stats (Dict[str,int]): selected, fetched, changed, genres_added and genres_removed
+    """
+    artist_ids = get_stalest_ids(engine, "artist", limit)
+    if not artist_ids:
+        return {"selected":0, "fetched":0, "changed":0, "genres_added":0, "genres_removed":0}
+    fetched_at = datetime.now()
+    artist_details = Extract.get_artist_details_from_ids(artist_ids, token=token, use_cache=False)
+    metadata_cache = cache.get_cache()
+    if metadata_cache is not None:
+        metadata_cache.set_many("artist", {artist_detail['id']:artist_detail for artist_detail in artist_details})
+
+    artist_df = Transform.create_artist_df(artist_details=artist_details)
+    artist_genre_df = Transform.dedupe_links(
+        Transform.create_artist_genre_df(artist_genre=Extract.get_artist_genre_from_artist_details(artist_details)),
+        LINK_TABLE_KEYS["artist_genre"])
+
+    fetched_ids = [artist_detail['id'] for artist_detail in artist_details]
+    with engine.begin() as conn:
+        changed = update_changed_rows(conn, "artist", artist_df, REFRESH_COLUMNS["artist"])
+        genres_added, removed_df = sync_artist_genres(conn, fetched_ids, artist_genre_df)
+        set_fetched_at(conn, "artist", artist_ids, fetched_at)
+    genres_removed = len(removed_df)
+    if aggregates.AGGREGATES_ENABLED and (genres_added or genres_removed):
+        #New pairs are added to the aggregates incrementally, genres that lost an artist are recomputed
+        aggregates.refresh_aggregates(engine=engine, artist_ids=fetched_ids, genres=removed_df["genre"])
+    metrics.count_rows("artist", rows_in=len(artist_ids), rows_out=changed, stage="refresh")
+    return {"selected":len(artist_ids), "fetched":len(artist_details), "changed":changed, "genres_added":genres_added, "genres_removed":genres_removed}
+
+@metrics.timed()
+def refresh_albums(engine:sqlalchemy.engine.base.Engine, token:Dict[str,any], limit:int=REFRESH_ALBUM_LIMIT):
+    """
+    Refetch the stalest albums from Spotify and update the changed ones, enrichment columns included.
+    fetched_at and enriched_at are set on every selected album
+
+    Returns:
+        refresh_stats (Dict[str,int]): selected, fetched and changed
+    """
+    album_ids = get_stalest_ids(engine, "album", limit)
+    if not album_ids:
+        return {"selected":0, "fetched":0, "changed":0}
+    fetched_at = datetime.now()
+    album_details = Extract.get_album_details_from_ids(album_ids, token=token)
+
+    album_df = pd.DataFrame(album_details)
+    if not album_df.empty:
+        album_df["release_date"] = Transform.parse_release_dates(album_df["release_date"], album_df["release_date_precision"])
+        album_df = Transform.cast_enrichment_columns(album_df, "album")
+
+    with engine.begin() as conn:
+        changed = update_changed_rows(conn, "album", album_df, REFRESH_COLUMNS["album"])
+        set_fetched_at(conn, "album", album_ids, fetched_at)
+        set_fetched_at(conn, "album", album_ids, fetched_at, column="enriched_at")
+    metrics.count_rows("album", rows_in=len(album_ids), rows_out=changed, stage="refresh")
+    return {"selected":len(album_ids), "fetched":len(album_details), "changed":changed}
+
+def run_refresh(engine:sqlalchemy.engine.base.Engine, artist_limit:int=REFRESH_ARTIST_LIMIT, album_limit:int=REFRESH_ALBUM_LIMIT):
+    """
+    Refresh the metadata of the stalest artists and albums. Each run costs at most
+    artist_limit / 50 + album_limit / 20 API requests and updates at most artist_limit + album_limit rows
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        artist_limit (int, optional): Artists refreshed. Defaults to REFRESH_ARTIST_LIMIT
+        album_limit (int, optional): Albums refreshed. Defaults to REFRESH_ALBUM_LIMIT
+
+    Returns:
+        refresh_stats (Dict[str,Dict[str,int]]): Stats of refresh_artists and refresh_albums keyed by table
+    """
+    token = spotify.get_token()
+    refresh_stats = {
+        "artist":refresh_artists(engine=engine, token=token, limit=artist_limit),
+        "album":refresh_albums(engine=engine, token=token, limit=album_limit),
+    }
+    artist_stats, album_stats = refresh_stats["artist"], refresh_stats["album"]
+    logger.info(f"Refreshed {artist_stats['selected']} artists, {artist_stats['changed']} changed, "
+                f"{artist_stats['genres_added']} genres added and {artist_stats['genres_removed']} removed")
+    logger.info(f"Refreshed {album_stats['selected']} albums, {album_stats['changed']} changed")
+    return refresh_stats
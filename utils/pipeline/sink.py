@@ -0,0 +1,281 @@
+import abc
+import os
+import uuid
+from datetime import date
+from time import time
+from typing import Dict, List
+import sqlalchemy
+import pandas as pd
+from . import load as Load
+from .. import logger, metrics
+from ..database import aggregates
+
+#Comma separated sinks of a run, e.g. "database,parquet"
+LOAD_SINKS = [sink.strip() for sink in os.getenv("LOAD_SINKS", "database").split(",") if sink.strip()]
+PARQUET_ROOT = os.getenv("PARQUET_ROOT", "data/parquet")
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+
+
+def _import_pyarrow():
+    """pyarrow is an optional dependency, only needed by the Parquet sink"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as err:
+        raise ImportError("The Parquet sink needs pyarrow, install it with `pip install pyarrow`") from err
+    return pyarrow, pyarrow.parquet
+
+
+class Sink(abc.ABC):
+    """
+    Destination of the DataFrames of a run. Subclasses implement write.
+    A partitioned sink is written once per genre of a run, see split_dfs_by_genre
+    """
+    name = "sink"
+    partitioned = False
+
+    @abc.abstractmethod
+    def write(self, dfs:Dict[str,pd.DataFrame], genre:str=None) -> Dict[str,Dict[str,float]]:
+        """
+        Write the DataFrames of a run
+
+        Params:
+            dfs (Dict[str,pd.DataFrame]): DataFrames keyed by table name, from transform.create_dfs
+            genre (str, optional): Genre the rows were crawled for
+
+        Returns:
+            write_stats (Dict[str,Dict[str,float]]): Per table statistics
+        """
+
+
+class DatabaseSink(Sink):
+    """
+    Loads into the database with load.load_tables, then refreshes the aggregates of the artists
+    of the run (see database.aggregates) unless AGGREGATES_ENABLED is off. The refresh runs after the
+    load is committed: when it fails the loaded rows are kept and the error is logged, and
+    `main.py rebuild-aggregates` brings the aggregates back in line
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        mode (str, optional): "upsert" or "append". Defaults to LOAD_MODE
+        strategy (str, optional): "transaction" or "parallel". Defaults to LOAD_STRATEGY
+    """
+    name = "database"
+
+    def __init__(self, engine:sqlalchemy.engine.base.Engine, mode:str=Load.LOAD_MODE, strategy:str=Load.LOAD_STRATEGY):
+        self.engine = engine
+        self.mode = mode
+        self.strategy = strategy
+
+    def write(self, dfs:Dict[str,pd.DataFrame], genre:str=None):
+        load_stats = Load.load_tables(engine=self.engine, dfs=dfs, mode=self.mode, strategy=self.strategy)
+        if aggregates.AGGREGATES_ENABLED:
+            artist_ids = set()
+            for table_name, column in [("artist", "id"), ("artist_track", "artist_id"), ("artist_album", "artist_id"), ("artist_genre", "artist_id")]:
+                if table_name in dfs and column in dfs[table_name]:
+                    artist_ids.update(dfs[table_name][column].dropna())
+            try:
+                with metrics.span("load.refresh_aggregates"):
+                    aggregates.refresh_aggregates(engine=self.engine, artist_ids=artist_ids)
+            except Exception as err:
+                logger.error(f"Loaded tables were kept but their aggregates could not be refreshed, run rebuild-aggregates: {err}")
+                metrics.increment("load.refresh_aggregates.failed")
+        return load_stats
+
+
+class ParquetSink(Sink):
+    """
+    Writes every table as Parquet files partitioned by genre and ingest date:
+    {root}/{table}/genre={genre}/ingest_date={YYYY-MM-DD}/part-*.parquet
+    String columns are dictionary encoded. Each file is written under a temporary name and renamed
+    when complete, so readers never see a partial file. Every run adds one file per table and
+    partition, merge them with compact_parquet
+
+    Params:
+        root (str, optional): Folder of the dataset. Defaults to PARQUET_ROOT
+        compression (str, optional): Parquet compression codec. Defaults to PARQUET_COMPRESSION
+    """
+    name = "parquet"
+    partitioned = True
+
+    def __init__(self, root:str=PARQUET_ROOT, compression:str=PARQUET_COMPRESSION):
+        _import_pyarrow()
+        self.root = root
+        self.compression = compression
+
+    def get_partition_path(self, table_name:str, genre:str, ingest_date:date) -> str:
+        return os.path.join(self.root, table_name, f"genre={genre}", f"ingest_date={ingest_date.isoformat()}")
+
+    @metrics.timed()
+    def write(self, dfs:Dict[str,pd.DataFrame], genre:str=None, ingest_date:date=None):
+        """
+        Write one file per non-empty table
+
+        Returns:
+            write_stats (Dict[str,Dict[str,float]]): Per table: rows, bytes, duration and path
+        """
+        genre = genre or "unknown"
+        ingest_date = ingest_date or date.today()
+        write_stats = {}
+        for table_name, df in dfs.items():
+            if df.empty:
+                continue
+            start_time = time()
+            path = write_parquet_file(df, self.get_partition_path(table_name, genre, ingest_date), compression=self.compression)
+            write_stats[table_name] = {"rows":len(df), "bytes":os.path.getsize(path), "duration":time() - start_time, "path":path}
+            metrics.count_rows(table_name, rows_in=len(df), rows_out=len(df), stage="parquet")
+        for table_name, stats in write_stats.items():
+            logger.info(f"Write {stats['rows']} records of table {table_name} to {stats['path']} ({stats['bytes']} bytes)")
+        return write_stats
+
+
+def to_arrow_table(df:pd.DataFrame):
+    """Convert a DataFrame to an Arrow table with dictionary encoded string columns"""
+    pyarrow, _ = _import_pyarrow()
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    for index, field in enumerate(table.schema):
+        if pyarrow.types.is_string(field.type) or pyarrow.types.is_large_string(field.type):
+            table = table.set_column(index, field.name, table.column(index).dictionary_encode())
+    return table
+
+def write_parquet_file(df:pd.DataFrame, directory:str, compression:str=PARQUET_COMPRESSION, prefix:str="part") -> str:
+    """
+    Atomically write a DataFrame as a new Parquet file in directory: the file is written
+    under a hidden temporary name, which readers ignore, then renamed
+
+    Returns:
+        path (str): Path of the new file
+    """
+    _, parquet = _import_pyarrow()
+    os.makedirs(directory, exist_ok=True)
+    file_name = f"{prefix}-{int(time() * 1000)}-{uuid.uuid4().hex[:8]}.parquet"
+    tmp_path = os.path.join(directory, f".{file_name}.tmp")
+    path = os.path.join(directory, file_name)
+    try:
+        parquet.write_table(to_arrow_table(df), tmp_path, compression=compression, use_dictionary=True)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+def get_parquet_files(directory:str) -> List[str]:
+    """Committed Parquet files of a partition folder, oldest first"""
+    return sorted(os.path.join(directory, file_name) for file_name in os.listdir(directory)
+                  if file_name.endswith(".parquet") and not file_name.startswith("."))
+
+@metrics.timed()
+def compact_parquet(root:str=PARQUET_ROOT, tables:List[str]=None, min_files:int=2, compression:str=PARQUET_COMPRESSION):
+    """
+    Merge the per-run files of every partition into a single file, dropping rows whose primary key
+    (see load.PRIMARY_KEYS) is already in an older file. The merged file is committed before the small
+    files are deleted, so an interrupted compaction leaves duplicates that the next one removes, never a gap
+
+    Params:
+        root (str, optional): Folder of the dataset. Defaults to PARQUET_ROOT
+        tables (List[str], optional): Tables to compact. Defaults to every table folder under root
+        min_files (int, optional): Partitions with fewer files are left as they are. Defaults to 2
+        compression (str, optional): Parquet compression codec. Defaults to PARQUET_COMPRESSION
+
+    Returns:
+        compact_stats (Dict[str,Dict[str,int]]): Per table: partitions compacted, files merged and rows kept
+    """
+    _, parquet = _import_pyarrow()
+    if not os.path.isdir(root):
+        return {}
+    tables = sorted(os.listdir(root)) if tables is None else tables
+    compact_stats = {}
+    for table_name in tables:
+        stats = {"partitions":0, "files":0, "rows":0}
+        for directory, _, _ in os.walk(os.path.join(root, table_name)):
+            files = get_parquet_files(directory)
+            if len(files) < max(2, min_files):
+                continue
+            df = pd.concat([parquet.read_table(path).to_pandas() for path in files], ignore_index=True)
+            key_columns = Load.PRIMARY_KEYS.get(table_name)
+            df = df.drop_duplicates(subset=key_columns, keep="first", ignore_index=True)
+            for column in df.columns:
+                if isinstance(df[column].dtype, pd.CategoricalDtype):
+                    df[column] = df[column].astype(object)
+            write_parquet_file(df, directory, compression=compression, prefix="compacted")
+            for path in files:
+                os.remove(path)
+            stats["partitions"] += 1
+            stats["files"] += len(files)
+            stats["rows"] += len(df)
+        compact_stats[table_name] = stats
+        logger.info(f"Compacted {stats['files']} Parquet files of table {table_name} into {stats['partitions']} files with {stats['rows']} records")
+    return compact_stats
+
+def split_dfs_by_genre(dfs:Dict[str,pd.DataFrame], genre_track_ids:Dict[str,List[str]]) -> Dict[str,Dict[str,pd.DataFrame]]:
+    """
+    Split the DataFrames of a run over several genres into one set of DataFrames per genre.
+    A genre gets its tracks, their albums and artists and the links between them, so a track found
+    in two genres is in both. Rows linked to no crawled track (e.g. artists only credited on an album)
+    go to the first genre, so that every row is written once
+
+    Params:
+        dfs (Dict[str,pd.DataFrame]): DataFrames keyed by table name, from transform.create_dfs
+        genre_track_ids (Dict[str,List[str]]): Track ids keyed by genre, from crawl.get_genre_track_ids
+
+    Returns:
+        genre_dfs (Dict[str,Dict[str,pd.DataFrame]]): DataFrames keyed by genre, then by table name
+    """
+    def select(table_name, column, ids):
+        df = dfs.get(table_name)
+        if df is None or column not in df:
+            return None
+        return df[column].isin(ids)
+
+    assigned = {table_name:pd.Series(False, index=df.index) for table_name, df in dfs.items()}
+    genre_masks = {}
+    for genre, track_ids in genre_track_ids.items():
+        track_ids = set(track_ids)
+        masks = {
+            "track":select("track", "id", track_ids),
+            "artist_track":select("artist_track", "track_id", track_ids),
+            "track_album":select("track_album", "track_id", track_ids),
+        }
+        album_ids = set(dfs["track_album"].loc[masks["track_album"], "album_id"]) if masks["track_album"] is not None else set()
+        masks["album"] = select("album", "id", album_ids)
+        masks["artist_album"] = select("artist_album", "album_id", album_ids)
+        artist_ids = set()
+        for table_name in ["artist_track", "artist_album"]:
+            if masks[table_name] is not None:
+                artist_ids.update(dfs[table_name].loc[masks[table_name], "artist_id"])
+        masks["artist"] = select("artist", "id", artist_ids)
+        masks["artist_genre"] = select("artist_genre", "artist_id", artist_ids)
+        genre_masks[genre] = {table_name:mask for table_name, mask in masks.items() if mask is not None}
+        for table_name, mask in genre_masks[genre].items():
+            assigned[table_name] |= mask
+
+    if not genre_masks:
+        return {"unknown":dfs}
+    first_genre = next(iter(genre_masks))
+    for table_name, df in dfs.items():
+        genre_masks[first_genre][table_name] = genre_masks[first_genre].get(table_name, pd.Series(False, index=df.index)) | ~assigned[table_name]
+    return {genre:{table_name:dfs[table_name][mask] for table_name, mask in masks.items()} for genre, masks in genre_masks.items()}
+
+def get_sinks(engine:sqlalchemy.engine.base.Engine, names:List[str]=None, mode:str=Load.LOAD_MODE) -> List[Sink]:
+    """
+    Create the sinks of a run
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine, used by the database sink
+        names (List[str], optional): "database" and/or "parquet". Defaults to LOAD_SINKS
+        mode (str, optional): Load mode of the database sink. Defaults to LOAD_MODE
+
+    Returns:
+        sinks (List[Sink]): Sinks in the given order
+    """
+    names = LOAD_SINKS if names is None else names
+    sinks = []
+    for name in names:
+        if name == DatabaseSink.name:
+            sinks.append(DatabaseSink(engine=engine, mode=mode))
+        elif name == ParquetSink.name:
+            sinks.append(ParquetSink())
+        else:
+            raise ValueError(f"Sink {name} is not supported")
+    return sinks
@@ -0,0 +1,127 @@
+import os
+import threading
+from queue import Queue, Full
+from time import time
+from typing import Dict
+import sqlalchemy
+from . import extract as Extract
+from . import transform as Transform
+from . import load as Load
+from . import crawl as Crawl
+from . import sink as Sink
+from . import enrich as Enrich
+from .. import spotify, logger, metrics
+
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", 2))
+
+#Marks the end of the producer output
+_DONE = object()
+
+
+def iter_batches(plan, token:Dict[str,any], engine:sqlalchemy.engine.base.Engine=None):
+    """
+    Extract the planned pages one at a time. Each search page becomes one micro-batch
+
+    Params:
+        plan (List[Dict[str,any]]): Pages from crawl.plan_pages
+        token (Dict[str,any]): Spotify authentication token
+        engine (sqlalchemy.engine.base.Engine, optional): Database engine. When given and ENRICH_ENABLED, the new albums
+            and tracks of each page are enriched, once per run even when the previous page is not loaded yet
+
+    Yields:
+        batch (Dict[str,any]): A batch, containing:
+            - page (Dict[str,any]): The fetched page
+            - extract_result (Dict[str,any]): From extract.extract_from_tracks, None when the page is empty
+    """
+    seen_ids = {}
+    for page in Extract.iter_track_pages(plan=plan, token=token):
+        tracks = page["tracks"]
+        extract_result = Extract.extract_from_tracks(tracks=tracks, token=token) if tracks["items"] else None
+        if extract_result is not None and engine is not None and Enrich.ENRICH_ENABLED:
+            extract_result["enrichment"] = Enrich.get_enrichment(engine, extract_result["columns"], token=token, seen_ids=seen_ids)
+        yield {"page":page, "extract_result":extract_result}
+
+def run_streaming(engine:sqlalchemy.engine.base.Engine, pages:int=Crawl.CRAWL_PAGES_PER_RUN, queue_size:int=STREAM_QUEUE_SIZE, mode:str=Load.LOAD_MODE):
+    """
+    Run the pipeline as a stream of micro-batches: a producer thread extracts one search page at a time
+    into a bounded queue while the caller thread transforms and loads the previous ones, so network
+    fetches overlap with database writes and at most queue_size batches wait in memory.
+    The checkpoint of each page is saved right after its batch is loaded
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        pages (int, optional): Number of search pages of the run. Defaults to CRAWL_PAGES_PER_RUN
+        queue_size (int, optional): Maximum number of extracted batches waiting to be loaded. Defaults to STREAM_QUEUE_SIZE
+        mode (str, optional): Load mode, "upsert" or "append". Defaults to LOAD_MODE
+
+    Returns:
+        stream_stats (Dict[str,float]): batches, rows, and seconds spent waiting for extract, in transform and in load
+    """
+    token = spotify.get_token()
+    Crawl.ensure_checkpoint_table(engine=engine)
+    plan = Crawl.plan_pages(engine=engine, pages=pages)
+    if not plan:
+        logger.error("All crawl partitions are exhausted")
+        raise ValueError("All crawl partitions are exhausted")
+
+    sinks = Sink.get_sinks(engine=engine, mode=mode)
+    queue = Queue(maxsize=max(1, queue_size))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return
+            except Full:
+                continue
+
+    def produce():
+        try:
+            for batch in iter_batches(plan=plan, token=token, engine=engine):
+                if stop.is_set():
+                    return
+                put(batch)
+        except Exception as err:
+            logger.error(f"Error in stream extract: {err}")
+            put(err)
+        finally:
+            put(_DONE)
+
+    producer = threading.Thread(target=produce, name="stream-extract", daemon=True)
+    producer.start()
+
+    stream_stats = {"batches":0, "rows":0, "extract_wait":0.0, "transform":0.0, "load":0.0}
+    try:
+        while True:
+            wait_start_time = time()
+            with metrics.span("stream.extract_wait"):
+                item = queue.get()
+            stream_stats["extract_wait"] += time() - wait_start_time
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            if item["extract_result"] is not None:
+                transform_start_time = time()
+                with metrics.span("transform_task"):
+                    dfs = Transform.create_dfs(extract_result=item["extract_result"], engine=engine, filter_existing=mode == "append")
+                stream_stats["transform"] += time() - transform_start_time
+
+                load_start_time = time()
+                with metrics.span("load_task"):
+                    for sink in sinks:
+                        sink.write(dfs=dfs, genre=item["page"]["genre"])
+                stream_stats["load"] += time() - load_start_time
+                stream_stats["rows"] += sum(len(df) for df in dfs.values())
+
+            Crawl.save_checkpoints(engine=engine, checkpoints=Crawl.get_next_checkpoints([item["page"]]))
+            stream_stats["batches"] += 1
+    finally:
+        stop.set()
+        producer.join()
+
+    logger.info(f"Stream loaded {stream_stats['batches']} batches with {stream_stats['rows']} rows, "
+                f"extract wait:{stream_stats['extract_wait']}, transform:{stream_stats['transform']}, load:{stream_stats['load']}")
+    return stream_stats
@@ -1,9 +1,12 @@
 import pandas as pd
-from .extract import *
-from .. import logger
+from typing import Dict, List
+from . import extract as Extract
+from .. import logger, metrics
+from ..database.maintenance import LINK_TABLE_KEYS, ENRICHMENT_COLUMNS
 
 import sqlalchemy
 
+@metrics.timed()
 def create_track_df(track_details):
     # track_details = get_track_details_from_tracks(tracks)
     
@@ -11,6 +14,7 @@ def create_track_df(track_details):
     track_df['release_date'] = pd.to_datetime(track_df['release_date'], format='mixed')
     return track_df
 
+@metrics.timed()
 def create_album_df(album_details):
     # album_details = get_album_details_from_tracks(tracks)
     album_df = pd.DataFrame(album_details).drop(columns=['artist_ids']).drop_duplicates()
@@ -19,11 +23,13 @@ def create_album_df(album_details):
     return album_df
 
 
+@metrics.timed()
 def create_artist_track_df(artist_track):
     # artist_tracks = get_artist_track_from_tracks(tracks)
     artist_tracks_df = pd.DataFrame({"artist_id": list(artist_track.keys()), "track_id": artist_track.values()}).explode("track_id")
     return artist_tracks_df
 
+@metrics.timed()
 def create_artist_album_df(artist_album):
     # artist_albums = get_artist_album_dict_from_tracks(tracks)
     artist_albums_df = pd.DataFrame({"artist_id": list(artist_album.keys()), "album_id": artist_album.values()}).explode("album_id")
@@ -37,10 +43,12 @@ def create_artist_album_df(artist_album):
     artist_details = get_artist_details_from_ids(artist_ids)
     ```
     """
+@metrics.timed()
 def create_artist_df(artist_details):
-    artist_df = pd.DataFrame(artist_details).drop(columns='genres').drop_duplicates()
+    artist_df = pd.DataFrame(artist_details).drop(columns='genres', errors='ignore').drop_duplicates()
     return artist_df
 
+@metrics.timed()
 def create_artist_genre_df(artist_genre):
     # artist_genres = get_artist_genre_from_artist_details(artist_details)
     artist_genres_df = pd.DataFrame({"artist_id":artist_genre.keys(),"genre":artist_genre.values()}).explode('genre')
@@ -50,14 +58,16 @@ def create_genre_df(artist_details):
     '''
     DEPRECATED
     '''
-    genre_list = get_genre_list_from_artist(artist_details)
+    genre_list = Extract.get_genre_list_from_artist(artist_details)
     genre_df = pd.DataFrame(genre_list).drop_duplicates()
     return genre_df
     
+@metrics.timed()
 def create_track_album_df(track_in_album):
     track_album_df = pd.DataFrame(list(track_in_album.items()), columns=['track_id','album_id'])
     return track_album_df
 
+@metrics.timed()
 def get_existing_ids(engine:sqlalchemy.engine.base.Engine, table_name:str):
     if table_name not in ["track", "artist", "album"]:
         raise ValueError(f"Table name {table_name} is not supported")
@@ -65,10 +75,162 @@ def get_existing_ids(engine:sqlalchemy.engine.base.Engine, table_name:str):
         try:
             existing_values = pd.read_sql(con=conn, sql=f'SELECT id FROM {table_name}')
             return existing_values['id'].tolist()
-        except Exception as e:
+        except Exception as err:
+            logger.warning(f"Could not read the ids of table {table_name}: {err}")
             return None
 
 def filter_duplicate(df:pd.DataFrame, ids:List):
     return df[~df['id'].isin(ids)]
-    
 
+@metrics.timed()
+def get_existing_keys(engine:sqlalchemy.engine.base.Engine, table_name:str, key_columns:List[str]):
+    """
+    Retrieves the composite keys already stored in an association table
+
+    Returns:
+        existing_keys (pd.DataFrame): One column per key column, None when the table cannot be read
+    """
+    key_list = ", ".join(f'"{column}"' for column in key_columns)
+    with engine.begin() as conn:
+        try:
+            return pd.read_sql(con=conn, sql=f'SELECT {key_list} FROM "{table_name}"')
+        except Exception as err:
+            logger.warning(f"Could not read the keys of table {table_name}, nothing is filtered: {err}")
+            return None
+
+def dedupe_links(df:pd.DataFrame, key_columns:List[str]):
+    """Drop link rows with a missing key and duplicated keys inside a batch"""
+    return df.dropna(subset=key_columns).drop_duplicates(subset=key_columns, ignore_index=True)
+
+def filter_existing_keys(df:pd.DataFrame, existing_keys:pd.DataFrame, key_columns:List[str]):
+    """Vectorized anti-join: keep the rows of df whose composite key is not in existing_keys"""
+    if existing_keys is None or existing_keys.empty or df.empty:
+        return df
+    merged = df.merge(existing_keys[key_columns].drop_duplicates(), on=key_columns, how="left", indicator=True)
+    return merged[merged["_merge"] == "left_only"].drop(columns="_merge").reset_index(drop=True)
+
+@metrics.timed()
+def parse_release_dates(release_dates:List[str], precisions:List[str]=None):
+    """
+    Parse Spotify release dates in a vectorized way, according to their precision.
+    "year" dates ("2019") become January 1st and "month" dates ("2019-05") the first of the month.
+    When a precision is missing, it is inferred from the length of the date
+
+    Params:
+        release_dates (List[str]): Release dates from Spotify
+        precisions (List[str], optional): "year", "month" or "day" for each date
+
+    Returns:
+        release_dates (pd.Series): datetime64 Series, NaT for dates that cannot be parsed
+    """
+    dates = pd.Series(release_dates, dtype=object).fillna("").astype(str)
+    if precisions is None:
+        precision = dates.str.len().map({4:"year", 7:"month"})
+    else:
+        precision = pd.Series(precisions, index=dates.index, dtype=object)
+        precision = precision.fillna(dates.str.len().map({4:"year", 7:"month"}))
+    dates = dates + precision.map({"year":"-01-01", "month":"-01"}).fillna("")
+    return pd.to_datetime(dates, format="%Y-%m-%d", errors="coerce")
+
+def cast_enrichment_columns(df:pd.DataFrame, table_name:str):
+    """Give the integer enrichment columns a nullable integer dtype, so that missing values do not turn them into floats"""
+    for column, column_type in ENRICHMENT_COLUMNS[table_name].items():
+        if column_type == "integer" and column in df:
+            df[column] = pd.to_numeric(df[column]).astype("Int64")
+    return df
+
+def apply_enrichment(df:pd.DataFrame, table_name:str, enrichment:Dict[str,list], enriched_at:pd.Timestamp):
+    """
+    Fill the enrichment columns of new rows from fetched details. enriched_at is set on the rows that were
+    requested, and on the rows whose search result already had the columns (full track objects)
+
+    Params:
+        df (pd.DataFrame): "album" or "track" rows
+        table_name (str): "album" or "track"
+        enrichment (Dict[str,list]): From enrich.get_enrichment for this table, with ids and details. None when not enriched
+        enriched_at (pd.Timestamp): Time of the enrichment
+
+    Returns:
+        df (pd.DataFrame): The rows with the columns of ENRICHMENT_COLUMNS and enriched_at
+    """
+    enrichment_columns = list(ENRICHMENT_COLUMNS[table_name])
+    for column in enrichment_columns:
+        if column not in df:
+            df[column] = None
+    complete = df[enrichment_columns].notna().any(axis=1)
+    if enrichment:
+        details_df = pd.DataFrame(enrichment["details"], columns=["id", *enrichment_columns]).drop_duplicates(subset="id").set_index("id")
+        fetched = df["id"].isin(details_df.index)
+        for column in enrichment_columns:
+            df.loc[fetched, column] = df.loc[fetched, "id"].map(details_df[column])
+        complete |= df["id"].isin(enrichment["ids"])
+    df["enriched_at"] = pd.Series(enriched_at, index=df.index).where(complete)
+    return cast_enrichment_columns(df, table_name)
+
+@metrics.timed()
+def create_dfs_from_columns(columns:Dict[str,Dict[str,list]], artist_details:List[Dict[str,any]], artist_genre:Dict[str,List[str]],
+                            enrichment:Dict[str,Dict[str,list]]=None):
+    """
+    Create the DataFrames of every table from the column arrays of extract.flatten_tracks
+
+    Params:
+        columns (Dict[str,Dict[str,list]]): From extract.flatten_tracks
+        artist_details (List[Dict[str,any]]): From extract.get_artist_details_from_ids
+        artist_genre (Dict[str,List[str]]): From extract.get_artist_genre_from_artist_details
+        enrichment (Dict[str,Dict[str,list]], optional): From enrich.get_enrichment, album and track details of the new ids
+
+    Returns:
+        dfs (Dict[str,pd.DataFrame]): DataFrames keyed by table name
+    """
+    track_df = pd.DataFrame(columns["track"])
+    track_df["release_date"] = parse_release_dates(track_df["release_date"], track_df["release_date_precision"])
+    track_df = track_df.drop(columns="release_date_precision").drop_duplicates(subset="id")
+
+    album_df = pd.DataFrame(columns["album"])
+    album_df["release_date"] = parse_release_dates(album_df["release_date"], album_df["release_date_precision"])
+    album_df = album_df.drop(columns="release_date_precision").drop_duplicates(subset="id")
+
+    #fetched_at lets the refresh job find the stalest artists and albums. Artists keep the time their details
+    #were fetched (see extract.get_artist_details_from_ids), which is older than the run for cached artists
+    fetched_at = pd.Timestamp.now()
+    artist_df = create_artist_df(artist_details=artist_details)
+    artist_df["fetched_at"] = pd.to_datetime(artist_df["fetched_at"]) if "fetched_at" in artist_df else fetched_at
+    album_df["fetched_at"] = fetched_at
+    enrichment = enrichment or {}
+    album_df = apply_enrichment(album_df, "album", enrichment.get("album"), fetched_at)
+    track_df = apply_enrichment(track_df, "track", enrichment.get("track"), fetched_at)
+
+    return {
+        "artist":artist_df,
+        "album":album_df,
+        "track":track_df,
+        "artist_genre":dedupe_links(create_artist_genre_df(artist_genre=artist_genre), LINK_TABLE_KEYS["artist_genre"]),
+        "artist_track":dedupe_links(pd.DataFrame(columns["artist_track"]), LINK_TABLE_KEYS["artist_track"]),
+        "artist_album":dedupe_links(pd.DataFrame(columns["artist_album"]), LINK_TABLE_KEYS["artist_album"]),
+        "track_album":dedupe_links(pd.DataFrame(columns["track_album"]), LINK_TABLE_KEYS["track_album"]).drop_duplicates(subset="track_id")}
+
+@metrics.timed()
+def create_dfs(extract_result:Dict[str,any], engine:sqlalchemy.engine.base.Engine=None, filter_existing:bool=False):
+    """
+    Create the DataFrames of every table from an extract result
+
+    Params:
+        extract_result (Dict[str,any]): From extract.extract_from_tracks
+        engine (sqlalchemy.engine.base.Engine, optional): Database engine, needed when filter_existing is True
+        filter_existing (bool, optional): Drop artists, albums, tracks and links already in the database. Defaults to False
+
+    Returns:
+        dfs (Dict[str,pd.DataFrame]): DataFrames keyed by table name
+    """
+    dfs = create_dfs_from_columns(columns=extract_result["columns"], artist_details=extract_result["artist"], artist_genre=extract_result["artist_genre"],
+                                  enrichment=extract_result.get("enrichment"))
+    if filter_existing:
+        for table_name in ["artist", "album", "track"]:
+            rows_in = len(dfs[table_name])
+            dfs[table_name] = filter_duplicate(df=dfs[table_name], ids=get_existing_ids(engine=engine, table_name=table_name))
+            metrics.count_rows(table_name, rows_in=rows_in, rows_out=len(dfs[table_name]), stage="filter")
+        for table_name, key_columns in LINK_TABLE_KEYS.items():
+            rows_in = len(dfs[table_name])
+            dfs[table_name] = filter_existing_keys(df=dfs[table_name], existing_keys=get_existing_keys(engine=engine, table_name=table_name, key_columns=key_columns), key_columns=key_columns)
+            metrics.count_rows(table_name, rows_in=rows_in, rows_out=len(dfs[table_name]), stage="filter")
+    return dfs
@@ -0,0 +1,519 @@
+import os
+import hashlib
+import json
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List
+import sqlalchemy
+import pandas as pd
+from . import extract as Extract
+from . import transform as Transform
+from . import load as Load
+from . import crawl as Crawl
+from . import refresh as Refresh
+from . import sink as Sink
+from . import enrich as Enrich
+from .. import spotify, logger, metrics
+from ..database import aggregates
+from ..database.maintenance import LINK_TABLE_KEYS
+from ..database.work_queue import WORK_ITEM_TABLE, get_queue_stats
+
+#Seconds a claimed item stays leased without a heartbeat before another worker may claim it
+WORKER_LEASE_SECONDS = float(os.getenv("WORKER_LEASE_SECONDS", 120))
+WORKER_HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", 30))
+#Claims of an item before it is marked failed
+WORKER_MAX_ATTEMPTS = int(os.getenv("WORKER_MAX_ATTEMPTS", 3))
+#Search pages queued ahead per crawl partition
+WORKER_QUEUE_DEPTH = int(os.getenv("WORKER_QUEUE_DEPTH", 4))
+#Seconds to wait when every item is leased by other workers
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", 2))
+#Items processed before the worker stops, 0 runs until the queue is drained
+WORKER_MAX_ITEMS = int(os.getenv("WORKER_MAX_ITEMS", 0))
+#Tokens taken from the shared rate budget per database round trip
+RATE_BUDGET_CHUNK = int(os.getenv("RATE_BUDGET_CHUNK", 2))
+
+RATE_BUDGET_TABLE = "rate_budget"
+#Kinds of work items, claimed in this order: artist batches complete pages that are already loaded
+WORK_KINDS = ["artists", "search"]
+#Artists inserted by a search page before their details are fetched. They have no name, which
+#keeps them out of the refresh mode (refresh.get_stalest_ids): their work item fetches them, or
+#requeue_placeholder_artists when that item failed
+PLACEHOLDER_FETCHED_AT = datetime(1970, 1, 1)
+
+
+def ensure_work_tables(engine:sqlalchemy.engine.base.Engine):
+    """Creates the work queue and rate budget tables if they do not exist yet (same definitions as in create_table.sql)."""
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text(
+            f'CREATE TABLE IF NOT EXISTS "{WORK_ITEM_TABLE}" ('
+            '"kind" text NOT NULL, "item_key" text NOT NULL, "partition_key" text, "payload" text, "status" text NOT NULL DEFAULT \'pending\', '
+            '"attempts" integer NOT NULL DEFAULT 0, "lease_owner" text, "lease_expires_at" timestamp, "last_error" text, '
+            '"created_at" timestamp, "updated_at" timestamp, PRIMARY KEY ("kind", "item_key"))'
+        ))
+        conn.execute(sqlalchemy.text(
+            f'CREATE INDEX IF NOT EXISTS "{WORK_ITEM_TABLE}_status_idx" ON "{WORK_ITEM_TABLE}" ("kind", "status", "created_at")'
+        ))
+        conn.execute(sqlalchemy.text(
+            f'CREATE INDEX IF NOT EXISTS "{WORK_ITEM_TABLE}_partition_idx" ON "{WORK_ITEM_TABLE}" ("kind", "partition_key", "status")'
+        ))
+        conn.execute(sqlalchemy.text(
+            f'CREATE TABLE IF NOT EXISTS "{RATE_BUDGET_TABLE}" ('
+            '"name" text PRIMARY KEY, "tokens" double precision NOT NULL, "refilled_at" double precision NOT NULL, '
+            '"paused_until" double precision NOT NULL DEFAULT 0)'
+        ))
+
+@contextmanager
+def write_transaction(engine:sqlalchemy.engine.base.Engine):
+    """
+    Transaction that holds the write lock from its first statement. SQLite has no row locks,
+    so the transaction is started with BEGIN IMMEDIATE and concurrent writers wait for it
+    instead of failing when they upgrade a read lock
+    """
+    if engine.dialect.name != "sqlite":
+        with engine.begin() as conn:
+            yield conn
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+        conn.exec_driver_sql("COMMIT")
+
+def get_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def enqueue_items(conn:sqlalchemy.engine.Connection, kind:str, items:Dict[str,Dict[str,any]]):
+    """
+    Add pending work items. Items whose key is already queued, whatever their status, are skipped,
+    so concurrent workers can enqueue the same items. Search pages also store their crawl partition
+    in partition_key, see get_partition_key
+
+    Params:
+        conn (sqlalchemy.engine.Connection): Connection with an open transaction
+        kind (str): One of WORK_KINDS
+        items (Dict[str,Dict[str,any]]): JSON payloads keyed by item key
+    """
+    if not items:
+        return
+    now = datetime.now()
+    conn.execute(sqlalchemy.text(
+        f'INSERT INTO "{WORK_ITEM_TABLE}" ("kind", "item_key", "partition_key", "payload", "status", "attempts", "created_at", "updated_at") '
+        'VALUES (:kind, :item_key, :partition_key, :payload, \'pending\', 0, :now, :now) ON CONFLICT ("kind", "item_key") DO NOTHING'
+    ), [{"kind":kind, "item_key":item_key, "partition_key":get_partition_key(payload) if kind == "search" else None,
+         "payload":json.dumps(payload), "now":now} for item_key, payload in items.items()])
+
+def claim_items(engine:sqlalchemy.engine.base.Engine, owner:str, kind:str, limit:int=1, lease_seconds:float=WORKER_LEASE_SECONDS,
+                max_attempts:int=WORKER_MAX_ATTEMPTS) -> List[Dict[str,any]]:
+    """
+    Lease pending items, and items whose lease expired, to the given worker. PostgreSQL skips the rows
+    other workers are claiming (FOR UPDATE SKIP LOCKED); SQLite runs claims one at a time (BEGIN IMMEDIATE)
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        owner (str): Worker id, see get_worker_id
+        kind (str): One of WORK_KINDS
+        limit (int, optional): Maximum number of items. Defaults to 1
+        lease_seconds (float, optional): Lease duration. Defaults to WORKER_LEASE_SECONDS
+        max_attempts (int, optional): Items claimed that many times are not claimed again. Defaults to WORKER_MAX_ATTEMPTS
+
+    Returns:
+        items (List[Dict[str,any]]): kind, item_key, payload and attempts of every claimed item
+    """
+    now = datetime.now()
+    skip_locked = " FOR UPDATE SKIP LOCKED" if engine.dialect.name == "postgresql" else ""
+    with write_transaction(engine) as conn:
+        rows = conn.execute(sqlalchemy.text(
+            f'UPDATE "{WORK_ITEM_TABLE}" SET "status" = \'leased\', "lease_owner" = :owner, "lease_expires_at" = :expires_at, '
+            '"attempts" = "attempts" + 1, "updated_at" = :now '
+            f'WHERE "kind" = :kind AND "item_key" IN (SELECT "item_key" FROM "{WORK_ITEM_TABLE}" WHERE "kind" = :kind '
+            'AND ("status" = \'pending\' OR ("status" = \'leased\' AND "lease_expires_at" < :now AND "attempts" < :max_attempts)) '
+            f'ORDER BY "created_at", "item_key" LIMIT :limit{skip_locked}) '
+            'RETURNING "kind", "item_key", "payload", "attempts"'
+        ), {"owner":owner, "kind":kind, "now":now, "expires_at":now + timedelta(seconds=lease_seconds),
+            "limit":limit, "max_attempts":max_attempts}).fetchall()
+    return [{"kind":kind, "item_key":item_key, "payload":json.loads(payload), "attempts":attempts} for kind, item_key, payload, attempts in rows]
+
+def extend_leases(engine:sqlalchemy.engine.base.Engine, owner:str, lease_seconds:float=WORKER_LEASE_SECONDS) -> int:
+    """Heartbeat: push back the expiry of every item leased by the worker. Returns the number of leases extended"""
+    with write_transaction(engine) as conn:
+        return conn.execute(sqlalchemy.text(
+            f'UPDATE "{WORK_ITEM_TABLE}" SET "lease_expires_at" = :expires_at WHERE "lease_owner" = :owner AND "status" = \'leased\''
+        ), {"owner":owner, "expires_at":datetime.now() + timedelta(seconds=lease_seconds)}).rowcount
+
+def complete_item(engine:sqlalchemy.engine.base.Engine, item:Dict[str,any], owner:str, status:str="done") -> bool:
+    """
+    Mark a leased item as done (or cancelled). Returns False when the lease was lost to another worker,
+    whose result then replaces this one: every write of an item is idempotent
+    """
+    with write_transaction(engine) as conn:
+        return conn.execute(sqlalchemy.text(
+            f'UPDATE "{WORK_ITEM_TABLE}" SET "status" = :status, "lease_owner" = NULL, "lease_expires_at" = NULL, "updated_at" = :now '
+            'WHERE "kind" = :kind AND "item_key" = :item_key AND "lease_owner" = :owner AND "status" = \'leased\''
+        ), {"status":status, "now":datetime.now(), "kind":item["kind"], "item_key":item["item_key"], "owner":owner}).rowcount == 1
+
+def release_item(engine:sqlalchemy.engine.base.Engine, item:Dict[str,any], owner:str, error:str, max_attempts:int=WORKER_MAX_ATTEMPTS):
+    """Give a failed item back to the queue, or mark it failed once it was claimed max_attempts times"""
+    status = "failed" if item["attempts"] >= max_attempts else "pending"
+    with write_transaction(engine) as conn:
+        conn.execute(sqlalchemy.text(
+            f'UPDATE "{WORK_ITEM_TABLE}" SET "status" = :status, "lease_owner" = NULL, "lease_expires_at" = NULL, '
+            '"last_error" = :error, "updated_at" = :now '
+            'WHERE "kind" = :kind AND "item_key" = :item_key AND "lease_owner" = :owner AND "status" = \'leased\''
+        ), {"status":status, "error":error[:1000], "now":datetime.now(), "kind":item["kind"], "item_key":item["item_key"], "owner":owner})
+
+def expire_dead_items(engine:sqlalchemy.engine.base.Engine, max_attempts:int=WORKER_MAX_ATTEMPTS) -> int:
+    """Mark failed the items whose last lease expired after max_attempts claims, e.g. items that crash their worker"""
+    with write_transaction(engine) as conn:
+        return conn.execute(sqlalchemy.text(
+            f'UPDATE "{WORK_ITEM_TABLE}" SET "status" = \'failed\', "last_error" = \'lease expired\', "lease_owner" = NULL, "updated_at" = :now '
+            'WHERE "status" = \'leased\' AND "lease_expires_at" < :now AND "attempts" >= :max_attempts'
+        ), {"now":datetime.now(), "max_attempts":max_attempts}).rowcount
+
+def get_partition_key(page:Dict[str,any]) -> str:
+    return f"{page['genre']}|{page['query_partition']}"
+
+def get_search_item_key(page:Dict[str,any]) -> str:
+    """Key of a search page. The offset is zero padded, so the keys of a partition sort in offset order"""
+    return f"{get_partition_key(page)}|{page['offset']:04d}"
+
+def enqueue_search_pages(engine:sqlalchemy.engine.base.Engine, partitions:List[Dict[str,str]]=None, depth:int=WORKER_QUEUE_DEPTH,
+                         limit:int=Crawl.SEARCH_LIMIT) -> int:
+    """
+    Top up the queue so that every partition that is not exhausted has depth search pages waiting.
+    New pages continue after the last page queued for the partition, or after its checkpoint
+
+    Returns:
+        total_records (int): Number of pages queued
+    """
+    partitions = Crawl.get_partitions() if partitions is None else partitions
+    checkpoints = Crawl.get_checkpoints(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(sqlalchemy.text(
+            f'SELECT "payload", "status" FROM "{WORK_ITEM_TABLE}" WHERE "kind" = \'search\''
+        )).fetchall()
+    queued:Dict[tuple,Dict[str,int]] = {}
+    for payload, status in rows:
+        page = json.loads(payload)
+        partition_queue = queued.setdefault((page["genre"], page["query_partition"]), {"next_offset":0, "open":0})
+        partition_queue["next_offset"] = max(partition_queue["next_offset"], page["offset"] + page["limit"])
+        partition_queue["open"] += status in ("pending", "leased")
+
+    items = {}
+    for partition in partitions:
+        key = (partition["genre"], partition["query_partition"])
+        checkpoint = checkpoints.get(key, {"next_offset":0, "exhausted":False})
+        if checkpoint["exhausted"]:
+            continue
+        partition_queue = queued.get(key, {"next_offset":0, "open":0})
+        offset = max(checkpoint["next_offset"], partition_queue["next_offset"])
+        for _ in range(depth - partition_queue["open"]):
+            if offset + limit >= Crawl.MAX_SEARCH_OFFSET:
+                break
+            page = {**partition, "offset":offset, "limit":limit}
+            items[get_search_item_key(page)] = page
+            offset += limit
+    with write_transaction(engine) as conn:
+        enqueue_items(conn, "search", items)
+    return len(items)
+
+def cancel_search_pages(engine:sqlalchemy.engine.base.Engine, page:Dict[str,any]) -> int:
+    """Cancel the pending pages of an exhausted partition that come after the given page"""
+    with write_transaction(engine) as conn:
+        return conn.execute(sqlalchemy.text(
+            f'UPDATE "{WORK_ITEM_TABLE}" SET "status" = \'cancelled\', "updated_at" = :now '
+            'WHERE "kind" = \'search\' AND "partition_key" = :partition_key AND "status" = \'pending\' AND "item_key" > :item_key'
+        ), {"partition_key":get_partition_key(page), "item_key":get_search_item_key(page), "now":datetime.now()}).rowcount
+
+def add_artist_placeholders(engine:sqlalchemy.engine.base.Engine, artist_ids:List[str], source_key:str, genre:str) -> List[str]:
+    """
+    Insert an artist row holding only the id for every artist not stored yet, so the links of a search page
+    can be loaded before the artist details are fetched, and queue batches of 50 of the new artists for
+    enrichment. An artist is queued only by the worker whose insert created it, which is what keeps two
+    workers from fetching the same artist
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        artist_ids (List[str]): Artists of a search page
+        source_key (str): Item key of the page, prefix of the keys of the artist batches
+        genre (str): Genre of the page, used as the partition of the non database sinks
+
+    Returns:
+        new_ids (List[str]): Artists that were not stored yet
+    """
+    existing_stmt = sqlalchemy.text('SELECT "id" FROM "artist" WHERE "id" IN :artist_ids').bindparams(
+        sqlalchemy.bindparam("artist_ids", expanding=True))
+    new_ids = []
+    with write_transaction(engine) as conn:
+        existing_ids = {row[0] for row in conn.execute(existing_stmt, {"artist_ids":list(artist_ids)})} if artist_ids else set()
+        for artist_id in sorted(set(artist_ids) - existing_ids):
+            inserted = conn.execute(sqlalchemy.text(
+                'INSERT INTO "artist" ("id", "fetched_at") VALUES (:id, :fetched_at) ON CONFLICT ("id") DO NOTHING'
+            ), {"id":artist_id, "fetched_at":PLACEHOLDER_FETCHED_AT}).rowcount
+            if inserted:
+                new_ids.append(artist_id)
+        enqueue_items(conn, "artists", {
+            f"{source_key}|{index}":{"artist_ids":batch, "genre":genre}
+            for index, batch in enumerate(Extract.chunk_ids(new_ids, Extract.MAX_ARTIST_IDS_PER_REQUEST))
+        })
+    return new_ids
+
+def requeue_placeholder_artists(engine:sqlalchemy.engine.base.Engine) -> int:
+    """
+    Queue again the placeholder artists whose batch failed, once no artist batch is pending or leased:
+    every placeholder left then belongs to a failed batch. Item keys are derived from the artist ids,
+    so workers requeueing at the same time queue the batches once, and a set of artists that failed again
+    is not requeued until it changes
+
+    Returns:
+        total_records (int): Number of artists queued
+    """
+    with write_transaction(engine) as conn:
+        open_items = conn.execute(sqlalchemy.text(
+            f'SELECT count(*) FROM "{WORK_ITEM_TABLE}" WHERE "kind" = \'artists\' AND "status" IN (\'pending\', \'leased\')'
+        )).scalar()
+        if open_items:
+            return 0
+        artist_ids = [row[0] for row in conn.execute(sqlalchemy.text(
+            'SELECT "id" FROM "artist" WHERE "name" IS NULL AND "fetched_at" = :fetched_at ORDER BY "id"'
+        ), {"fetched_at":PLACEHOLDER_FETCHED_AT})]
+        if not artist_ids:
+            return 0
+        key = hashlib.sha1(",".join(artist_ids).encode()).hexdigest()[:16]
+        items = {
+            f"requeue|{key}|{index}":{"artist_ids":batch, "genre":None}
+            for index, batch in enumerate(Extract.chunk_ids(artist_ids, Extract.MAX_ARTIST_IDS_PER_REQUEST))
+        }
+        queued = conn.execute(sqlalchemy.text(
+            f'SELECT count(*) FROM "{WORK_ITEM_TABLE}" WHERE "kind" = \'artists\' AND "item_key" = :item_key'
+        ), {"item_key":next(iter(items))}).scalar()
+        if queued:
+            return 0
+        enqueue_items(conn, "artists", items)
+    logger.info(f"Requeued {len(artist_ids)} placeholder artists of failed batches")
+    return len(artist_ids)
+
+@metrics.timed()
+def process_search_page(engine:sqlalchemy.engine.base.Engine, item:Dict[str,any], token:Dict[str,any], sinks:List[Sink.Sink]):
+    """
+    Fetch a search page, load its tracks, albums (with the full objects of the new ones) and links,
+    queue its new artists and move the checkpoint of its partition
+
+    Returns:
+        page_stats (Dict[str,int]): tracks of the page
+    """
+    page = item["payload"]
+    tracks = Extract.get_tracks_by_query(query=page["query"], token=token, offset=page["offset"], limit=page["limit"])
+    if tracks["items"]:
+        columns = Extract.flatten_tracks(tracks)
+        artist_ids = columns.pop("artist_ids")
+        enrichment = Enrich.get_enrichment(engine, columns, token=token) if Enrich.ENRICH_ENABLED else None
+        dfs = Transform.create_dfs_from_columns(columns=columns, artist_details=[], artist_genre={}, enrichment=enrichment)
+        add_artist_placeholders(engine, artist_ids, source_key=item["item_key"], genre=page["genre"])
+        for sink in sinks:
+            sink.write(dfs=dfs, genre=page["genre"])
+    checkpoints = Crawl.get_next_checkpoints([{**page, "tracks":tracks}])
+    Crawl.save_checkpoints(engine=engine, checkpoints=checkpoints)
+    if checkpoints[0]["exhausted"]:
+        cancel_search_pages(engine, page)
+    return {"tracks":len(tracks["items"])}
+
+@metrics.timed()
+def process_artist_batch(engine:sqlalchemy.engine.base.Engine, item:Dict[str,any], token:Dict[str,any], sinks:List[Sink.Sink]):
+    """
+    Fetch the details of a batch of placeholder artists (see add_artist_placeholders), fill their rows and genres.
+    fetched_at is set on every artist of the batch, including the ones no longer on Spotify, so that
+    requeue_placeholder_artists does not queue them again
+
+    Returns:
+        batch_stats (Dict[str,int]): artists fetched
+    """
+    artist_ids = item["payload"]["artist_ids"]
+    artist_details = Extract.get_artist_details_from_ids(artist_ids, token=token)
+    artist_df = Transform.create_artist_df(artist_details=artist_details)
+    artist_genre_df = Transform.dedupe_links(
+        Transform.create_artist_genre_df(artist_genre=Extract.get_artist_genre_from_artist_details(artist_details)),
+        LINK_TABLE_KEYS["artist_genre"])
+    #Cached artists keep the time they were fetched from Spotify, artists not found get the current time
+    fetched_at = datetime.now()
+    detail_fetched_at = {artist_detail["id"]:datetime.fromisoformat(artist_detail["fetched_at"]) for artist_detail in artist_details}
+    ids_by_fetched_at:Dict[datetime,List[str]] = {}
+    for artist_id in artist_ids:
+        ids_by_fetched_at.setdefault(detail_fetched_at.get(artist_id, fetched_at), []).append(artist_id)
+    with engine.begin() as conn:
+        Refresh.update_changed_rows(conn, "artist", artist_df, Refresh.REFRESH_COLUMNS["artist"])
+        for row_fetched_at, row_ids in ids_by_fetched_at.items():
+            Refresh.set_fetched_at(conn, "artist", row_ids, row_fetched_at)
+        Load.load_table(conn, artist_genre_df, "artist_genre", mode="upsert")
+    if aggregates.AGGREGATES_ENABLED:
+        aggregates.refresh_aggregates(engine=engine, artist_ids=artist_ids)
+    if not artist_df.empty:
+        artist_df["fetched_at"] = pd.to_datetime(artist_df["fetched_at"])
+    for sink in sinks:
+        if sink.name != Sink.DatabaseSink.name:
+            sink.write(dfs={"artist":artist_df, "artist_genre":artist_genre_df}, genre=item["payload"]["genre"])
+    return {"artists":len(artist_details)}
+
+
+class SharedRateBudget:
+    """
+    Token bucket stored in the rate_budget table, shared by every worker using the same database.
+    Tokens are taken chunk at a time under a row lock and handed out locally, and a pause after a 429
+    response is written to the table so every worker waits. Implements acquire() and pause() like
+    spotify.client.TokenBucket, install it with spotify.client.set_rate_limiter
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        name (str, optional): Budget name. Defaults to "spotify"
+        rate (float, optional): Tokens added per second. Defaults to SPOTIFY_RATE_LIMIT_PER_SECOND
+        capacity (int, optional): Maximum number of tokens. Defaults to SPOTIFY_RATE_LIMIT_BURST
+        chunk (int, optional): Tokens taken per round trip. Defaults to RATE_BUDGET_CHUNK
+    """
+    def __init__(self, engine:sqlalchemy.engine.base.Engine, name:str="spotify", rate:float=spotify.client.RATE_LIMIT_PER_SECOND,
+                 capacity:int=spotify.client.RATE_LIMIT_BURST, chunk:int=RATE_BUDGET_CHUNK):
+        self.engine = engine
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.chunk = max(1, chunk)
+        self.tokens = 0
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        with write_transaction(engine) as conn:
+            conn.execute(sqlalchemy.text(
+                f'INSERT INTO "{RATE_BUDGET_TABLE}" ("name", "tokens", "refilled_at", "paused_until") '
+                'VALUES (:name, :tokens, :now, 0) ON CONFLICT ("name") DO NOTHING'
+            ), {"name":name, "tokens":float(capacity), "now":time.time()})
+
+    def take(self) -> float:
+        """Take up to chunk tokens from the table. Returns 0 when tokens were taken, else the seconds to wait"""
+        lock = " FOR UPDATE" if self.engine.dialect.name == "postgresql" else ""
+        with write_transaction(self.engine) as conn:
+            tokens, refilled_at, paused_until = conn.execute(sqlalchemy.text(
+                f'SELECT "tokens", "refilled_at", "paused_until" FROM "{RATE_BUDGET_TABLE}" WHERE "name" = :name{lock}'
+            ), {"name":self.name}).fetchone()
+            now = time.time()
+            tokens = min(self.capacity, tokens + max(0.0, now - refilled_at) * self.rate)
+            taken = min(self.chunk, int(tokens)) if now >= paused_until else 0
+            conn.execute(sqlalchemy.text(
+                f'UPDATE "{RATE_BUDGET_TABLE}" SET "tokens" = :tokens, "refilled_at" = :now WHERE "name" = :name'
+            ), {"name":self.name, "tokens":tokens - taken, "now":now})
+        self.tokens += taken
+        self.paused_until = paused_until
+        if taken:
+            return 0.0
+        if now < paused_until:
+            return paused_until - now
+        return (1 - tokens) / self.rate
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self.lock:
+                if self.tokens >= 1 and time.time() >= self.paused_until:
+                    self.tokens -= 1
+                    return
+                wait = self.take()
+            if wait:
+                time.sleep(wait)
+
+    def pause(self, seconds:float):
+        """Stop every worker from sending requests for the given number of seconds, e.g. after a Retry-After"""
+        paused_until = time.time() + seconds
+        with self.lock:
+            self.paused_until = max(self.paused_until, paused_until)
+            self.tokens = 0
+        with write_transaction(self.engine) as conn:
+            conn.execute(sqlalchemy.text(
+                f'UPDATE "{RATE_BUDGET_TABLE}" SET "paused_until" = :paused_until WHERE "name" = :name AND "paused_until" < :paused_until'
+            ), {"name":self.name, "paused_until":paused_until})
+
+
+def run_worker(engine:sqlalchemy.engine.base.Engine, max_items:int=WORKER_MAX_ITEMS, stop:threading.Event=None, mode:str=Load.LOAD_MODE):
+    """
+    Process work items until the queue is drained: artist batches first, then search pages, topping up
+    the queue with the next search pages when it runs empty. Any number of workers can run at once, on one
+    host or several, against the same database: every item is leased to one worker, a heartbeat thread keeps
+    the leases alive, and the items of a worker that dies are claimed again once its leases expire.
+    The Spotify rate limit is shared by all workers through the rate_budget table
+
+    Params:
+        engine (sqlalchemy.engine.base.Engine): Database engine
+        max_items (int, optional): Items processed before stopping, 0 for no limit. Defaults to WORKER_MAX_ITEMS
+        stop (threading.Event, optional): Event that stops the worker after the current item
+        mode (str, optional): Load mode of the database sink. Defaults to LOAD_MODE
+
+    Returns:
+        worker_stats (Dict[str,int]): items, failed, tracks and artists
+    """
+    stop = stop or threading.Event()
+    owner = get_worker_id()
+    Crawl.ensure_checkpoint_table(engine=engine)
+    ensure_work_tables(engine)
+    previous_limiter = spotify.client.set_rate_limiter(SharedRateBudget(engine))
+    token = spotify.get_token()
+    sinks = Sink.get_sinks(engine=engine, mode=mode)
+
+    heartbeat_stop = threading.Event()
+    def heartbeat():
+        while not heartbeat_stop.wait(WORKER_HEARTBEAT_SECONDS):
+            try:
+                extend_leases(engine, owner)
+            except Exception as err:
+                logger.error(f"Worker {owner} heartbeat failed: {err}")
+    heartbeat_thread = threading.Thread(target=heartbeat, name="worker-heartbeat", daemon=True)
+    heartbeat_thread.start()
+
+    worker_stats = {"items":0, "failed":0, "tracks":0, "artists":0}
+    logger.info(f"Worker {owner} started")
+    try:
+        while not stop.is_set() and not (max_items and worker_stats["items"] >= max_items):
+            items = []
+            for kind in WORK_KINDS:
+                items = claim_items(engine, owner, kind)
+                if items:
+                    break
+            if not items:
+                expire_dead_items(engine)
+                if requeue_placeholder_artists(engine) or enqueue_search_pages(engine):
+                    continue
+                open_items = sum(count for kind_stats in get_queue_stats(engine).values()
+                                 for status, count in kind_stats.items() if status in ("pending", "leased"))
+                if open_items == 0:
+                    logger.info(f"Worker {owner}: queue drained")
+                    break
+                stop.wait(WORKER_POLL_INTERVAL)
+                continue
+
+            item = items[0]
+            try:
+                token = spotify.get_token()
+                with metrics.span(f"worker.{item['kind']}"):
+                    if item["kind"] == "search":
+                        item_stats = process_search_page(engine, item, token=token, sinks=sinks)
+                    else:
+                        item_stats = process_artist_batch(engine, item, token=token, sinks=sinks)
+            except Exception as err:
+                logger.error(f"Worker {owner} failed on {item['kind']} {item['item_key']}: {err}")
+                release_item(engine, item, owner, error=str(err))
+                worker_stats["failed"] += 1
+                continue
+            if not complete_item(engine, item, owner):
+                logger.warning(f"Worker {owner} lost the lease of {item['kind']} {item['item_key']}")
+            worker_stats["items"] += 1
+            for key, value in item_stats.items():
+                worker_stats[key] += value
+    finally:
+        heartbeat_stop.set()
+        heartbeat_thread.join()
+        spotify.client.set_rate_limiter(previous_limiter)
+
+    logger.info(f"Worker {owner} processed {worker_stats['items']} items ({worker_stats['failed']} failed), "
+                f"{worker_stats['tracks']} tracks and {worker_stats['artists']} artists")
+    return worker_stats
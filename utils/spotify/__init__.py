@@ -1 +1,2 @@
-from .authentication import *
\ No newline at end of file
+from .authentication import *
+from . import client
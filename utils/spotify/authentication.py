@@ -1,7 +1,9 @@
 import os
 from dotenv import load_dotenv
 import json
-import requests
+import threading
+import time
+from . import client
 from typing import Dict
 from .. import logger
 
@@ -10,26 +12,60 @@ load_dotenv(dotenv_path=".env")
 #Constants
 __SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 __SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+TOKEN_CACHE_PATH = os.getenv("SPOTIFY_TOKEN_CACHE")
+TOKEN_REFRESH_MARGIN = int(os.getenv("SPOTIFY_TOKEN_REFRESH_MARGIN", 60))
 
-#Main API routes
-SPOTIFY_API_URL_PREFIX = "https://api.spotify.com/v1"
+#Main API routes, can be pointed at a local stand-in server (see benchmarks/fake_spotify.py)
+SPOTIFY_API_URL_PREFIX = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+SPOTIFY_ACCOUNTS_URL = os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com")
 
+#In-process token cache
+_token = None
+_token_lock = threading.RLock()
 
-def get_token(client_id:str=__SPOTIFY_CLIENT_ID, client_secret:str=__SPOTIFY_CLIENT_SECRET):
+
+def is_token_valid(token:Dict[str,any], client_id:str=None) -> bool:
     """
-    Retrieves a Spotify access token.
+    Check if a token can still be used for at least TOKEN_REFRESH_MARGIN seconds
 
     Params:
-        client_id (str): The Spotify Client ID.
-        client_secret (str): The Spotify Client Secret.
+        token (Dict[str,any]): token dictionary from get_token()
+        client_id (str, optional): When given, the token must also belong to this client
 
     Returns:
-        response_json (Dict(str, str, int)): A dictionary containing:
-            - access_token (str): The Spotify access token.
-            - token_type (str): The type of authorization token (e.g., "Bearer").
-            - expires_in (int): The token's expiration time in seconds (typically 3600).
+        valid (bool): Whether the token can be used
     """
-    URL_TOKEN = "https://accounts.spotify.com/api/token"
+    if not token or "access_token" not in token:
+        return False
+    if client_id is not None and token.get("client_id") != client_id:
+        return False
+    return time.time() < token.get("expires_at", 0) - TOKEN_REFRESH_MARGIN
+
+def _read_token_cache():
+    if not TOKEN_CACHE_PATH or not os.path.exists(TOKEN_CACHE_PATH):
+        return None
+    try:
+        with open(TOKEN_CACHE_PATH, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError) as err:
+        logger.warning(f"Cannot read Spotify token cache: {err}")
+        return None
+
+def _write_token_cache(token:Dict[str,any]):
+    if not TOKEN_CACHE_PATH:
+        return
+    tmp_path = f"{TOKEN_CACHE_PATH}.tmp"
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(token, file)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, TOKEN_CACHE_PATH)
+    except OSError as err:
+        logger.warning(f"Cannot write Spotify token cache: {err}")
+
+def _request_token(client_id:str, client_secret:str):
+    URL_TOKEN = f"{SPOTIFY_ACCOUNTS_URL}/api/token"
     headers = {
         "Content-Type":"application/x-www-form-urlencoded"
     }
@@ -39,24 +75,103 @@ def get_token(client_id:str=__SPOTIFY_CLIENT_ID, client_secret:str=__SPOTIFY_CLI
         "client_secret":client_secret
     }
     try:
-        response = requests.post(url=URL_TOKEN, headers=headers, data=payload)
+        response = client.post(url=URL_TOKEN, headers=headers, data=payload)
         response_json = json.loads(response.content)
-        logger.info("Get new spotify token")
-        return response_json
     except Exception as err:
         print(err)
         return None
+    if "access_token" not in response_json:
+        logger.error(f"Cannot get spotify token: {response_json.get('error')}")
+        return None
+    response_json["expires_at"] = time.time() + response_json.get("expires_in", 3600)
+    response_json["client_id"] = client_id
+    logger.info("Get new spotify token")
+    return response_json
+
+def get_token(client_id:str=__SPOTIFY_CLIENT_ID, client_secret:str=__SPOTIFY_CLIENT_SECRET, force_refresh:bool=False):
+    """
+    Retrieves a Spotify access token.
+    The token is cached in process and, when SPOTIFY_TOKEN_CACHE is set, in that file (owner-only permissions).
+    A new token is only requested when the cached one expires within TOKEN_REFRESH_MARGIN seconds.
+
+    Params:
+        client_id (str): The Spotify Client ID.
+        client_secret (str): The Spotify Client Secret.
+        force_refresh (bool, optional): Ignore the cached token. Defaults to False
+
+    Returns:
+        response_json (Dict(str, str, int)): A dictionary containing:
+            - access_token (str): The Spotify access token.
+            - token_type (str): The type of authorization token (e.g., "Bearer").
+            - expires_in (int): The token's expiration time in seconds (typically 3600).
+            - expires_at (float): Unix time when the token expires.
+    """
+    global _token
+    with _token_lock:
+        if not force_refresh:
+            if is_token_valid(_token, client_id):
+                return _token
+            cached_token = _read_token_cache()
+            if is_token_valid(cached_token, client_id):
+                logger.info("Use cached spotify token")
+                _token = cached_token
+                return _token
+        token = _request_token(client_id=client_id, client_secret=client_secret)
+        if token is not None:
+            _token = token
+            _write_token_cache(token)
+        return token
+
+def refresh_token(rejected_token:Dict[str,any]=None):
+    """
+    Replaces a token rejected by Spotify. If another thread already replaced it, the new token is reused.
+
+    Params:
+        rejected_token (Dict[str,any], optional): The token that got a 401 response
+
+    Returns:
+        token (Dict[str,any]): A fresh token dictionary
+    """
+    with _token_lock:
+        if rejected_token is not None and is_token_valid(_token) and _token["access_token"] != rejected_token.get("access_token"):
+            return _token
+        return get_token(force_refresh=True)
 
 def get_auth_header(token: Dict[str,any]) -> Dict[str, str]:
     """
-    Retrieves Spotify authorization header
-    
+    Retrieves Spotify authorization header.
+    If the token is about to expire or was already replaced, the header uses the newest token instead.
+
     Params:
         token (Dict[str,any]) : token dictionary from get_token()
-        
+
     Returns:
         authorization_header (Dict(str,str)): Bearer authorization header
 
     """
+    if "expires_at" in token:
+        if _token is not None and _token.get("client_id") == token.get("client_id") and _token["expires_at"] > token["expires_at"]:
+            token = _token
+        elif not is_token_valid(token):
+            token = get_token()
     authorization_header = {"Authorization": f"Bearer {token['access_token']}"}
-    return authorization_header   
\ No newline at end of file
+    return authorization_header
+
+def authorized_get(url:str, token:Dict[str,any]):
+    """
+    Sends an authorized GET request to Spotify. On a 401 response the token is refreshed and the request retried once.
+
+    Params:
+        url (str): Request URL
+        token (Dict[str,any]): token dictionary from get_token()
+
+    Returns:
+        response (requests.Response): Response from Spotify
+    """
+    response = client.get(url=url, headers=get_auth_header(token=token))
+    if response.status_code == 401:
+        logger.warning("Spotify token rejected, refreshing")
+        token = refresh_token(rejected_token=token)
+        if token is not None:
+            response = client.get(url=url, headers=get_auth_header(token=token))
+    return response
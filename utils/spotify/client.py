@@ -0,0 +1,200 @@
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from .. import logger, metrics
+
+load_dotenv(dotenv_path=".env")
+
+#Constants
+POOL_SIZE = int(os.getenv("SPOTIFY_POOL_SIZE", 10))
+REQUEST_TIMEOUT = float(os.getenv("SPOTIFY_REQUEST_TIMEOUT", 10))
+MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", 5))
+BACKOFF_BASE = float(os.getenv("SPOTIFY_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.getenv("SPOTIFY_BACKOFF_MAX", 30))
+RATE_LIMIT_PER_SECOND = float(os.getenv("SPOTIFY_RATE_LIMIT_PER_SECOND", 10))
+RATE_LIMIT_BURST = int(os.getenv("SPOTIFY_RATE_LIMIT_BURST", 10))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+_SPOTIFY_ID_PATTERN = re.compile(r"^[0-9A-Za-z]{22}$")
+
+
+class RateLimitError(Exception):
+    """Raised when Spotify keeps answering 429 after all retries are used"""
+
+
+class TokenBucket:
+    """
+    Thread-safe client-side rate limiter
+
+    Params:
+        rate (float): Number of tokens added per second
+        capacity (int): Maximum number of tokens, i.e. the allowed burst
+    """
+    def __init__(self, rate:float, capacity:int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds:float):
+        """Stop handing out tokens for the given number of seconds, e.g. after a Retry-After"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+_session = None
+_session_lock = threading.Lock()
+_bucket = TokenBucket(rate=RATE_LIMIT_PER_SECOND, capacity=RATE_LIMIT_BURST)
+_stats:Dict[str,Dict[str,int]] = {}
+_stats_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Creates or returns the shared keep-alive session used for every Spotify call."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            logger.info("Created new Spotify HTTP session")
+    return _session
+
+def set_rate_limiter(rate_limiter) -> "TokenBucket":
+    """
+    Replace the client-side rate limiter, e.g. by a budget shared between processes (see pipeline.worker).
+    Any object with acquire() and pause(seconds) works
+
+    Returns:
+        previous (TokenBucket): The rate limiter that was replaced
+    """
+    global _bucket
+    previous, _bucket = _bucket, rate_limiter
+    return previous
+
+def get_endpoint_name(method:str, url:str) -> str:
+    """
+    Normalizes a request URL into an endpoint name used for counters,
+    e.g. "GET /v1/artists/{id}" for any single artist lookup
+    """
+    path = urlparse(url).path
+    segments = ["{id}" if _SPOTIFY_ID_PATTERN.match(segment) else segment for segment in path.split("/")]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+def _count(endpoint:str, key:str, value:int=1):
+    with _stats_lock:
+        counters = _stats.setdefault(endpoint, {"requests":0, "retries":0, "rate_limited":0, "errors":0})
+        counters[key] += value
+
+def _get_backoff(attempt:int, retry_after:str=None) -> float:
+    """Seconds to wait before the next attempt: Retry-After when given, else jittered exponential backoff"""
+    if retry_after is not None:
+        try:
+            return float(retry_after) + random.uniform(0, BACKOFF_BASE)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def request(method:str, url:str, **kwargs) -> requests.Response:
+    """
+    Sends a request through the shared session, respecting the client-side rate limit.
+    429 and 5xx responses as well as connection errors are retried with backoff.
+
+    Params:
+        method (str): HTTP method
+        url (str): Request URL
+        **kwargs: Passed to requests.Session.request
+
+    Returns:
+        response (requests.Response): The last response received
+
+    Raises:
+        RateLimitError: Spotify still answers 429 after MAX_RETRIES retries
+    """
+    endpoint = get_endpoint_name(method, url)
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    session = get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        wait_start_time = time.perf_counter()
+        _bucket.acquire()
+        metrics.increment("http.rate_limiter_wait_seconds", time.perf_counter() - wait_start_time)
+        _count(endpoint, "requests")
+        start_time = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            metrics.observe_http(endpoint, time.perf_counter() - start_time, "error")
+            _count(endpoint, "errors")
+            if attempt == MAX_RETRIES:
+                raise
+            logger.warning(f"{endpoint} failed ({err}), retrying")
+            _count(endpoint, "retries")
+            time.sleep(_get_backoff(attempt))
+            continue
+        metrics.observe_http(endpoint, time.perf_counter() - start_time, response.status_code)
+
+        if response.status_code not in RETRY_STATUS_CODES:
+            return response
+
+        if response.status_code == 429:
+            _count(endpoint, "rate_limited")
+            if attempt == MAX_RETRIES:
+                logger.error(f"Exceed rate limit on {endpoint}")
+                raise RateLimitError(f"Exceed rate limit on {endpoint}")
+            delay = _get_backoff(attempt, response.headers.get("Retry-After"))
+            _bucket.pause(delay)
+        else:
+            _count(endpoint, "errors")
+            if attempt == MAX_RETRIES:
+                return response
+            delay = _get_backoff(attempt)
+        logger.warning(f"{endpoint} returned {response.status_code}, retrying in {delay:.2f}s")
+        _count(endpoint, "retries")
+        metrics.increment("http.retry_wait_seconds", delay)
+        time.sleep(delay)
+    return response
+
+def get(url:str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+def post(url:str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+def get_stats() -> Dict[str,Dict[str,int]]:
+    """
+    Returns a copy of the per-endpoint counters, containing for each endpoint:
+        - requests (int): Number of requests sent, retries included
+        - retries (int): Number of retries
+        - rate_limited (int): Number of 429 responses
+        - errors (int): Number of 5xx responses and connection errors
+    """
+    with _stats_lock:
+        return {endpoint:dict(counters) for endpoint, counters in _stats.items()}
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()